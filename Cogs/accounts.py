@@ -0,0 +1,144 @@
+import logging
+from contextlib import contextmanager
+from database import FieldIndex, ColumnMirror
+
+log = logging.getLogger(__name__)
+
+class Transaction:
+    """Changes to several accounts that are written back in one go, see Accounts.transaction()."""
+
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.documents = {}
+        self.originals = {}
+
+
+    def get(self, user):
+        """A changeable copy of _user_'s account, or None if they haven't been added yet. Repeated calls return the same copy."""
+
+        if user not in self.documents:
+            document = self.accounts.get(user)
+
+            if document is None:
+                return None
+
+            # Copy lists too (e.g. horse_bets), so changes never leak into the database before commit
+            self.originals[user] = {key: list(value) if isinstance(value, list) else value for key, value in document.items()}
+            self.documents[user] = {key: list(value) if isinstance(value, list) else value for key, value in document.items()}
+
+        return self.documents[user]
+
+
+    def commit(self):
+        changed = [user for user, document in self.documents.items() if document != self.originals[user]]
+
+        if changed:
+            self.accounts.main_db.write_back([self.documents[user] for user in changed], [self.accounts.doc_id(user) for user in changed])
+
+        self.originals = {user: dict(document) for user, document in self.documents.items()}
+
+
+class Accounts:
+    """Access to user accounts in main_db by username. Uses a hash index instead of scanning the table with a query.
+
+    _columns_ mirrors the numeric account fields for leaderboards and ranks, see ColumnMirror.
+    """
+
+    def __init__(self, main_db, database):
+        self.main_db = main_db
+        self.database = database
+        self.index = FieldIndex(main_db, 'user')
+        self.columns = ColumnMirror(main_db, 'user')
+
+
+    def rebuild(self):
+        self.index.rebuild()
+        self.columns.rebuild()
+
+
+    def doc_id(self, user):
+        return self.index.get(user)
+
+
+    def contains(self, user):
+        return self.index.get(user) is not None
+
+
+    def get(self, user):
+        """The account of _user_, or None if they haven't been added yet."""
+
+        doc_id = self.index.get(user)
+
+        if doc_id is None:
+            return None
+
+        return self.main_db.get(doc_id=doc_id)
+
+
+    def update(self, fields, user):
+        """Update the account of _user_. _fields_ may be a dict or a tinydb operation, as with Table.update."""
+
+        doc_id = self.index.get(user)
+
+        if doc_id is None:
+            return []
+
+        return self.main_db.update(fields, doc_ids=[doc_id])
+
+
+    def users(self):
+        return list(self.index.doc_ids)
+
+
+    def rank(self, user, field):
+        """(rank, value) of _user_ among all users by _field_ (1 being the highest), or None for unknown users or fields."""
+
+        doc_id = self.index.get(user)
+
+        if doc_id is None:
+            return None
+
+        return self.columns.rank(field, doc_id)
+
+
+    @contextmanager
+    def transaction(self):
+        """Read and change several accounts at once:
+
+            with accounts.transaction() as transaction:
+                donor = transaction.get(donor_name)
+                donor['balance'] -= amount
+                ...
+
+        All changed accounts are written back together when the with block ends. Other database writes inside the block
+        become part of the same commit. If anything inside the block raises, nothing is written, and trivia changes
+        made inside the block are undone (see Trivia).
+        Note: Don't await inside the block.
+        """
+
+        transaction = Transaction(self)
+
+        with self.database.batch():
+            yield transaction
+            transaction.commit()
+
+
+    def update_all(self, function):
+        """Call _function_ with every account (a copy, to be changed in place) in a single pass over main_db and write back
+        all changed accounts at once. Returns the number of changed accounts.
+        """
+
+        accounts = self.main_db.all()
+        changed = []
+
+        for account in accounts:
+            original = dict(account)
+            function(account)
+
+            if account != original:
+                changed.append(account)
+
+        if changed:
+            self.main_db.write_back(changed)
+
+        return len(changed)
@@ -28,15 +28,19 @@ class BaseCog(commands.Cog):
         return None
 
 
-    def extend_trivia_table(self, trivia_table):
+    def extend_trivia_table(self, trivia):
         pass
 
 
-    def extend_trivia_output(self, trivia_table):
+    def extend_trivia_output(self, trivia):
         return None
 
 
-    def extend_season_output(self, number, season_trivia_table, season_main_db, season_tables):
+    def extend_season_summary(self, season_trivia_table, season_main_db, summary):
+        pass
+
+
+    def extend_season_output(self, number, summary):
         return None
 
 
@@ -50,34 +54,55 @@ class BaseCog(commands.Cog):
 
     async def on_season_end(self):
         pass
+
+
+    def prepare_daily_reset(self):
+        pass
+
+
+    def extend_daily_reset(self, account):
+        pass
+
+
+    def on_shutdown(self):
+        pass
     #==============================================
 
 
+    def cog_unload(self):
+        """Make sure no cached database writes are lost when a cog is unloaded."""
+
+        try:
+            self.bot.database.flush()
+        except Exception as e:
+            log.exception(e)
+
+
     def map_user(self, user):
         """Map user shortcuts to actual usernames as they appear in the database."""
 
-        user_lower = user.lower()
-        found = False
-
         try:
             economy_cog = BaseCog.load_dependency(self, 'Economy')
-            core_cog = BaseCog.load_dependency(self, 'Core')
         except DependencyLoadError:
             return user
 
-        for item in economy_cog.main_db:
-            if user_lower == item['user'].lower():
-                user = item['user']
-                found = True
-                break
+        return economy_cog.resolver.resolve(user)
+
 
-        if not found:
-            for s, u in core_cog.shortcuts.items():
-                if user_lower == s.lower():
-                    user = u
-                    break
+    def suggest_users(self, user):
+        """A ' Did you mean ...?' hint for error messages about the unknown user _user_, or an empty string."""
 
-        return user
+        try:
+            economy_cog = BaseCog.load_dependency(self, 'Economy')
+        except DependencyLoadError:
+            return ''
+
+        suggestions = economy_cog.resolver.suggest(user)
+
+        if not suggestions:
+            return ''
+
+        return ' Did you mean ' + ', '.join(suggestions[:-1]) + (' or ' if len(suggestions) > 1 else '') + suggestions[-1] + '?'
 
     #========= COMMON CHECKS =========
 
@@ -86,6 +111,11 @@ class BaseCog(commands.Cog):
             raise commands.CheckFailure(message='')
 
 
+    def check_game_channel(self, ctx):
+        if not (ctx.message.channel == self.bot.bot_channel or ctx.message.channel.id in config.game_channel_ids):
+            raise commands.CheckFailure(message='')
+
+
     def check_admin(self, ctx):
         if ctx.message.author.name not in config.admins:
             raise commands.CheckFailure(message='Permission denied. Your roles are insufficient to use this specific command.')
@@ -108,7 +138,7 @@ class BaseCog(commands.Cog):
             await self.bot.post_error(ctx, 'Oh no, something went wrong (DNL). ' + config.additional_error_message)
             return
 
-        if not economy_cog.main_db.contains(self.bot.query.user == ctx.message.author.name):
+        if not economy_cog.accounts.contains(ctx.message.author.name):
             await economy_cog.add_internal(ctx.message.author.name)
 
     #==================================
@@ -2,32 +2,48 @@ import logging
 import json
 import discord
 from discord.ext import commands
-from tinydb.operations import increment
 from tinydb.operations import subtract
 from collections import defaultdict
 from operator import itemgetter
 import math
-import datetime
 import asyncio
 import random
 from os import linesep
 from .base_cog import BaseCog
 from conf import config
-from dependency_load_error import DependencyLoadError
+from game_session import GameSession
 
 log = logging.getLogger(__name__)
 
+
+class BattleRoyaleSession(GameSession):
+    """A battle royale: its fighters, the entry fee (_bet_) and the prize pool. _holiday_points_used_ holds the holiday points each
+    fighter paid the entry fee with, in the order of _participants_.
+    """
+
+    game = 'battleroyale'
+    title = 'Battle royale'
+    exclusive = True # The kill feed may be edited live
+
+    def __init__(self, bot, channel, bet):
+        GameSession.__init__(self, bot, channel)
+        self.participants = []
+        self.holiday_points_used = []
+        self.pool = 0
+        self.bet = bet
+        self.closed = True
+
+
+    def describe(self):
+        return 'Battle royale with ' + str(len(self.participants)) + ' fighters over ' + str(self.pool) + ' ' + config.currency_name + 's' + ('' if self.closed else ' (open, entry fee ' + str(self.bet) + ')')
+
+
 class BattleRoyale(BaseCog):
     """A cog for the battle royale minigame."""
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
-        self.br_participants = []
-        self.br_holiday_points_used = []
         self.br_last_ann = ''
-        self.br_pool = 0
-        self.br_bet = 0
-        self.br_closed = True
 
         with open(config.cogs_data_path + '/gambling.json', 'r') as gambling_config:
             data = json.load(gambling_config)
@@ -45,6 +61,13 @@ class BattleRoyale(BaseCog):
         self.p_bomb_or_melee = float(config.get('BattleRoyale', 'p_bomb_or_melee', fallback=0.15))
         self.p_exotic = float(config.get('BattleRoyale', 'p_exotic', fallback=0.05))
 
+        # How kills are posted: 'round' (one message per round), 'live' (one message, edited every round) or 'event' (one message per kill)
+        self.kill_feed = config.get('BattleRoyale', 'kill_feed', fallback='round')
+        self.kill_feed_per_event_up_to = int(config.get('BattleRoyale', 'kill_feed_per_event_up_to', fallback='0'))
+
+        if self.kill_feed not in ('round', 'live', 'event'):
+            raise RuntimeError('Unknown kill_feed ' + self.kill_feed + ', use round, live or event!')
+
         if (self.br_min_users < 3):
             raise RuntimeError('Minimum number of BR participants is 3!')
 
@@ -65,19 +88,19 @@ class BattleRoyale(BaseCog):
         return result_string
 
 
-    def extend_trivia_table(self, trivia_table):
-        trivia_table.insert({'name': 'highest_br_pool', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'largest_br', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'amnt_brs', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'most_br_score', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'longest_streak', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
+    def extend_trivia_table(self, trivia):
+        trivia.add('highest_br_pool')
+        trivia.add('largest_br')
+        trivia.add('amnt_brs')
+        trivia.add('most_br_score')
+        trivia.add('longest_streak')
 
 
-    def extend_trivia_output(self, trivia_table):
+    def extend_trivia_output(self, trivia):
         result = ''
 
         try:
-            amnt_brs = trivia_table.get(self.bot.query.name == 'amnt_brs')
+            amnt_brs = trivia.get('amnt_brs')
 
             if amnt_brs['value'] > 0:
                 result += 'Total amount of battle royales fought'.ljust(config.trivia_ljust) + '  ' + str(amnt_brs['value']) + linesep
@@ -85,7 +108,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            highest_br_pool = trivia_table.get(self.bot.query.name == 'highest_br_pool')
+            highest_br_pool = trivia.get('highest_br_pool')
 
             if highest_br_pool['person1'] != '':
                 result += 'Highest battle royale prize pool'.ljust(config.trivia_ljust) + '  ' + str(highest_br_pool['value']) + ' won by ' + highest_br_pool['person1'] + ' with score ' + str(highest_br_pool['person2']) + ' on ' + highest_br_pool['date'] + linesep
@@ -93,7 +116,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            largest_br = trivia_table.get(self.bot.query.name == 'largest_br')
+            largest_br = trivia.get('largest_br')
 
             if largest_br['person1'] != '':
                 result += 'Most participants in a battle royale'.ljust(config.trivia_ljust) + '  ' + str(largest_br['value']) + ' won by ' + largest_br['person1'] + ' with score ' + str(largest_br['person2']) + ' on ' + largest_br['date'] + linesep
@@ -101,7 +124,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            most_kills = trivia_table.get(self.bot.query.name == 'most_br_score')
+            most_kills = trivia.get('most_br_score')
 
             if most_kills['person1'] != '':
                 result += 'Highest score in a battle royale'.ljust(config.trivia_ljust) + '  ' + str(most_kills['value']) + ' by ' + most_kills['person1'] + ' (won by ' + most_kills['person2'] + ') on ' + most_kills['date'] + linesep
@@ -109,7 +132,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            longest_streak = trivia_table.get(self.bot.query.name == 'longest_streak')
+            longest_streak = trivia.get('longest_streak')
 
             if longest_streak['person1'] != '':
                 result += 'Longest kill streak in a battle royale'.ljust(config.trivia_ljust) + '  ' + str(longest_streak['value']) + ' by ' + longest_streak['person1'] + ' (won by ' + longest_streak['person2'] + ') on ' + longest_streak['date'] + linesep + linesep
@@ -119,11 +142,11 @@ class BattleRoyale(BaseCog):
         return result
 
 
-    def extend_season_output(self, number, season_trivia_table, season_main_db, season_tables):
+    def extend_season_output(self, number, summary):
         result = ''
 
         try:
-            amnt_brs = season_trivia_table.get(self.bot.query.name == 'amnt_brs')
+            amnt_brs = summary['trivia'].get('amnt_brs')
 
             if amnt_brs['value'] > 0:
                 result += 'Total amount of battle royales fought'.ljust(config.season_ljust) + '  ' + str(amnt_brs['value']) + linesep
@@ -131,7 +154,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            highest_br_pool = season_trivia_table.get(self.bot.query.name == 'highest_br_pool')
+            highest_br_pool = summary['trivia'].get('highest_br_pool')
 
             if highest_br_pool['person1'] != '':
                 result += 'Highest battle royale prize pool'.ljust(config.season_ljust) + '  ' + str(highest_br_pool['value']) + ' won by ' + highest_br_pool['person1'] + ' with score ' + str(highest_br_pool['person2']) + ' on ' + highest_br_pool['date'] + linesep
@@ -139,7 +162,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            largest_br = season_trivia_table.get(self.bot.query.name == 'largest_br')
+            largest_br = summary['trivia'].get('largest_br')
 
             if largest_br['person1'] != '':
                 result += 'Most participants in a battle royale'.ljust(config.season_ljust) + '  ' + str(largest_br['value']) + ' won by ' + largest_br['person1'] + ' with score ' + str(largest_br['person2']) + ' on ' + largest_br['date'] + linesep + linesep
@@ -147,7 +170,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            most_kills = season_trivia_table.get(self.bot.query.name == 'most_br_score')
+            most_kills = summary['trivia'].get('most_br_score')
 
             if most_kills['person1'] != '':
                 result += 'Highest score in a battle royale'.ljust(config.season_ljust) + '  ' + str(most_kills['value']) + ' by ' + most_kills['person1'] + ' (won by ' + most_kills['person2'] + ') on ' + most_kills['date'] + linesep
@@ -155,7 +178,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            most_brs = max(season_main_db.all(), key=itemgetter('brs'))
+            most_brs = summary['most']['brs']
 
             if most_brs['brs'] > 0:
                 result += 'Most battle royales fought'.ljust(config.season_ljust) + '  ' + str(most_brs['brs']) + ' by ' + most_brs['user'] + linesep
@@ -163,7 +186,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            most_br_wins = max(season_main_db.all(), key=itemgetter('br_wins'))
+            most_br_wins = summary['most']['br_wins']
 
             if most_br_wins['br_wins'] > 0:
                 result += 'Most battle royale wins'.ljust(config.season_ljust) + '  ' + str(most_br_wins['br_wins']) + ' by ' + most_br_wins['user'] + linesep
@@ -171,7 +194,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            most_br_score = max(season_main_db.all(), key=itemgetter('br_score'))
+            most_br_score = summary['most']['br_score']
 
             if most_br_score['br_score'] > 0:
                 result += 'Highest total battle royale score'.ljust(config.season_ljust) + '  ' + str(most_br_score['br_score']) + ' by ' + most_br_score['user'] + linesep
@@ -179,7 +202,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            highest_br_winnings = max(season_main_db.all(), key=itemgetter('br_winnings'))
+            highest_br_winnings = summary['most']['br_winnings']
 
             if highest_br_winnings['br_winnings'] > 0:
                 result += ('Most ' + config.currency_name + ' winnings in battle royale').ljust(config.season_ljust) + '  ' + str(highest_br_winnings['br_winnings']) + ' by ' + highest_br_winnings['user'] + linesep
@@ -187,7 +210,7 @@ class BattleRoyale(BaseCog):
             pass
 
         try:
-            longest_streak = season_trivia_table.get(self.bot.query.name == 'longest_streak')
+            longest_streak = summary['trivia'].get('longest_streak')
 
             if longest_streak['person1'] != '':
                 result += 'Longest kill streak in a battle royale'.ljust(config.season_ljust) + '  ' + str(longest_streak['value']) + ' by ' + longest_streak['person1'] + ' (won by ' + longest_streak['person2'] + ') on ' + longest_streak['date'] + linesep + linesep
@@ -228,33 +251,64 @@ class BattleRoyale(BaseCog):
     #==============================================
 
 
+    async def post_kill_feed(self, session, feed, events, amnt_left):
+        """Post the _events_ (kills, blocks and suicides) of one round of the battle royale _session_, as set up in _feed_.
+
+        Except for the 'event' mode, which posts every event on its own, this takes at most one send (or edit) per round, however many
+        fighters take part. The live message is continued in a new one once it would exceed Discord's 2000 character limit.
+        """
+
+        if feed['mode'] == 'event':
+            for event in events:
+                await session.post('**[BATTLE ROYALE]** ' + event)
+
+            return
+
+        feed['round'] += 1
+        text = '**[BATTLE ROYALE]** Round ' + str(feed['round']) + ' (' + str(amnt_left) + ' left)' + linesep + linesep.join(events)
+
+        if feed['mode'] == 'round':
+            await session.post(text)
+            return
+
+        if feed['message'] is not None and len(feed['text']) + len(linesep * 2) + len(text) <= 2000:
+            try:
+                feed['text'] += linesep * 2 + text
+                await feed['message'].edit(content=feed['text'])
+                return
+            except discord.errors.HTTPException as e:
+                log.exception(e)
+
+        feed['text'] = text
+        feed['message'] = await session.post(text, coalesce=False)
+
+
     @commands.command()
     async def joinbr(self, context):
         """Joins the battle royale with an entry fee."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
         await BaseCog.dynamic_user_add(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
-        stats = BaseCog.load_dependency(self, 'Stats')
-        trivia_table = stats.trivia_table
+        accounts = economy.accounts
         gambling = BaseCog.load_dependency(self, 'Gambling')
         weapon_emotes = gambling.weapon_emotes
 
-        is_participating = context.message.author.name in self.br_participants
+        session = self.bot.sessions.get('battleroyale', context.message.channel)
+        is_participating = session is not None and context.message.author.name in session.participants
 
         try:
-            pukcab_pool = self.br_pool
+            pukcab_pool = session.pool if session is not None else 0
 
-            if self.br_closed:
+            if session is None or session.closed:
                 await self.bot.post_error(context, 'You are too late to join the recent battle royale, ' + context.message.author.name + '. Start a new one with !battleroyale <bet> if you are so eager to fight.')
-            elif context.message.author.name in self.br_participants:
+            elif context.message.author.name in session.participants:
                 await self.bot.post_error(context, 'You are already taking part in this battle royale, ' + context.message.author.name + '.')
             else:
-                user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
+                user_balance = accounts.get(context.message.author.name)['balance']
 
                 # Check if battle royale is today's minigame for holiday points
                 holidays = self.bot.get_cog('Holidays')
@@ -264,42 +318,42 @@ class BattleRoyale(BaseCog):
                 if holidays is not None:
                     if holidays.holiday_minigame.contains(self.bot.query.minigame == 'Battle Royale'):
                         is_holiday_minigame = True
-                        holiday = main_db.get(self.bot.query.user == context.message.author.name)['holiday']
+                        holiday = accounts.get(context.message.author.name)['holiday']
 
-                if user_balance + holiday >= self.br_bet:
-                    self.br_participants.append(context.message.author.name)
-                    self.br_pool += self.br_bet
+                if user_balance + holiday >= session.bet:
+                    session.participants.append(context.message.author.name)
+                    session.pool += session.bet
 
                     # Remove entry fee
                     if holiday > 0:
-                        leftover = self.br_bet - holiday
+                        leftover = session.bet - holiday
 
                         if leftover > 0: # i.e. br bet > holiday points
-                            main_db.update(subtract('holiday', holiday), self.bot.query.user == context.message.author.name)
-                            self.br_holiday_points_used.append(holiday)
-                            main_db.update(subtract('balance', leftover), self.bot.query.user == context.message.author.name)
-                            main_db.update(subtract('gambling_profit', leftover), self.bot.query.user == context.message.author.name)
+                            accounts.update(subtract('holiday', holiday), context.message.author.name)
+                            session.holiday_points_used.append(holiday)
+                            accounts.update(subtract('balance', leftover), context.message.author.name)
+                            accounts.update(subtract('gambling_profit', leftover), context.message.author.name)
                         else: # Note: holiday points do not count as negative gambling profit
-                            main_db.update(subtract('holiday', self.br_bet), self.bot.query.user == context.message.author.name)
-                            self.br_holiday_points_used.append(self.br_bet)
+                            accounts.update(subtract('holiday', session.bet), context.message.author.name)
+                            session.holiday_points_used.append(session.bet)
                     else:
-                        main_db.update(subtract('balance', self.br_bet), self.bot.query.user == context.message.author.name)
-                        main_db.update(subtract('gambling_profit', self.br_bet), self.bot.query.user == context.message.author.name)
-                        self.br_holiday_points_used.append(0)
+                        accounts.update(subtract('balance', session.bet), context.message.author.name)
+                        accounts.update(subtract('gambling_profit', session.bet), context.message.author.name)
+                        session.holiday_points_used.append(0)
 
-                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** ' + context.message.author.name + ' has joined the challengers! The prize pool is now at ' + str(self.br_pool) + ' ' + config.currency_name + 's.')
+                    await session.post('**[BATTLE ROYALE]** ' + context.message.author.name + ' has joined the challengers! The prize pool is now at ' + str(session.pool) + ' ' + config.currency_name + 's.')
                 else:
-                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. The entry fee is ' + str(self.br_bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
+                    await session.post('**[BATTLE ROYALE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. The entry fee is ' + str(session.bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
         except Exception as e:
             try:
-                if (context.message.author.name in self.br_participants) and not is_participating:
-                    self.br_participants.pop()
+                if (context.message.author.name in session.participants) and not is_participating:
+                    session.participants.pop()
 
                     # Careful: We might have crashed before even adding the used holiday points, so can't always pop!
-                    if len(self.br_participants) < len(self.br_holiday_points_used):
-                        self.br_holiday_points_used.pop()
+                    if len(session.participants) < len(session.holiday_points_used):
+                        session.holiday_points_used.pop()
 
-                self.br_pool = pukcab_pool
+                session.pool = pukcab_pool
                 await self.bot.post_error(context, 'Oh no, something went wrong (you are not part of the challengers).', config.additional_error_message)
                 log.exception(e)
             except Exception as e2:
@@ -312,25 +366,18 @@ class BattleRoyale(BaseCog):
         """Starts a battle royale with a forced bet of _bet_ points."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
         await BaseCog.dynamic_user_add(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+        accounts = economy.accounts
         stats = BaseCog.load_dependency(self, 'Stats')
-        trivia_table = stats.trivia_table
+        trivia = stats.trivia
         gambling = BaseCog.load_dependency(self, 'Gambling')
         weapon_emotes = gambling.weapon_emotes
 
-        race_participants = None
-
-        try:
-            horserace = BaseCog.load_dependency(self, 'Horserace')
-            race_participants = horserace.race_participants
-        except DependencyLoadError:
-            # If horse race cog is not available, shouldn't exit with error
-            pass
+        session = None
 
         try:
             if not bet:
@@ -343,16 +390,21 @@ class BattleRoyale(BaseCog):
                 await self.bot.post_error(context, 'Bet must be an integer.')
                 return
 
-            if self.br_bet != 0:
-                await self.bot.post_error(context, 'Not so hasty, courageous fighter. There is already a battle royale in progress.')
+            # Any number of battle royales can be fought at once, but only one game with animated messages per channel
+            session = BattleRoyaleSession(self.bot, context.message.channel, bet)
+            blocking = self.bot.sessions.blocking(session)
+
+            if blocking is not None and blocking.game == 'battleroyale':
+                await self.bot.post_error(context, 'Not so hasty, courageous fighter. There is already a battle royale in progress in this channel.')
+                return
+            elif blocking is not None:
+                await self.bot.post_error(context, 'Sorry ' + context.message.author.name + ', please wait for the ongoing ' + blocking.title.lower() + ' in this channel to end so that the messages don\'t interfere.')
                 return
-            elif race_participants is not None and len(race_participants) > 0:
-                await self.bot.post_error(context, 'Sorry ' + context.message.author.name + ', please wait for the ongoing horse race to end so that the messages don\'t interfere.')
             elif bet < self.br_min_bet:
                 await self.bot.post_error(context, '!battleroyale requires the initial forced bet to be at least ' + str(self.br_min_bet) + ' ' + config.currency_name + 's.')
                 return
             else:
-                user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
+                user_balance = accounts.get(context.message.author.name)['balance']
 
                 # Check if battle royale is today's minigame for holiday points
                 holidays = self.bot.get_cog('Holidays')
@@ -362,10 +414,10 @@ class BattleRoyale(BaseCog):
                 if holidays is not None:
                     if holidays.holiday_minigame.contains(self.bot.query.minigame == 'Battle Royale'):
                         is_holiday_minigame = True
-                        holiday = main_db.get(self.bot.query.user == context.message.author.name)['holiday']
+                        holiday = accounts.get(context.message.author.name)['holiday']
 
                 if user_balance + holiday < bet:
-                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. The desired entry fee is ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
+                    await session.post('**[BATTLE ROYALE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. The desired entry fee is ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
                     return
 
                 lock = True
@@ -379,82 +431,82 @@ class BattleRoyale(BaseCog):
                         await self.bot.post_error(context, 'High-stakes gambling is not allowed. Please stay below ' + str(gambling.lock_max_bet) + ' ' + config.currency_name + 's, ' + context.message.author.name + '. Admins can remove this limit using !unlock.') 
                         return
 
-                self.br_participants.append(context.message.author.name)
-                self.br_pool = bet
-                self.br_bet = bet
+                self.bot.sessions.start(session)
+                session.participants.append(context.message.author.name)
+                session.pool = bet
 
                 if holiday > 0:
                     leftover = bet - holiday
 
                     if leftover > 0: # i.e. br bet > holiday points
-                        main_db.update(subtract('holiday', holiday), self.bot.query.user == context.message.author.name)
-                        self.br_holiday_points_used.append(holiday)
-                        main_db.update(subtract('balance', leftover), self.bot.query.user == context.message.author.name)
-                        main_db.update(subtract('gambling_profit', leftover), self.bot.query.user == context.message.author.name)
+                        accounts.update(subtract('holiday', holiday), context.message.author.name)
+                        session.holiday_points_used.append(holiday)
+                        accounts.update(subtract('balance', leftover), context.message.author.name)
+                        accounts.update(subtract('gambling_profit', leftover), context.message.author.name)
                     else: # Note: holiday points do not count as negative gambling profit
-                        main_db.update(subtract('holiday', bet), self.bot.query.user == context.message.author.name)
-                        self.br_holiday_points_used.append(bet)
+                        accounts.update(subtract('holiday', bet), context.message.author.name)
+                        session.holiday_points_used.append(bet)
                 else:
-                    main_db.update(subtract('balance', bet), self.bot.query.user == context.message.author.name)
-                    main_db.update(subtract('gambling_profit', bet), self.bot.query.user == context.message.author.name)
-                    self.br_holiday_points_used.append(0)
+                    accounts.update(subtract('balance', bet), context.message.author.name)
+                    accounts.update(subtract('gambling_profit', bet), context.message.author.name)
+                    session.holiday_points_used.append(0)
 
                 announcement = self.br_last_ann
 
                 while announcement == self.br_last_ann:
                     announcement = random.choice(self.arena_init_texts).replace('[USER]', context.message.author.name)
 
-                await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** ' + announcement)
-                await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** Type !joinbr (entry fee is ' + str(bet) + ') to join the ranks of the challengers.')
+                await session.post('**[BATTLE ROYALE]** ' + announcement)
+                await session.post('**[BATTLE ROYALE]** Type !joinbr (entry fee is ' + str(bet) + ') to join the ranks of the challengers.')
                 self.br_last_ann = announcement
-                self.br_closed = False
+                session.closed = False
                 amount_asked = 0
 
-                while len(self.br_participants) < self.br_min_users and amount_asked < 3:
+                while len(session.participants) < self.br_min_users and amount_asked < 3:
                     if self.br_delay <= 60:
                         await asyncio.sleep(self.br_delay) # during this time, people can use commands to join
                     else:
                         await asyncio.sleep(self.br_delay-60) # during this time, people can use commands to join
-                        await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** Battle royale will start in 1 minute. Type !joinbr to take part!')
+                        await session.post('**[BATTLE ROYALE]** Battle royale will start in 1 minute. Type !joinbr to take part!')
                         await asyncio.sleep(30) # during this time, people can use commands to join
-                        await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** Battle royale will start in 30 seconds. Type !joinbr to take part!')
+                        await session.post('**[BATTLE ROYALE]** Battle royale will start in 30 seconds. Type !joinbr to take part!')
                         await asyncio.sleep(30) # during this time, people can use commands to join
 
-                    if len(self.br_participants) < self.br_min_users:
-                        await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** Waiting for more people to join the bloodshed (min ' + str(self.br_min_users) + ' participants).')
+                    if len(session.participants) < self.br_min_users:
+                        await session.post('**[BATTLE ROYALE]** Waiting for more people to join the bloodshed (min ' + str(self.br_min_users) + ' participants).')
 
                     amount_asked += 1
 
-                self.br_closed = True
+                session.closed = True
 
-                if len(self.br_participants) < self.br_min_users:
-                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** The battle royale has been canceled due to a lack of interest in the bloodshed. Cowards! (min ' + str(self.br_min_users) + ' participants).')
-                    for i, p in enumerate(self.br_participants):
+                if len(session.participants) < self.br_min_users:
+                    await session.post('**[BATTLE ROYALE]** The battle royale has been canceled due to a lack of interest in the bloodshed. Cowards! (min ' + str(self.br_min_users) + ' participants).')
+                    for i, p in enumerate(session.participants):
                         try:
-                            balance_p = main_db.get(self.bot.query.user == p)['balance']
-                            gambling_pr = main_db.get(self.bot.query.user == p)['gambling_profit']
-                            main_db.update({'gambling_profit': gambling_pr + (self.br_bet - self.br_holiday_points_used[i])}, self.bot.query.user == p)
-                            if self.br_holiday_points_used[i] > 0:
-                                holiday_p = main_db.get(self.bot.query.user == p)['holiday']
-                                main_db.update({'holiday': holiday_p + self.br_holiday_points_used[i]}, self.bot.query.user == p)
-                                main_db.update({'balance': balance_p + self.br_bet - self.br_holiday_points_used[i]}, self.bot.query.user == p)
+                            balance_p = accounts.get(p)['balance']
+                            gambling_pr = accounts.get(p)['gambling_profit']
+                            accounts.update({'gambling_profit': gambling_pr + (session.bet - session.holiday_points_used[i])}, p)
+                            if session.holiday_points_used[i] > 0:
+                                holiday_p = accounts.get(p)['holiday']
+                                accounts.update({'holiday': holiday_p + session.holiday_points_used[i]}, p)
+                                accounts.update({'balance': balance_p + session.bet - session.holiday_points_used[i]}, p)
                             else:
-                                main_db.update({'balance': balance_p + self.br_bet}, self.bot.query.user == p)
+                                accounts.update({'balance': balance_p + session.bet}, p)
                         except Exception as e:
                             await self.bot.post_error(context, 'Could not refund bet to ' + context.message.author.name + '.', config.additional_error_message)
                             log.exception(e)
                 else:
-                    # _self.br_participants_ is now filled with usernames
-                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** Ladies and gentlemen, the battle royale is about to begin. ' + str(len(self.br_participants)) + ' brave fighters have stepped into the arena after ' + context.message.author.name + ' called for a grand battle. They fight over ' + str(self.br_pool) + ' ' + config.currency_name + 's. Additionally, at least 1 ' + config.currency_name + ' is granted for each kill on the field. Good luck! :drum:')
+                    # _session.participants_ is now filled with usernames
+                    await session.post('**[BATTLE ROYALE]** Ladies and gentlemen, the battle royale is about to begin. ' + str(len(session.participants)) + ' brave fighters have stepped into the arena after ' + context.message.author.name + ' called for a grand battle. They fight over ' + str(session.pool) + ' ' + config.currency_name + 's. Additionally, at least 1 ' + config.currency_name + ' is granted for each kill on the field. Good luck! :drum:')
 
-                    dim_participants = self.br_participants[:]
+                    dim_participants = session.participants[:]
                     kill_map = defaultdict(int)
                     time_intervals = [10, 12, 14, 16, 18, 20]
                     weapons = {}
                     last_killer = ''
                     streak = 0
 
-                    for p in self.br_participants:
+                    for p in session.participants:
                         if p in self.custom_weapons:
                             weapons[p] = self.custom_weapons[p]
                         else:
@@ -467,8 +519,15 @@ class BattleRoyale(BaseCog):
                     local_longest_streak = 0
                     local_longest_streak_user = None
 
+                    # Small games may keep posting every kill on its own
+                    if len(session.participants) <= self.kill_feed_per_event_up_to:
+                        feed = {'mode': 'event'}
+                    else:
+                        feed = {'mode': self.kill_feed, 'round': 0, 'message': None, 'text': ''}
+
                     while len(dim_participants) > 1:
                         await asyncio.sleep(random.choice(time_intervals))
+                        events = []
 
                         if len(dim_participants) > 3:
                             max_killed = math.ceil(len(dim_participants)/3)
@@ -500,10 +559,10 @@ class BattleRoyale(BaseCog):
 
                             if event < p_suicide:
                                 if killed in self.custom_suicides:
-                                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** ' + killed + ' ' + self.custom_suicides[killed])
+                                    events.append(killed + ' ' + self.custom_suicides[killed])
                                 else:
                                     suicide_emote = random.choice(self.suicide_emotes)
-                                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** ' + killed + ' ' + suicide_emote + ' ' + killed)
+                                    events.append(killed + ' ' + suicide_emote + ' ' + killed)
 
                                 killed = dim_participants.pop(dim_participants.index(killed))
                                 continue
@@ -552,131 +611,85 @@ class BattleRoyale(BaseCog):
                                     streak = 1
                                     last_killer = killer
 
-                                result = '**[BATTLE ROYALE]** ' + killer + ' ' + weapon + ' ' + killed
+                                result = killer + ' ' + weapon + ' ' + killed
 
                                 for note in notes:
                                     result += ' *(' + note + ')*'
 
-                                await self.bot.post_message(self.bot.bot_channel, result)
+                                events.append(result)
                             else:
-                                await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** ' + killer + ' :shield: ' + killed)
+                                events.append(killer + ' :shield: ' + killed)
+
+                        await self.post_kill_feed(session, feed, events, len(dim_participants))
 
-                    await self.bot.post_message(self.bot.bot_channel, '**[BATTLE ROYALE]** :confetti_ball: :confetti_ball: :confetti_ball: ' + dim_participants[0] + ' wins, taking home the pool of ' + str(self.br_pool) + ' ' + config.currency_name + 's! :confetti_ball: :confetti_ball: :confetti_ball:')
+                    await session.post('**[BATTLE ROYALE]** :confetti_ball: :confetti_ball: :confetti_ball: ' + dim_participants[0] + ' wins, taking home the pool of ' + str(session.pool) + ' ' + config.currency_name + 's! :confetti_ball: :confetti_ball: :confetti_ball:')
 
                     result = '```Scoreboard ' + linesep + linesep
 
-                    indent = max(len(p) for p in self.br_participants)
+                    indent = max(len(p) for p in session.participants)
 
                     ctr = 1
-                    kill_map[dim_participants[0]] += self.br_pool
+                    kill_map[dim_participants[0]] += session.pool
 
                     for p, k in sorted(kill_map.items(), key=itemgetter(1), reverse=True):
                         result += p.ljust(indent) + '   ' + str(k) + linesep
                         ctr += 1
 
-                    for p in self.br_participants:
+                    for p in session.participants:
                         if p not in kill_map:
                             result += p.ljust(indent) + '   0' + linesep
                             ctr += 1
 
                     result += '```'
-                    await self.bot.post_message(self.bot.bot_channel, result)
-                    kill_map[dim_participants[0]] -= self.br_pool
+                    await session.post(result)
+                    kill_map[dim_participants[0]] -= session.pool
 
-                    # Update winner balance
+                    # Pay out the pool and kills and update stats. Everything is written together, or not at all if anything fails.
                     try:
-                        balance_first = main_db.get(self.bot.query.user == dim_participants[0])['balance']
-                        main_db.update({'balance': balance_first + self.br_pool}, self.bot.query.user == dim_participants[0])
-                    except Exception as e:
-                        await self.bot.post_error(context, 'Could not update winner\'s balance.', config.additional_error_message)
-                        log.exception(e)
+                        with accounts.transaction() as transaction:
+                            winner = transaction.get(dim_participants[0])
+                            winner['balance'] += session.pool
+                            winner['gambling_profit'] += session.pool
+                            winner['br_winnings'] += session.pool
+                            winner['br_wins'] += 1
 
-                    # Update winner stats
-                    try:
-                        gambling_profit_first = main_db.get(self.bot.query.user == dim_participants[0])['gambling_profit']
-                        main_db.update({'gambling_profit': gambling_profit_first + self.br_pool}, self.bot.query.user == dim_participants[0])
-                        first_total_won = main_db.get(self.bot.query.user == dim_participants[0])['br_winnings']
-                        main_db.update({'br_winnings': first_total_won + self.br_pool}, self.bot.query.user == dim_participants[0])
-                    except Exception as e:
-                        await self.bot.post_error(context, 'Could not update winner\'s gambling stats.', config.additional_error_message)
-                        log.exception(e)
-
-                    # Kills
-                    try:
-                        highest_total_owned = trivia_table.get(self.bot.query.name == 'highest_total_owned')['value']
-
-                        for p in self.br_participants:
-                            amnt_kills = kill_map[p]
+                            new_balances = []
 
-                            if amnt_kills > 0:
-                                try:
-                                    balance = main_db.get(self.bot.query.user == p)['balance']
-                                    main_db.update({'balance': balance + amnt_kills}, self.bot.query.user == p)
-                                except Exception as e:
-                                    await self.bot.post_error(context, 'Could not update balance for user ' + p + '.', config.additional_error_message)
-                                    log.exception(e)
+                            for p in session.participants:
+                                account = transaction.get(p)
+                                account['brs'] += 1
+                                amnt_kills = kill_map[p]
 
-                                gambling_profit = main_db.get(self.bot.query.user == p)['gambling_profit']
-                                main_db.update({'gambling_profit': gambling_profit + amnt_kills}, self.bot.query.user == p)
+                                if amnt_kills > 0:
+                                    account['balance'] += amnt_kills
+                                    account['gambling_profit'] += amnt_kills
 
-                                if amnt_kills > self.br_bet or p == dim_participants[0]:
-                                    total_won = main_db.get(self.bot.query.user == p)['br_winnings']
-                                    main_db.update({'br_winnings': total_won + amnt_kills - self.br_bet}, self.bot.query.user == p)
+                                    if amnt_kills > session.bet or p == dim_participants[0]:
+                                        account['br_winnings'] += amnt_kills - session.bet
 
-                                akills = main_db.get(self.bot.query.user == p)['br_score']
-                                main_db.update({'br_score': akills + amnt_kills}, self.bot.query.user == p)
+                                    account['br_score'] += amnt_kills
+                                    new_balances.append((p, account['balance']))
 
-                                new_balance = balance + amnt_kills
+                        for p, new_balance in new_balances:
+                            trivia.record('highest_total_owned', new_balance, p)
 
-                                if new_balance > highest_total_owned:
-                                    trivia_table.update({'value': new_balance, 'person1': p, 'person2': 'None', 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_total_owned')
-                                    highest_total_owned = new_balance
-                    except Exception as e:
-                        await self.bot.post_error(context, 'Could not update some stats/balances.', config.additional_error_message)
-                        log.exception(e)
-
-                    # Other
-                    try:
                         maxkills = max(kill_map.items(), key=itemgetter(1))
-                        trivia_table.update(increment('value'), self.bot.query.name == 'amnt_brs')
-                        main_db.update(increment('br_wins'), self.bot.query.user == dim_participants[0])
-
-                        highest_br_pool = trivia_table.get(self.bot.query.name == 'highest_br_pool')['value']
-                        largest_br = trivia_table.get(self.bot.query.name == 'largest_br')['value']
-                        most_kills = trivia_table.get(self.bot.query.name == 'most_br_score')['value']
-                        longest_streak = trivia_table.get(self.bot.query.name == 'longest_streak')['value']
-
-                        if maxkills[1] > most_kills:
-                            trivia_table.update({'value': maxkills[1], 'person1': maxkills[0], 'person2': dim_participants[0], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'most_br_score')
-
-                        if self.br_pool > highest_br_pool:
-                            trivia_table.update({'value': self.br_pool, 'person1': dim_participants[0], 'person2': kill_map[dim_participants[0]], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_br_pool')
-
-                        if local_longest_streak > longest_streak:
-                            trivia_table.update({'value': local_longest_streak, 'person1': local_longest_streak_user, 'person2': dim_participants[0], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'longest_streak')
-
-                        if len(self.br_participants) > largest_br:
-                            trivia_table.update({'value': len(self.br_participants), 'person1': dim_participants[0], 'person2': kill_map[dim_participants[0]], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'largest_br')
-                    except Exception as e:
-                        await self.bot.post_error(context, 'Could not update some battle royale stats (only affects !trivia output).', config.additional_error_message)
-                        log.exception(e)
-
-                    try:
-                        for p in self.br_participants:
-                            main_db.update(increment('brs'), self.bot.query.user == p)
+                        trivia.increment('amnt_brs')
+                        trivia.record('most_br_score', maxkills[1], maxkills[0], dim_participants[0])
+                        trivia.record('highest_br_pool', session.pool, dim_participants[0], kill_map[dim_participants[0]])
+                        trivia.record('longest_streak', local_longest_streak, local_longest_streak_user, dim_participants[0])
+                        trivia.record('largest_br', len(session.participants), dim_participants[0], kill_map[dim_participants[0]])
                     except Exception as e:
-                        await self.bot.post_error(context, 'Could not update some battle royale stats (only affects !trivia output).', config.additional_error_message)
+                        await self.bot.post_error(context, 'Could not pay out the battle royale! Nobody has been paid out, please contact an admin.', config.additional_error_message)
                         log.exception(e)
         except Exception as e:
             await self.bot.post_error(context, 'Oh no, something went wrong.', config.additional_error_message)
             log.exception(e)
 
-        # Reset stuff
-        self.br_closed = True
-        self.br_pool = 0
-        self.br_bet = 0
-        self.br_participants = []
-        self.br_holiday_points_used = []
+        # The next battle royale in this channel starts with a session of its own
+        if session is not None:
+            session.closed = True
+            self.bot.sessions.end(session)
 
 
 
@@ -75,9 +75,112 @@ class Core(BaseCog):
         with open(config.cogs_data_path + '/user_shortcuts.json', 'w') as shortcuts_file:
             json.dump(self.shortcuts, shortcuts_file)
 
+        economy_cog = self.bot.get_cog('Economy')
+
+        if economy_cog is not None:
+            economy_cog.resolver.set_shortcuts(self.shortcuts)
+
         await self.bot.post_message(self.bot.bot_channel, context.message.author.name + ' has created a new shortcut \"' + shortcut + '\".')
 
 
+    @commands.command()
+    async def dbstats(self, context):
+        """[ADMINS ONLY] Shows database write statistics."""
+
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_admin(self, context)
+        BaseCog.check_forbidden_characters(self, context)
+
+        result = '```'
+
+        for stats in self.bot.database.all_stats():
+            result += 'Database ' + stats['path'] + ' (' + stats['format'] + ')' + linesep + linesep
+            result += 'Write-behind'.ljust(24) + '  ' + ('on' if stats['write_behind'] else 'off') + linesep
+            result += 'Logical writes'.ljust(24) + '  ' + str(stats['writes']) + linesep
+            result += 'Flushes to disk'.ljust(24) + '  ' + str(stats['flushes']) + linesep
+            result += 'Writes per flush'.ljust(24) + '  ' + '%1.2f' % stats['writes_per_flush'] + linesep
+            result += 'Bytes written'.ljust(24) + '  ' + str(stats['bytes_written']) + linesep
+            result += 'Bytes per logical write'.ljust(24) + '  ' + '%1.0f' % stats['bytes_per_write'] + linesep
+            result += 'Time spent flushing'.ljust(24) + '  ' + '%1.3fs' % stats['flush_time'] + linesep
+            result += 'Pending writes'.ljust(24) + '  ' + str(stats['pending_writes']) + linesep
+            result += 'Write queue depth'.ljust(24) + '  ' + str(stats['queue_depth']) + ' (max. ' + str(stats['max_backlog']) + ')' + linesep
+            result += 'Dirty tables'.ljust(24) + '  ' + (', '.join(stats['dirty_tables']) or '-') + linesep + linesep
+
+            for name, writes in sorted(stats['table_writes'].items()):
+                result += ('Writes to ' + name).ljust(24) + '  ' + str(writes) + linesep
+
+            if 'journal' in stats:
+                journal = stats['journal']
+                result += linesep + 'Journal ' + journal['path'] + linesep + linesep
+                result += 'Records'.ljust(24) + '  ' + str(journal['records']) + linesep
+                result += 'Syncs'.ljust(24) + '  ' + str(journal['syncs']) + linesep
+                result += 'Bytes written'.ljust(24) + '  ' + str(journal['bytes_written']) + linesep
+                result += 'Unsynced records'.ljust(24) + '  ' + str(journal['unsynced_records']) + linesep
+                result += 'Replayed on startup'.ljust(24) + '  ' + str(journal['replayed_records']) + ' in %1.3fs' % journal['replay_time'] + linesep
+
+            result += linesep
+
+        result += '```'
+        await self.bot.post_message(self.bot.bot_channel, result)
+
+
+    @commands.command()
+    async def msgstats(self, context):
+        """[ADMINS ONLY] Shows statistics of the outgoing message queues."""
+
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_admin(self, context)
+        BaseCog.check_forbidden_characters(self, context)
+
+        all_stats = self.bot.outbox.stats()
+
+        if not all_stats:
+            await self.bot.post_message(self.bot.bot_channel, '**[INFO]** No messages have been sent yet.')
+            return
+
+        result = '```'
+
+        for stats in all_stats:
+            result += 'Channel ' + stats['channel'] + linesep + linesep
+            result += 'Queued messages'.ljust(24) + '  ' + str(stats['depth']) + ' (max. ' + str(stats['max_depth']) + ')' + linesep
+            result += 'Messages posted'.ljust(24) + '  ' + str(stats['messages']) + linesep
+            result += 'Sent to Discord'.ljust(24) + '  ' + str(stats['sends']) + linesep
+            result += 'Joined with others'.ljust(24) + '  ' + str(stats['coalesced']) + linesep
+            result += 'Retries'.ljust(24) + '  ' + str(stats['retries']) + ' (' + str(stats['rate_limited']) + ' rate limited)' + linesep
+            result += 'Dropped'.ljust(24) + '  ' + str(stats['dropped']) + linesep
+            result += 'Time spent waiting'.ljust(24) + '  ' + '%1.1fs' % stats['wait_time'] + linesep
+
+            for priority, (messages, average, maximum) in stats['latency'].items():
+                result += ('Latency (' + priority + ')').ljust(24) + '  ' + '%1.2fs avg., %1.2fs max. (%d messages)' % (average, maximum, messages) + linesep
+
+            result += linesep
+
+        result += '```'
+        await self.bot.post_message(self.bot.bot_channel, result)
+
+
+    @commands.command()
+    async def games(self, context):
+        """Shows the games that are running right now."""
+
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_game_channel(self, context)
+        BaseCog.check_forbidden_characters(self, context)
+
+        if not self.bot.sessions:
+            await self.bot.post_message(context.message.channel, '**[INFO]** No games are running right now.')
+            return
+
+        result = '**[INFO]** Running games:' + linesep + linesep
+
+        for session in self.bot.sessions:
+            result += str(session.id) + '  ' + session.describe() + ' in #' + str(session.channel) + linesep
+
+        await self.bot.post_message(context.message.channel, result)
+
+
 
 def setup(bot):
     """Core cog load."""
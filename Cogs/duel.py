@@ -1,26 +1,40 @@
 import logging
 import discord
 from discord.ext import commands
-from tinydb.operations import increment
-from tinydb.operations import subtract
-import datetime
 import asyncio
 import random
-from operator import itemgetter
 from os import linesep
 from .base_cog import BaseCog
 from conf import config
 from dependency_load_error import DependencyLoadError
+from game_session import GameSession
 
 log = logging.getLogger(__name__)
 
+
+class DuelSession(GameSession):
+    """A duel in which _challenger_ has challenged _user_ over _bet_ points."""
+
+    game = 'duel'
+    title = 'Duel'
+
+    def __init__(self, bot, channel, challenger, user, bet):
+        GameSession.__init__(self, bot, channel)
+        self.challenger = challenger
+        self.user = user
+        self.bet = bet
+        self.accepted = False
+
+
+    def describe(self):
+        return 'Duel between ' + self.challenger + ' and ' + self.user + ' over ' + str(self.bet) + ' ' + config.currency_name + 's' + ('' if self.accepted else ' (not accepted yet)')
+
+
 class Duel(BaseCog):
     """A cog for the duel minigame."""
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
-        self.duels = {}
-        self.duel_ctr = 0
         self.duel_delay = int(config.get('Duel', 'duel_delay', fallback=120))
         self.duel_battle_delay = int(config.get('Duel', 'duel_battle_delay', fallback=10))
 
@@ -34,16 +48,16 @@ class Duel(BaseCog):
         return result_string
 
 
-    def extend_trivia_table(self, trivia_table):
-        trivia_table.insert({'name': 'highest_duel', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'amnt_duels', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
+    def extend_trivia_table(self, trivia):
+        trivia.add('highest_duel')
+        trivia.add('amnt_duels')
 
 
-    def extend_trivia_output(self, trivia_table):
+    def extend_trivia_output(self, trivia):
         result = linesep
 
         try:
-            amnt_duels = trivia_table.get(self.bot.query.name == 'amnt_duels')
+            amnt_duels = trivia.get('amnt_duels')
 
             if amnt_duels['value'] > 0:
                 result += 'Total amount of duels fought'.ljust(config.trivia_ljust) + '  ' + str(amnt_duels['value']) + linesep
@@ -51,7 +65,7 @@ class Duel(BaseCog):
             pass
 
         try:
-            highest_duel = trivia_table.get(self.bot.query.name == 'highest_duel')
+            highest_duel = trivia.get('highest_duel')
 
             if highest_duel['person1'] != '':
                 result += 'Highest duel'.ljust(config.trivia_ljust) + '  ' + str(highest_duel['value']) + ' won by ' + highest_duel['person1'] + ' against ' + highest_duel['person2'] + ' on ' + highest_duel['date'] + linesep + linesep
@@ -61,11 +75,11 @@ class Duel(BaseCog):
         return result
 
 
-    def extend_season_output(self, number, season_trivia_table, season_main_db, season_tables):
+    def extend_season_output(self, number, summary):
         result = ''
 
         try:
-            amnt_duels = season_trivia_table.get(self.bot.query.name == 'amnt_duels')
+            amnt_duels = summary['trivia'].get('amnt_duels')
 
             if amnt_duels['value'] > 0:
                 result += 'Total amount of duels fought'.ljust(config.season_ljust) + '  ' + str(amnt_duels['value']) + linesep
@@ -73,7 +87,7 @@ class Duel(BaseCog):
             pass
 
         try:
-            most_duels = max(season_main_db.all(), key=itemgetter('duels'))
+            most_duels = summary['most']['duels']
 
             if most_duels['duels'] > 0:
                 result += 'Most duels fought'.ljust(config.season_ljust) + '  ' + str(most_duels['duels']) + ' by ' + most_duels['user'] + linesep
@@ -81,7 +95,7 @@ class Duel(BaseCog):
             pass
             
         try:
-            highest_duel = season_trivia_table.get(self.bot.query.name == 'highest_duel')
+            highest_duel = summary['trivia'].get('highest_duel')
 
             if highest_duel['person1'] != '':
                 result += 'Highest duel'.ljust(config.season_ljust) + '  ' + str(highest_duel['value']) + ' won by ' + highest_duel['person1'] + ' against ' + highest_duel['person2'] + ' on ' + highest_duel['date'] + linesep
@@ -89,7 +103,7 @@ class Duel(BaseCog):
             pass
 
         try:
-            most_duel_wins = max(season_main_db.all(), key=itemgetter('duel_wins'))
+            most_duel_wins = summary['most']['duel_wins']
 
             if most_duel_wins['duel_wins'] > 0:
                 result += 'Most duel wins'.ljust(config.season_ljust) + '  ' + str(most_duel_wins['duel_wins']) + ' by ' + most_duel_wins['user'] + linesep
@@ -97,7 +111,7 @@ class Duel(BaseCog):
             pass
 
         try:
-            highest_amnt_winnings_duel = max(season_main_db.all(), key=itemgetter('duel_winnings'))
+            highest_amnt_winnings_duel = summary['most']['duel_winnings']
 
             if highest_amnt_winnings_duel['duel_winnings'] > 0:
                 result += ('Most ' + config.currency_name + ' winnings in duels').ljust(config.season_ljust) + '  ' + str(highest_amnt_winnings_duel['duel_winnings']) + ' by ' + highest_amnt_winnings_duel['user'] + linesep + linesep
@@ -139,33 +153,25 @@ class Duel(BaseCog):
         """Reject a duel."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
         main_db = economy.main_db
+        duels = self.bot.sessions.find('duel')
 
-        if not context.message.author.name in [d[1] for d in self.duels.values()]:
+        if not context.message.author.name in [d.user for d in duels]:
             await self.bot.post_error(context, 'You have not been challenged to a duel, ' + context.message.author.name + '.')
-        elif context.message.author.name in [d[0] for d in self.duels.values()]:
+        elif context.message.author.name in [d.challenger for d in duels]:
             await self.bot.post_error(context, 'You cannot reject a duel when you are the challenger, ' + context.message.author.name + '.')
         else:
-            challenger = None
-            bet = None
-            duel_id = None
-
-            for did, (c, user, b, accepted) in self.duels.items():
-                if user == context.message.author.name and not accepted:
-                    challenger = c
-                    bet = b
-                    duel_id = did
-                    break
-
-            if challenger is None:
+            session = next((d for d in duels if d.user == context.message.author.name and not d.accepted), None)
+
+            if session is None:
                 await self.bot.post_error(context, 'You have not been challenged to a duel, ' + context.message.author.name + '.')
             else:
-                await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** There will be no duel between ' + challenger + ' and ' + context.message.author.name + '.')
-                del self.duels[duel_id]
+                self.bot.sessions.end(session)
+                await session.post('**[DUEL]** There will be no duel between ' + session.challenger + ' and ' + context.message.author.name + '.')
 
 
     @commands.command()
@@ -173,59 +179,55 @@ class Duel(BaseCog):
         """Accept a duel."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+        accounts = economy.accounts
         stats = BaseCog.load_dependency(self, 'Stats')
-        trivia_table = stats.trivia_table
+        trivia = stats.trivia
         gambling = BaseCog.load_dependency(self, 'Gambling')
         weapon_emotes = gambling.weapon_emotes
 
-        if not context.message.author.name in [d[1] for d in self.duels.values()]:
+        duels = self.bot.sessions.find('duel')
+
+        if not context.message.author.name in [d.user for d in duels]:
             await self.bot.post_error(context, 'You have not been challenged to a duel, ' + context.message.author.name + '.')
-        elif context.message.author.name in [d[0] for d in self.duels.values()]:
+        elif context.message.author.name in [d.challenger for d in duels]:
             await self.bot.post_error(context, 'You have already challenged someone else to a duel, ' + context.message.author.name + ', you need to finish that duel before you can start another one.')
         else:
-            challenger = None
-            bet = None
-            duel_id = None
-
-            for did, (c, user, b, accepted) in self.duels.items():
-                if user == context.message.author.name and not accepted:
-                    challenger = c
-                    bet = b
-                    duel_id = did
-                    break
-
-            if challenger is None:
+            session = next((d for d in duels if d.user == context.message.author.name and not d.accepted), None)
+
+            if session is None:
                 await self.bot.post_error(context, 'You have not been challenged to a duel, ' + context.message.author.name + '.')
                 return
 
-            user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
-            other_balance = main_db.get(self.bot.query.user == challenger)['balance']
+            challenger = session.challenger
+            bet = session.bet
+            user_balance = accounts.get(context.message.author.name)['balance']
+            other_balance = accounts.get(challenger)['balance']
 
             if other_balance < bet:
-                await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** ' + challenger + ' doesn\'t even have ' + str(bet) + ' ' + config.currency_name + 's anymore, the duel has been canceled.')
-                del self.duels[duel_id]
+                self.bot.sessions.end(session)
+                await session.post('**[DUEL]** ' + challenger + ' doesn\'t even have ' + str(bet) + ' ' + config.currency_name + 's anymore, the duel has been canceled.')
             elif user_balance < bet:
-                await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. ' + challenger + ' wants to fight over ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
-                del self.duels[duel_id]
+                self.bot.sessions.end(session)
+                await session.post('**[DUEL]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. ' + challenger + ' wants to fight over ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
             else:
-                self.duels[duel_id] = (challenger, context.message.author.name, bet, True)
+                session.accepted = True
 
                 try:
-                    main_db.update(subtract('balance', bet), self.bot.query.user == challenger)
-                    main_db.update(subtract('balance', bet), self.bot.query.user == context.message.author.name)
-                    main_db.update(subtract('gambling_profit', bet), self.bot.query.user == challenger)
-                    main_db.update(subtract('gambling_profit', bet), self.bot.query.user == context.message.author.name)
+                    with accounts.transaction() as transaction:
+                        for name in (challenger, context.message.author.name):
+                            account = transaction.get(name)
+                            account['balance'] -= bet
+                            account['gambling_profit'] -= bet
                 except Exception as e:
-                    await self.bot.post_error(context, 'A fatal error occurred while trying to subtract ' + config.currency_name + 's from respective accounts. Duel is canceled and balances might be wrong.', config.additional_error_message)
+                    await self.bot.post_error(context, 'A fatal error occurred while trying to subtract ' + config.currency_name + 's from respective accounts. Duel is canceled.', config.additional_error_message)
                     log.exception(e)
                 else:
                     try:
-                        await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** Ladies and gentlemen, we are about to see a duel to the death between ' + challenger + ' and ' + context.message.author.name + '. Who is going to prevail, taking ' + str(bet) + ' ' + config.currency_name + 's from their opponent?')
+                        await session.post('**[DUEL]** Ladies and gentlemen, we are about to see a duel to the death between ' + challenger + ' and ' + context.message.author.name + '. Who is going to prevail, taking ' + str(bet) + ' ' + config.currency_name + 's from their opponent?')
                         await asyncio.sleep(self.duel_battle_delay) # nothing happens during this time
                         duel_participants = []
                         duel_participants.append(context.message.author.name)
@@ -240,55 +242,33 @@ class Duel(BaseCog):
                         else:
                             second = context.message.author.name
 
-                        balance_first = 0
-
                         try:
-                            balance_first = main_db.get(self.bot.query.user == first)['balance']
-                            main_db.update({'balance': balance_first + bet + bet}, self.bot.query.user == first)
+                            # Winnings and duel stats are written together, or not at all if anything fails
+                            with accounts.transaction() as transaction:
+                                winner = transaction.get(first)
+                                loser = transaction.get(second)
+                                balance_first = winner['balance']
+                                winner['balance'] += bet + bet
+                                winner['gambling_profit'] += bet + bet
+                                winner['duel_winnings'] += bet
+                                winner['duel_wins'] += 1
+                                winner['duels'] += 1
+                                loser['duels'] += 1
+
+                            trivia.record('highest_total_owned', balance_first + bet, first)
+                            trivia.record('highest_duel', bet, first, second)
+                            trivia.increment('amnt_duels')
                         except Exception as e:
                             await self.bot.post_error(context, 'A fatal error occurred while trying to add ' + config.currency_name + 's to ' + first + '\'s account. Balances might be wrong.', config.additional_error_message)
                             log.exception(e)
                         else:
                             weapon = random.choice(weapon_emotes)
-                            await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** ' + first + ' ' + weapon + ' ' + second )
-
-                            try:
-                                gambling_profit_first = main_db.get(self.bot.query.user == first)['gambling_profit']
-                                main_db.update({'gambling_profit': gambling_profit_first + bet + bet}, self.bot.query.user == first)
-
-                                first_total_won_duels = main_db.get(self.bot.query.user == first)['duel_winnings']
-                                main_db.update({'duel_winnings': first_total_won_duels + bet}, self.bot.query.user == first)
-                                highest_total_owned = trivia_table.get(self.bot.query.name == 'highest_total_owned')['value']
-
-                                if balance_first + bet > highest_total_owned:
-                                    trivia_table.update({'value': balance_first + bet, 'person1': first, 'person2': 'None', 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_total_owned')
-                            except Exception as e:
-                                await self.bot.post_error(context, 'Could not update some stats (affects !trivia output).', config.additional_error_message)
-                                log.exception(e)
-
-                            try:
-                                main_db.update(increment('duel_wins'), self.bot.query.user == first)
-
-                                highest_duel = trivia_table.get(self.bot.query.name == 'highest_duel')['value']
-
-                                if bet > highest_duel:
-                                    trivia_table.update({'value': bet, 'person1': first, 'person2': second, 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_duel')
-                            except Exception as e:
-                                await self.bot.post_error(context, 'Could not update some duel stats (affects !trivia output).', config.additional_error_message)
-                                log.exception(e)
-
-                            try:
-                                main_db.update(increment('duels'), self.bot.query.user == first)
-                                main_db.update(increment('duels'), self.bot.query.user == second)
-                                trivia_table.update(increment('value'), self.bot.query.name == 'amnt_duels')
-                            except Exception as e:
-                                await self.bot.post_error(context, 'Could not update some duel stats (affects !trivia output).', config.additional_error_message)
-                                log.exception(e)
+                            await session.post('**[DUEL]** ' + first + ' ' + weapon + ' ' + second )
                     except Exception as e:
                         await self.bot.post_error(context, 'Oh no, something went wrong (duel may or may not have finished).', config.additional_error_message)
                         log.exception(e)
 
-                del self.duels[duel_id]
+                self.bot.sessions.end(session)
 
 
     @commands.command()
@@ -296,12 +276,12 @@ class Duel(BaseCog):
         """Challenges _user_ to a duel. If you win, you receive _bet_ points from them."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
         await BaseCog.dynamic_user_add(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+        accounts = economy.accounts
         gambling = BaseCog.load_dependency(self, 'Gambling')
 
         if not bet:
@@ -316,21 +296,21 @@ class Duel(BaseCog):
 
         user = BaseCog.map_user(self, user)
 
-        if not main_db.contains(self.bot.query.user == user):
-            await self.bot.post_error(context, 'User ' + user + ' has not been added yet. They need to type !add to initialize their account.')
+        if not accounts.contains(user):
+            await self.bot.post_error(context, 'User ' + user + ' has not been added yet. They need to type !add to initialize their account.' + BaseCog.suggest_users(self, user))
         elif context.message.author.name == user:
             await self.bot.post_error(context, 'You cannot challenge yourself to a duel, ' + context.message.author.name + '.')
-        elif context.message.author.name in [d[0] for d in self.duels.values()]:
+        elif context.message.author.name in [d.challenger for d in self.bot.sessions.find('duel')]:
             await self.bot.post_error(context, 'You have already challenged someone to a duel, ' + context.message.author.name + ', you need to finish that duel before you can start another one.')
-        elif context.message.author.name in [d[1] for d in self.duels.values()]:
+        elif context.message.author.name in [d.user for d in self.bot.sessions.find('duel')]:
             await self.bot.post_error(context, 'You have already been challenged to a duel, ' + context.message.author.name + ', you need to finish that duel before you can start another one.')
-        elif user in [d[0] for d in self.duels.values()] or user in [d[1] for d in self.duels.values()]:
+        elif any(user in (d.challenger, d.user) for d in self.bot.sessions.find('duel')):
             await self.bot.post_error(context, '' + user + ' is already in a duel, ' + context.message.author.name + '. Please try again later.')
         elif bet <= 0:
             await self.bot.post_error(context, '!duel requires bets to be greater than zero.')
         else:
-            user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
-            other_balance = main_db.get(self.bot.query.user == user)['balance']
+            user_balance = accounts.get(context.message.author.name)['balance']
+            other_balance = accounts.get(user)['balance']
 
             if user_balance < bet:
                 await self.bot.post_error(context, 'You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. You want to fight over ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
@@ -347,16 +327,16 @@ class Duel(BaseCog):
                     await self.bot.post_error(context, 'High-stakes gambling is not allowed. Please stay below ' + str(gambling.lock_max_bet) + ' ' + config.currency_name + 's, ' + context.message.author.name + '. Admins can remove this limit using !unlock.') 
                     return
 
-            self.duel_ctr += 1
-            duel_id = self.duel_ctr
-            self.duels[duel_id] = (context.message.author.name, user, bet, False)
+            # Duels are played in the channel they were started in, alongside any other game there
+            session = self.bot.sessions.start(DuelSession(self.bot, context.message.channel, context.message.author.name, user, bet))
 
-            await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** ' + context.message.author.name + ' has challenged ' + user + ' to a duel. They have two minutes to accept (!acceptduel).')
+            await session.post('**[DUEL]** ' + context.message.author.name + ' has challenged ' + user + ' to a duel. They have two minutes to accept (!acceptduel).')
             await asyncio.sleep(self.duel_delay) # during this time, people can decline or accept
 
-            if duel_id in self.duels:
-                await self.bot.post_message(self.bot.bot_channel, '**[DUEL]** There will be no duel between ' + context.message.author.name + ' and ' + user + '.')
-                del self.duels[duel_id]
+            # Note: An accepted duel ends itself once it has been fought
+            if not session.ended and not session.accepted:
+                self.bot.sessions.end(session)
+                await session.post('**[DUEL]** There will be no duel between ' + context.message.author.name + ' and ' + user + '.')
 
 
 
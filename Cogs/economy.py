@@ -1,12 +1,10 @@
 import logging
 import discord
 from discord.ext import commands
-from tinydb.operations import subtract
-from tinydb import where
-import datetime
-from operator import itemgetter
 from os import linesep
 from .base_cog import BaseCog
+from .accounts import Accounts
+from .user_resolver import UserResolver
 from conf import config
 from dependency_load_error import DependencyLoadError
 
@@ -18,6 +16,11 @@ class Economy(BaseCog):
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
         self.main_db = bot.database.table('main_db')
+        self.accounts = Accounts(self.main_db, bot.database)
+
+        # Note: Core is loaded before Economy and owns the shortcuts, see Core.addshortcut
+        core_cog = bot.get_cog('Core')
+        self.resolver = UserResolver(self.main_db, core_cog.shortcuts if core_cog is not None else {})
         self.give_table = bot.database.table('give_table')
 
         bot.info_text += 'Registered users may reward others by giving away a fictional currency called ' + config.currency_name + 's.' + linesep + 'Type !add to initialize your account.' + linesep + linesep
@@ -29,50 +32,52 @@ class Economy(BaseCog):
         self.max_loan =  int(config.get('Economy', 'max_loan', fallback='14'))
 
         timed_events_cog = BaseCog.load_dependency(self, 'TimedEvents')
-        timed_events_cog.register_timed_event(self.refill_free_points)
-        timed_events_cog.register_timed_event(self.pay_back_loans)
+        timed_events_cog.register_timed_event(self.post_loan_summary)
+        self.repaid_loans = [] # (user, loan, free points left) of the last daily reset
 
 
     #================ BASECOG INTERFACE ================
-    def extend_trivia_table(self, trivia_table):
-        trivia_table.insert({'name': 'highest_total_owned', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'total_loans', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
+    def extend_trivia_table(self, trivia):
+        trivia.add('highest_total_owned')
+        trivia.add('total_loans')
 
 
-    def extend_trivia_output(self, trivia_table):
+    def extend_trivia_output(self, trivia):
         total_amnt_users = len(self.main_db)
         current_main_db_total = sum(item['balance'] for item in self.main_db if item['balance'] > 0)
 
-        total_loans = trivia_table.get(self.bot.query.name == 'total_loans')
+        total_loans = trivia.get('total_loans')
         result = (config.currency_name + 's currently in circulation').ljust(config.trivia_ljust) + '  ' + str(current_main_db_total) + linesep
         result += ('Total ' + config.currency_name + ' loans taken out').ljust(config.trivia_ljust) + '  ' + str(total_loans['value']) + linesep
         result += 'Amount of users'.ljust(config.trivia_ljust) + '  ' + str(total_amnt_users) + linesep
         return result
 
 
-    def extend_season_output(self, number, season_trivia_table, season_main_db, season_tables):
+    def extend_season_summary(self, season_trivia_table, season_main_db, summary):
+        summary['circulation'] = sum(item['balance'] for item in season_main_db if item['balance'] > 0)
+
+
+    def extend_season_output(self, number, summary):
         result = ''
 
         try:
             try:
-                current_main_db_total = sum(item['balance'] for item in season_main_db if item['balance'] > 0)
-                result += (config.currency_name + 's in circulation').ljust(config.season_ljust) + '  ' + str(current_main_db_total) + linesep
+                result += (config.currency_name + 's in circulation').ljust(config.season_ljust) + '  ' + str(summary['circulation']) + linesep
             except Exception:
                 pass
 
             try:
-                total_loans = season_trivia_table.get(self.bot.query.name == 'total_loans')
+                total_loans = summary['trivia'].get('total_loans')
                 result += ('Total ' + config.currency_name + ' loans taken out').ljust(config.season_ljust) + '  ' + str(total_loans['value']) + linesep
             except Exception:
                 pass
 
-            total_amnt_users = len(season_main_db)
-            result += 'Amount of users'.ljust(config.season_ljust) + '  ' + str(total_amnt_users) + linesep + linesep
+            result += 'Amount of users'.ljust(config.season_ljust) + '  ' + str(summary['users']) + linesep + linesep
         except Exception:
             pass
 
         try:
-            highest_given_total = max(season_main_db.all(), key=itemgetter('given'))
+            highest_given_total = summary['most']['given']
 
             if highest_given_total['given'] > 0:
                 result += ('Most ' + config.currency_name + 's given (total)').ljust(config.season_ljust) + '  ' + str(highest_given_total['given']) + ' by ' + highest_given_total['user'] + linesep
@@ -80,7 +85,7 @@ class Economy(BaseCog):
             print(str(e))
 
         try:
-            highest_received_total = max(season_main_db.all(), key=itemgetter('received'))
+            highest_received_total = summary['most']['received']
 
             if highest_received_total['received'] > 0:
                 result += ('Most ' + config.currency_name + 's received (total)').ljust(config.season_ljust) + '  ' + str(highest_received_total['received']) + ' by ' + highest_received_total['user'] + linesep
@@ -88,7 +93,7 @@ class Economy(BaseCog):
             pass
 
         try:
-            highest_owned = max(season_main_db.all(), key=itemgetter('balance'))
+            highest_owned = summary['most']['balance']
 
             if highest_owned['balance'] > 0:
                 result += ('Most ' + config.currency_name + 's owned at end of season').ljust(config.season_ljust) + '  ' + str(highest_owned['balance']) + ' by ' + highest_owned['user'] + linesep
@@ -96,7 +101,7 @@ class Economy(BaseCog):
             pass
 
         try:
-            highest_total_owned = season_trivia_table.get(self.bot.query.name == 'highest_total_owned')
+            highest_total_owned = summary['trivia'].get('highest_total_owned')
 
             if highest_total_owned['person1'] != '':
                 result += ('Most ' + config.currency_name + 's owned at a time').ljust(config.season_ljust) + '  ' + str(highest_total_owned['value']) + ' by ' + highest_total_owned['person1'] + ' on ' + highest_total_owned['date'] + linesep
@@ -108,32 +113,41 @@ class Economy(BaseCog):
 
     async def on_season_end(self):
         self.give_table.purge()
+        self.accounts.rebuild()
+        self.resolver.rebuild()
         self.main_db.update({'free': self.free_points_per_day, 'balance': self.initial_balance, 'given': 0, 'received': 0, 'loan': 0, 'gambling_profit': 0, 'duel_wins': 0, 'duel_winnings': 0, 'duels': 0, 'races': 0, 'first_place_bets': 0, 'top_three_bets': 0, 'race_winnings': 0, 'horse_bets': [0, 0, 0, 0, 0, 0, 0, 0, 0, 0], 'brs': 0, 'br_score': 0, 'br_wins': 0, 'br_winnings': 0, 'holiday': 0})
         await self.bot.post_message(self.bot.bot_channel, '**[NEW SEASON]** Everyone gets ' + str(self.free_points_per_day) + ' free points and starts with a balance of ' + str(self.initial_balance) + '!')
     #==============================================
 
 
     #================ TIMED EVENTS ================
-    async def refill_free_points(self):
-        """Refill every user's free points to the default value. Usually executed once per day, e.g. at 5AM."""
+    def prepare_daily_reset(self):
         self.give_table.purge()
-        self.main_db.update({'free': self.free_points_per_day})
+        self.repaid_loans = []
 
-    async def pay_back_loans(self):
-        for user in self.main_db.all():
-            try:
-                loan = user['loan']
 
-                if loan > 0:
-                    freer = user['free']
-                    diff = max(freer - loan, 0)
+    def extend_daily_reset(self, account):
+        """Refill the free points to the default value, then pay back the loan from them. Executed once per day, e.g. at 5AM."""
 
-                    self.main_db.update({'free': diff}, self.bot.query.user == user['user'])
-                    self.main_db.update({'loan': 0}, self.bot.query.user == user['user'])
-                    await self.bot.post_message(self.bot.bot_channel, '**[INFO]** ' + user['user'] + ' pays back his loan of ' + str(loan) + ' ' + config.currency_name + 's. They have ' + str(diff) + ' free ' + config.currency_name + 's left for the day.')
-            except Exception as e:
-                await self.bot.post_message(self.bot.bot_channel, '**[ERROR]** Oh no, something went wrong while paying back loans. ' + config.additional_error_message)
-                log.exception(e)
+        account['free'] = self.free_points_per_day
+        loan = account['loan']
+
+        if loan > 0:
+            account['free'] = max(account['free'] - loan, 0)
+            account['loan'] = 0
+            self.repaid_loans.append((account['user'], loan, account['free']))
+
+
+    async def post_loan_summary(self):
+        if not self.repaid_loans:
+            return
+
+        result = '**[INFO]** Loans paid back today:' + linesep
+
+        for user, loan, free in self.repaid_loans:
+            result += user + ' pays back a loan of ' + str(loan) + ' ' + config.currency_name + 's and has ' + str(free) + ' free ' + config.currency_name + 's left for the day.' + linesep
+
+        await self.bot.post_message(self.bot.bot_channel, result)
     #==============================================
 
     @commands.command()
@@ -146,7 +160,7 @@ class Economy(BaseCog):
 
         user = context.message.author.name
 
-        if self.main_db.contains(self.bot.query.user == user):
+        if self.accounts.contains(user):
             await self.bot.post_error(context, 'User ' + user + ' already exists.')
         else:
             await self.add_internal(user)
@@ -166,7 +180,7 @@ class Economy(BaseCog):
         await BaseCog.dynamic_user_add(self, context)
 
         stats = BaseCog.load_dependency(self, 'Stats')
-        trivia_table = stats.trivia_table
+        trivia = stats.trivia
 
         try:
             quote = ''
@@ -188,7 +202,7 @@ class Economy(BaseCog):
                 else:
                     if amnt < 0:
                         await self.bot.post_error(context, 'Cannot give a negative amount of ' + config.currency_name + 's.')
-                    elif self.main_db.contains(self.bot.query.user == user):
+                    elif self.accounts.contains(user):
                         if amnt > self.max_points_to_give_per_day:
                             await self.bot.post_error(context, 'You cannot give ' + user + ' more than ' + str(self.max_points_to_give_per_day) + ' ' + config.currency_name + 's each day, ' + context.message.author.name + '.')
                             return
@@ -204,76 +218,56 @@ class Economy(BaseCog):
                                 await self.bot.post_error(context, 'You have already given ' + user + ' ' + str(already_given_amount_today) + ' ' + config.currency_name + 's today, ' + context.message.author.name + ', you can only give ' + str(amnt) + ' more.')
                                 quote = ''
 
-                        freep = 0
-                        balance = 0
-                        other_balance = 0
-
-                        freep = self.main_db.get(self.bot.query.user == context.message.author.name)['free']
-                        balance = self.main_db.get(self.bot.query.user == context.message.author.name)['balance']
-                        other_balance = self.main_db.get(self.bot.query.user == user)['balance']
+                        if user == context.message.author.name:
+                            await self.bot.post_error(context, 'You cannot give ' + config.currency_name + 's to yourself, ' + context.message.author.name + '.')
+                            return
 
                         try:
-                            if user == context.message.author.name:
-                                await self.bot.post_error(context, 'You cannot give ' + config.currency_name + 's to yourself, ' + context.message.author.name + '.')
-                                return # not sure if necessary
-                            else:
+                            # Balances and give_table are written together, or not at all if anything fails; trivia changes are undone then as well
+                            with self.accounts.transaction() as transaction:
+                                donor = transaction.get(context.message.author.name)
+                                recipient = transaction.get(user)
+                                freep = donor['free']
+                                balance = donor['balance']
+
                                 if freep < amnt:
                                     rest_pay = amnt - freep # always positive
 
                                     if rest_pay > balance:
-                                        await self.bot.post_error(context, 'You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. Your balance is ' + str(balance) + ' and you have ' + str(freep) + ' free points left to spend today. Use !loan <amount> to take out a loan in free points (automatically repaid the next day)')
-                                        return
+                                        message = None
                                     else:
-                                        self.main_db.update({'balance': other_balance + amnt}, self.bot.query.user == user)
-                                        self.main_db.update({'free': 0, 'balance': balance - rest_pay}, self.bot.query.user == context.message.author.name)
-                                        await self.bot.post_message(self.bot.bot_channel, quote + '**[INFO]** ' + context.message.author.name + ' gave ' + str(freep) + ' free ' + config.currency_name + 's and ' + str(rest_pay) + ' ' + config.currency_name + 's to ' + user + '.' )
+                                        donor['free'] = 0
+                                        donor['balance'] = balance - rest_pay
+                                        message = quote + '**[INFO]** ' + context.message.author.name + ' gave ' + str(freep) + ' free ' + config.currency_name + 's and ' + str(rest_pay) + ' ' + config.currency_name + 's to ' + user + '.'
                                 else:
-                                    self.main_db.update({'balance': other_balance + amnt}, self.bot.query.user == user)
-                                    self.main_db.update(subtract('free', amnt), self.bot.query.user == context.message.author.name)
-                                    await self.bot.post_message(self.bot.bot_channel, quote + '**[INFO]** ' + context.message.author.name + ' gave ' + str(amnt) + ' (free) ' + config.currency_name + 's to ' + user + '.' )
-
-                                try:
-                                    if self.give_table.contains((self.bot.query.donor == context.message.author.name) & (self.bot.query.recipient == user)):
-                                        already_given_amount_today = self.give_table.get((self.bot.query.donor == context.message.author.name) & (self.bot.query.recipient == user))['amount']
-
-                                        try:
-                                            self.give_table.update({'amount': already_given_amount_today + amnt}, (self.bot.query.donor == context.message.author.name) & (self.bot.query.recipient == user))
-                                        except Exception as e:
-                                            try:
-                                                self.give_table.update({'amount': already_given_amount_today}, (self.bot.query.donor == context.message.author.name) & (self.bot.query.recipient == user))
-                                            except Exception as e2:
-                                                await self.bot.post_error(context, 'A fatal error occured while trying to update ' + config.currency_name + 's given today from ' + context.message.author.name + ' to ' + user + '. Please note that the transaction may not have completed successfully and/or your balances might be wrong.')
-                                                log.exception(e2)
-                                            raise
+                                    donor['free'] = freep - amnt
+                                    message = quote + '**[INFO]** ' + context.message.author.name + ' gave ' + str(amnt) + ' (free) ' + config.currency_name + 's to ' + user + '.'
+
+                                if message is not None:
+                                    recipient['balance'] += amnt
+                                    donor['given'] += amnt
+                                    recipient['received'] += amnt
+
+                                    given_query = (self.bot.query.donor == context.message.author.name) & (self.bot.query.recipient == user)
+                                    given_today = self.give_table.get(given_query)
+
+                                    if given_today is not None:
+                                        self.give_table.update({'amount': given_today['amount'] + amnt}, doc_ids=[given_today.doc_id])
                                     else:
                                         self.give_table.insert({'donor': context.message.author.name, 'recipient': user, 'amount': amnt})
-                                except Exception as e:
-                                    raise
-
-                                try:
-                                    highest_total_owned = trivia_table.get(where('name') == 'highest_total_owned')['value']
-
-                                    if other_balance + amnt > highest_total_owned:
-                                        trivia_table.update({'value': other_balance + amnt, 'person1': user, 'person2': 'None', 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_total_owned')
-
-                                    given_total = self.main_db.get(self.bot.query.user == context.message.author.name)['given']
-                                    self.main_db.update({'given': given_total + amnt}, self.bot.query.user == context.message.author.name)
-                                    received_total = self.main_db.get(self.bot.query.user == user)['received']
-                                    self.main_db.update({'received': received_total + amnt}, self.bot.query.user == user)
-                                except Exception as e:
-                                    await self.bot.post_error(context, 'Could not update some stats (only affects !trivia output).')
-                                    log.exception(e)
+
+                                    trivia.record('highest_total_owned', recipient['balance'], user)
                         except Exception as e:
-                            try:
-                                self.main_db.update({'balance': other_balance}, self.bot.query.user == user)
-                                self.main_db.update({'free': freep}, self.bot.query.user == context.message.author.name)
-                                self.main_db.update({'balance': balance}, self.bot.query.user == context.message.author.name)
-                                await self.bot.post_error(context, 'Oh no, something went wrong.')
-                            except Exception as e2:
-                                await self.bot.post_error(context, 'A fatal error occured while trying to reset balances. Please note that the transaction may not have completed successfully and/or your balances might be wrong.')
-                                log.exception(e2)
+                            await self.bot.post_error(context, 'Oh no, something went wrong. Nothing has been transferred.')
+                            log.exception(e)
+                            return
+
+                        if message is None:
+                            await self.bot.post_error(context, 'You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. Your balance is ' + str(balance) + ' and you have ' + str(freep) + ' free points left to spend today. Use !loan <amount> to take out a loan in free points (automatically repaid the next day)')
+                        else:
+                            await self.bot.post_message(self.bot.bot_channel, message)
                     else:
-                        await self.bot.post_error(context, '' + user + ' has not been added yet. They need to type !add to initialize their account.')
+                        await self.bot.post_error(context, '' + user + ' has not been added yet. They need to type !add to initialize their account.' + BaseCog.suggest_users(self, user))
         except Exception as e:
             raise e
         finally:
@@ -310,7 +304,7 @@ class Economy(BaseCog):
         await BaseCog.dynamic_user_add(self, context)
 
         stats = BaseCog.load_dependency(self, 'Stats')
-        trivia_table = stats.trivia_table
+        trivia = stats.trivia
 
         try:
             quote = ''
@@ -323,7 +317,7 @@ class Economy(BaseCog):
             except ValueError:
                 await self.bot.post_error(context, 'Amount must be an integer.')
             else:
-                account = self.main_db.get(self.bot.query.user == context.message.author.name)
+                account = self.accounts.get(context.message.author.name)
                 debt = account['loan']
                 new_debt = debt + amount
 
@@ -335,14 +329,12 @@ class Economy(BaseCog):
                     await self.bot.post_error(context, 'Min loan is 1 ' + config.currency_name + '.')
                 else:
                     freer = account['free']
-                    self.main_db.update({'free': freer + amount}, self.bot.query.user == context.message.author.name)
-                    self.main_db.update({'loan': new_debt}, self.bot.query.user == context.message.author.name)
+                    self.accounts.update({'free': freer + amount}, context.message.author.name)
+                    self.accounts.update({'loan': new_debt}, context.message.author.name)
 
                     await self.bot.post_message(self.bot.bot_channel, quote + '**[INFO]** ' + context.message.author.name + ' has taken out a loan of ' + str(amount) + ' (free) ' + config.currency_name + 's.')
 
-                    total_loans = trivia_table.get(self.bot.query.name == 'total_loans')['value']
-                    total_loans += amount
-                    trivia_table.update({'value': total_loans, 'person1': 'None', 'person2': 'None', 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'total_loans')
+                    trivia.increment('total_loans', amount)
         except Exception as e:
             raise e
         finally:
@@ -366,15 +358,15 @@ class Economy(BaseCog):
             user_pukcab = user
             user = BaseCog.map_user(self, user)
 
-            if not self.main_db.contains(self.bot.query.user == user):
+            if not self.accounts.contains(user):
                 if not aspect:
                     aspect = user
                     user = context.message.author.name
                 else:
-                    await self.bot.post_error(context, 'User ' + user_pukcab + ' has not been added yet. They need to type !add to initialize their account.')
+                    await self.bot.post_error(context, 'User ' + user_pukcab + ' has not been added yet. They need to type !add to initialize their account.' + BaseCog.suggest_users(self, user_pukcab))
                     return
 
-        main_db_entry = self.main_db.get(self.bot.query.user == user)
+        main_db_entry = self.accounts.get(user)
 
         if not aspect:
             combined_check_result = '**[INFO]** Checking user ' + user + ':' + linesep + '```' \
@@ -438,9 +430,21 @@ class Economy(BaseCog):
 
         await self.bot.post_message(self.bot.bot_channel, '**[NEW SEASON]** Duke ' + context.message.author.name + ' has announced a new season!')
 
+        # Take the snapshot for the season archive before any cog starts resetting its data
+        stats = self.bot.get_cog('Stats')
+        snapshot = stats.snapshot_season() if stats is not None else None
+
         for cog_name, cog in self.bot.cogs.items():
             await cog.on_season_end()
 
+        if snapshot is not None:
+            try:
+                number = await stats.archive_season(snapshot)
+                await self.bot.post_message(self.bot.bot_channel, '**[INFO]** The past season has been archived. Type !season ' + str(number) + ' to look back on it.')
+            except Exception as e:
+                await self.bot.post_message(self.bot.bot_channel, '**[ERROR]** The past season could not be archived. ' + config.additional_error_message)
+                log.exception(e)
+
 def setup(bot):
     """Economy cog load."""
     bot.add_cog(Economy(bot))
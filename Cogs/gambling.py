@@ -2,7 +2,6 @@ import logging
 import discord
 import json
 from discord.ext import commands
-from operator import itemgetter
 from os import linesep
 from .base_cog import BaseCog
 from conf import config
@@ -32,10 +31,10 @@ class Gambling(BaseCog):
         return result_string
 
 
-    def extend_season_output(self, number, season_trivia_table, season_main_db, season_tables):
+    def extend_season_output(self, number, summary):
         result = ''
 
-        gambling = max(season_main_db.all(), key=itemgetter('gambling_profit'))
+        gambling = summary['most']['gambling_profit']
 
         if gambling['gambling_profit'] > 0:
             result += 'Most profit made from gambling'.ljust(config.season_ljust) + '  ' + str(gambling['gambling_profit']) + ' by ' + gambling['user'] + linesep + linesep
@@ -28,6 +28,8 @@ class Holidays(BaseCog):
         # on which minigame was chosen at the beginning of the day for holiday points.
         self.holiday_minigame = self.bot.database.table('holiday_minigame')
         self.minigames = []
+        self.todays_holiday = None # Set by the daily reset
+        self.todays_minigame = None
 
         timed_events_cog = BaseCog.load_dependency(self, 'TimedEvents')
         timed_events_cog.register_timed_event(self.print_holiday)
@@ -58,51 +60,50 @@ class Holidays(BaseCog):
         print('Holiday cog is ready. Holiday announcement channel: ' + str(self.holiday_announcement_channel))
 
     #================ TIMED EVENTS ================
-    async def print_holiday(self):
-        """If the current day is a specified (in the .json) holiday, print info and grant free/holiday points. Executed once per day."""
-
-        economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+    def prepare_daily_reset(self):
+        """Find out whether the current day is a specified (in the .json) holiday and choose its minigame."""
 
         today = datetime.date.today()
-        holiday_dict = None
+        self.todays_holiday = self.holidays[today.month - 1].get(str(today.day))
+        self.todays_minigame = None
 
-        try:
-            holiday_dict = self.holidays[today.month - 1]
-        except Exception as e:
-            await self.bot.post_message(self.bot.bot_channel, '**[ERROR]** Oh no, something went wrong. ' + config.additional_error_message)
-            log.exception(e)
+        self.holiday_minigame.purge()
+
+        if self.todays_holiday is not None and len(self.minigames) > 0:
+            self.todays_minigame = random.choice(self.minigames)
+            self.holiday_minigame.insert({'minigame': self.todays_minigame})
+
+
+    def extend_daily_reset(self, account):
+        """Grant free/holiday points on holidays. Otherwise make sure nobody has holiday points left over from a recent holiday."""
+
+        if self.todays_holiday is None:
+            account['holiday'] = 0
+        else:
+            account['free'] += self.free_points_on_holiday
+            account['holiday'] = self.holiday_points
+
+
+    async def print_holiday(self):
+        """If the daily reset found a holiday, print info on it. Executed once per day."""
+
+        if self.todays_holiday is None:
             return
 
-        self.holiday_minigame.purge()
+        holiday = self.todays_holiday
 
         try:
-            holiday = holiday_dict[str(today.day)]
-        except KeyError as e:
-            # Make sure nobody has holiday points left over from a recent holiday
-            for user in main_db.all():
-                main_db.update({'holiday': 0}, self.bot.query.user == user['user'])
-        else:
-            try:
-                for user in main_db.all():
-                    freep = user['free']
-                    main_db.update({'free': freep + self.free_points_on_holiday}, self.bot.query.user == user['user'])
-                    main_db.update({'holiday': self.holiday_points}, self.bot.query.user == user['user'])
-
-                await self.bot.post_message(self.holiday_announcement_channel, '**[HOLIDAY]** :confetti_ball: :confetti_ball: :confetti_ball: **' + holiday[0] + '** :confetti_ball: :confetti_ball: :confetti_ball:' + linesep + linesep)
-                await self.bot.post_message(self.holiday_announcement_channel, '**[HOLIDAY]** *' + holiday[1] + '*' + linesep + linesep)
-
-                if len(self.minigames) > 0:
-                    chosen_minigame = random.choice(self.minigames)
-                    self.holiday_minigame.insert({'minigame': chosen_minigame})
-
-                    await self.bot.post_message(self.bot.bot_channel, '**[HOLIDAY]** :confetti_ball: :confetti_ball: :confetti_ball: **' + holiday[0] + '** :confetti_ball: :confetti_ball: :confetti_ball:' + linesep + linesep)
-                    await self.bot.post_message(self.bot.bot_channel, '**[HOLIDAY]** To celebrate the holiday, every registered user receives ' + str(self.holiday_points) + ' holiday points that can be spent on a minigame as well as ' + str(self.free_points_on_holiday) + ' free ' + config.currency_name + 's to give away to other users.')
-                    await self.bot.post_message(self.bot.bot_channel, '**[HOLIDAY]** The chosen minigame for today is ' + chosen_minigame + '. Have fun!')
-
-            except Exception as e:
-                await self.bot.post_message(self.bot.bot_channel, '**[ERROR]** There\'s supposed to be a holiday, but something went wrong. ' + config.additional_error_message)
-                log.exception(e)
+            await self.bot.post_message(self.holiday_announcement_channel, '**[HOLIDAY]** :confetti_ball: :confetti_ball: :confetti_ball: **' + holiday[0] + '** :confetti_ball: :confetti_ball: :confetti_ball:' + linesep + linesep)
+            await self.bot.post_message(self.holiday_announcement_channel, '**[HOLIDAY]** *' + holiday[1] + '*' + linesep + linesep)
+
+            if self.todays_minigame is not None:
+                await self.bot.post_message(self.bot.bot_channel, '**[HOLIDAY]** :confetti_ball: :confetti_ball: :confetti_ball: **' + holiday[0] + '** :confetti_ball: :confetti_ball: :confetti_ball:' + linesep + linesep)
+                await self.bot.post_message(self.bot.bot_channel, '**[HOLIDAY]** To celebrate the holiday, every registered user receives ' + str(self.holiday_points) + ' holiday points that can be spent on a minigame as well as ' + str(self.free_points_on_holiday) + ' free ' + config.currency_name + 's to give away to other users.')
+                await self.bot.post_message(self.bot.bot_channel, '**[HOLIDAY]** The chosen minigame for today is ' + self.todays_minigame + '. Have fun!')
+
+        except Exception as e:
+            await self.bot.post_message(self.bot.bot_channel, '**[ERROR]** There\'s supposed to be a holiday, but something went wrong. ' + config.additional_error_message)
+            log.exception(e)
     #==============================================
 
     @commands.command()
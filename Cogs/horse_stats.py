@@ -0,0 +1,158 @@
+import logging
+from os import linesep
+
+log = logging.getLogger(__name__)
+
+__all__ = ('HorseStats', 'PLACE_FIELDS')
+
+# Fields of the horses table counting how often a horse finished in each place
+PLACE_FIELDS = ('race_wins', '2nd', '3rd', '4th', '5th', '6th', '7th', '8th', '9th', '10th')
+
+# Historical profit per race shown in !horses, as if one point had been bet on the horse in every race (places 1 to 5)
+PROFIT_WEIGHTS = (4, 2, 1.75, 1.25, 1.00)
+
+
+class HorseStats:
+    """Placement counters and total bets of all horses, kept in memory and written to the horses table once per race.
+
+    Each horse's counters are a list in the order of PLACE_FIELDS. The weighted sums behind the Profit and Winrate columns are
+    updated along with the counters, and the rendered tables are kept until the next race changes them.
+    Rolled back batches (e.g. a failed race settlement) reload the stats from the table.
+    """
+
+    def __init__(self, table, names):
+        self.table = table
+        self.names = names
+        self.reload()
+        table.add_listener(self.on_change)
+
+
+    def reload(self):
+        self.places = {}
+        self.total_bets = {}
+        self.doc_ids = {}
+        self.profit_sums = {}
+        self.top_five = {}
+        self.rendered = {}
+
+        for document in self.table.all():
+            name = document['name']
+            self.places[name] = [document.get(field, 0) for field in PLACE_FIELDS]
+            self.total_bets[name] = document.get('total_bets', 0)
+            self.doc_ids[name] = document.doc_id
+            self.update_sums(name)
+
+
+    def on_change(self, event, doc_ids, fields):
+        # Note: Our own writes change nothing we don't already know
+        if event in ('reload', 'purge'):
+            self.reload()
+
+
+    def update_sums(self, name):
+        places = self.places[name]
+        self.profit_sums[name] = sum(weight * count for weight, count in zip(PROFIT_WEIGHTS, places))
+        self.top_five[name] = sum(places[:5])
+
+
+    def reset(self):
+        """Start over with all counters at zero, e.g. at the end of a season."""
+
+        self.table.purge()
+        self.table.insert_multiple([dict({field: 0 for field in PLACE_FIELDS}, name=name, total_bets=0) for name in self.names])
+        self.reload()
+
+
+    def record_race(self, placements, bets):
+        """Count a race: _placements_ are horse names in the order they finished, _bets_ maps horse names to the total amount bet on
+        them. Horses that aren't in the table (the uninvited guest) are skipped. All changed horses are written back at once.
+        """
+
+        changed = set()
+
+        for place, name in enumerate(placements[:len(PLACE_FIELDS)]):
+            if name in self.places:
+                self.places[name][place] += 1
+                changed.add(name)
+
+        for name, amount in bets.items():
+            if name in self.total_bets:
+                self.total_bets[name] += amount
+                changed.add(name)
+
+        for name in changed:
+            self.update_sums(name)
+
+        self.rendered = {}
+
+        if changed:
+            documents = [dict({field: count for field, count in zip(PLACE_FIELDS, self.places[name])}, name=name, total_bets=self.total_bets[name]) for name in changed]
+            self.table.write_back(documents, [self.doc_ids[name] for name in changed])
+
+
+    def most_popular(self):
+        """(name, total bets) of the horse with the most total bets, or None."""
+
+        if not self.total_bets:
+            return None
+
+        name = max(self.total_bets, key=self.total_bets.get)
+        return name, self.total_bets[name]
+
+
+    def profit(self, name, amnt_races):
+        return (self.profit_sums[name] - amnt_races) / amnt_races
+
+
+    def winrate(self, name, amnt_races):
+        return self.top_five[name] / amnt_races
+
+
+    def derived(self, name, amnt_races):
+        """Profit and winrate of _name_ as shown in tables."""
+
+        if amnt_races > 0 and name in self.places:
+            return '%1.2f' % self.profit(name, amnt_races), '%1.2f' % self.winrate(name, amnt_races)
+
+        return '0', '0'
+
+
+    def render(self, amnt_races):
+        """The table of !horses: all placements, profit and winrate of each horse."""
+
+        key = ('full', amnt_races)
+
+        if key not in self.rendered:
+            indent = max(len(h) for h in self.names)
+            result = '```Horses ' + linesep + linesep
+            result += 'Number  ' + 'Name'.ljust(indent) + '  1st' + '  2nd' + '  3rd' + '  4th' + '  5th' + '  6th' + '  7th' + '  8th' + '  9th' + '  10th' + '  Profit' + '  Winrate' + linesep + linesep
+
+            for number, name in enumerate(self.names, 1):
+                str_profit, str_winrate = self.derived(name, amnt_races)
+                places = self.places.get(name, [0] * len(PLACE_FIELDS))
+                result += str(number).ljust(len('Number')) + '  ' + name.ljust(indent) + '  ' + '  '.join(str(count).ljust(3) for count in places[:-1]) + '  ' + str(places[-1]).ljust(4) + '  ' + str_profit.ljust(len('Profit')) + '  ' + str_winrate.ljust(len('Winrate')) + linesep
+
+            result += '```'
+            self.rendered[key] = result
+
+        return self.rendered[key]
+
+
+    def render_summary(self, amnt_races):
+        """The short table of horses posted when a race is announced: wins, profit and winrate."""
+
+        key = ('summary', amnt_races)
+
+        if key not in self.rendered:
+            indent = max(len(h) for h in self.names)
+            result = '```Nr.  ' + 'Name'.ljust(indent) + '  Wins' + '  Profit' + '  Winrate' + linesep
+
+            for number, name in enumerate(self.names, 1):
+                str_profit, str_winrate = self.derived(name, amnt_races)
+                wins = self.places.get(name, [0])[0]
+                result += str(number).ljust(len('Nr.')) + '  ' + name.ljust(indent) + '  ' + str(wins).ljust(len('Wins')) + '  ' + str_profit.ljust(len('Profit')) + '  ' + str_winrate.ljust(len('Winrate')) + '   ' + linesep
+
+            result += '```'
+            self.rendered[key] = result
+
+        return self.rendered[key]
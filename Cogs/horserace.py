@@ -2,26 +2,51 @@ import logging
 import discord
 import json
 from discord.ext import commands
-from tinydb.operations import increment
 from tinydb.operations import subtract
-import datetime
 import asyncio
 import random
-from operator import itemgetter
+import time
 from os import linesep
 from .base_cog import BaseCog
 from conf import config
-from dependency_load_error import DependencyLoadError
+from outbox import PRIORITY_LOW
+from .race_engine import RaceRenderer, simulate_race
+from . import race_odds
+from .horse_stats import HorseStats
+from game_session import GameSession
 
 log = logging.getLogger(__name__)
 
+# Bets on the horses finishing first to fifth pay out this many times the bet
+PAYOUT_MULTIPLIERS = (4, 2, 1.8, 1.3, 1)
+
+
+class RaceSession(GameSession):
+    """A horse race: the bets placed so far and the horses on the track, which may include an uninvited guest."""
+
+    game = 'horserace'
+    title = 'Horse race'
+    exclusive = True # The race message is edited every frame
+
+    def __init__(self, bot, channel, names, emotes):
+        GameSession.__init__(self, bot, channel)
+        self.participants = {} # user -> (bet, holiday points used, horse number)
+        self.names = list(names)
+        self.emotes = list(emotes)
+        self.closed = True
+        self.last_message_id = None # Latest message in the race's channel, see Horserace.on_message
+
+
+    def describe(self):
+        bets = sum(b for b, f, h in self.participants.values())
+        return 'Horse race with ' + str(len(self.participants)) + ' bets over ' + str(bets) + ' ' + config.currency_name + 's' + ('' if self.closed else ' (open for bets)')
+
+
 class Horserace(BaseCog):
     """A cog for the horse race gambling minigame."""
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
-        self.race_participants = {}
-        self.race_closed = True
         self.race_last_ann = ''
         self.horse_table = self.bot.database.table('horses')
 
@@ -37,9 +62,17 @@ class Horserace(BaseCog):
         self.race_time_end = float(config.get('Horserace', 'race_time_end', fallback=2))
         self.race_time_finish = float(config.get('Horserace', 'race_time_finish', fallback=0.5))
         self.uninvited_chance = float(config.get('Horserace', 'uninvited_chance', fallback=0.15))
+        self.race_simulation = config.get('Horserace', 'race_simulation', fallback='python') # python or numpy
+        self.odds_races = int(config.get('Horserace', 'odds_races', fallback='1000000'))
+        self.odds_processes = max(int(config.get('Horserace', 'odds_processes', fallback='1')), 1)
+        self.odds_payout_tables = [PAYOUT_MULTIPLIERS] + [tuple(float(m) for m in table.split(',')) for table in config.get('Horserace', 'odds_payout_tables', fallback='').split(';') if table.strip()]
+        self.odds = race_odds.OddsCache(config.cogs_data_path + '/race_odds.json')
+        self.odds_task = None # Running simulation, so concurrent !odds don't start another one
+
+        self.horse_stats = HorseStats(self.horse_table, self.horse_names)
 
         if len(self.horse_table) < 1:
-            self.reset_horses()
+            self.horse_stats.reset()
 
         # Register horseraces to be a possible minigame for holiday points
         holidays = self.bot.get_cog('Holidays')
@@ -48,10 +81,51 @@ class Horserace(BaseCog):
             holidays.minigames.append('Horseraces')
 
 
-    def reset_horses(self):
-        self.horse_table.purge()
-        for horse_name in self.horse_names:
-            self.horse_table.insert({'name': horse_name, 'race_wins': 0, '2nd': 0, '3rd': 0, '4th': 0, '5th': 0, '6th': 0, '7th': 0, '8th': 0, '9th': 0, '10th': 0, 'total_bets': 0})
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        """Remember the latest message in channels with a race, so races know whether their message is still the latest one without asking Discord."""
+
+        for session in self.bot.sessions.find('horserace', message.channel):
+            session.last_message_id = message.id
+
+
+    async def play_race(self, session, race):
+        """Show the frames of the simulated _race_ in the channel of the race _session_ at the configured pace.
+
+        Frames are shown on a fixed schedule. If sending falls behind (e.g. when rate limited), frames that are already overdue are
+        skipped, so the race doesn't take longer than planned; the last frame is always shown. The result doesn't depend on this.
+        """
+
+        renderer = RaceRenderer(session.names, session.emotes, race.length)
+        delays = race.delays(self.race_time_default, self.race_time_end, self.race_time_finish)
+        horse_message = None
+        last_frame = None
+        start = time.monotonic()
+        due = 0.0
+        frame = 0
+
+        while frame < len(race):
+            # Skip to the latest frame that is due by now
+            while frame + 1 < len(race) and time.monotonic() - start >= due + delays[frame]:
+                due += delays[frame]
+                frame += 1
+
+            update = renderer.render(race.frames[frame], race.frame_placements(frame))
+
+            # Keep editing the race message while it is the latest one in the channel, otherwise post it again so it stays visible
+            if horse_message is None or session.last_message_id != horse_message.id:
+                horse_message = await session.post(update, priority=PRIORITY_LOW, coalesce=False)
+
+                # Note: The gateway may report the new message a little later; don't mistake that for someone else's message
+                if horse_message is not None:
+                    session.last_message_id = horse_message.id
+            elif update != last_frame:
+                await horse_message.edit(content=update)
+
+            last_frame = update
+            due += delays[frame]
+            frame += 1
+            await asyncio.sleep(max(due - (time.monotonic() - start), 0))
 
 
     #================ BASECOG INTERFACE ================
@@ -74,18 +148,18 @@ class Horserace(BaseCog):
         return result_string
 
 
-    def extend_trivia_table(self, trivia_table):
-        trivia_table.insert({'name': 'highest_accum_bets', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'highest_succ_bet', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'largest_race', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
-        trivia_table.insert({'name': 'amnt_races', 'value': 0, 'person1': '', 'person2': '', 'date': ''})
+    def extend_trivia_table(self, trivia):
+        trivia.add('highest_accum_bets')
+        trivia.add('highest_succ_bet')
+        trivia.add('largest_race')
+        trivia.add('amnt_races')
 
 
-    def extend_trivia_output(self, trivia_table):
+    def extend_trivia_output(self, trivia):
         result = ''
 
         try:
-            amnt_races = trivia_table.get(self.bot.query.name == 'amnt_races')
+            amnt_races = trivia.get('amnt_races')
 
             if amnt_races['value'] > 0:
                 result += 'Total amount of horse races arranged'.ljust(config.trivia_ljust) + '  ' + str(amnt_races['value']) + linesep
@@ -93,7 +167,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            largest_race = trivia_table.get(self.bot.query.name == 'largest_race')
+            largest_race = trivia.get('largest_race')
 
             if largest_race['person1'] != '':
                 result += 'Most gamblers in one horse race'.ljust(config.trivia_ljust) + '  ' + str(largest_race['value']) + ' won by ' + largest_race['person1'] + ' on ' + largest_race['date'] + linesep
@@ -101,15 +175,15 @@ class Horserace(BaseCog):
             pass
 
         try:
-            total_bets = max(self.horse_table.all(), key=itemgetter('total_bets'))
+            name, total_bets = self.horse_stats.most_popular()
 
-            if total_bets['total_bets'] > 0:
-                result += 'Most popular horse'.ljust(config.trivia_ljust) + '  ' + str(total_bets['name']) + ' with ' + str(total_bets['total_bets']) + ' total bets placed.' + linesep
+            if total_bets > 0:
+                result += 'Most popular horse'.ljust(config.trivia_ljust) + '  ' + str(name) + ' with ' + str(total_bets) + ' total bets placed.' + linesep
         except Exception:
             pass
 
         try:
-            highest_succ_bet = trivia_table.get(self.bot.query.name == 'highest_succ_bet')
+            highest_succ_bet = trivia.get('highest_succ_bet')
 
             if highest_succ_bet['person1'] != '':
                 result += 'Highest race payout'.ljust(config.trivia_ljust) + '  ' + str(highest_succ_bet['value']) + ' by ' + highest_succ_bet['person1'] + ' on ' + highest_succ_bet['person2'] + ' on ' + highest_succ_bet['date'] + linesep
@@ -117,7 +191,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            highest_accum_bets = trivia_table.get(self.bot.query.name == 'highest_accum_bets')
+            highest_accum_bets = trivia.get('highest_accum_bets')
 
             if highest_accum_bets['person1'] != '':
                 result += 'Most bets on a horse in one race'.ljust(config.trivia_ljust) + '  ' + str(highest_accum_bets['value']) + ' on ' + highest_accum_bets['person1'] + ' on ' + highest_accum_bets['date']
@@ -127,11 +201,11 @@ class Horserace(BaseCog):
         return result
 
 
-    def extend_season_output(self, number, season_trivia_table, season_main_db, season_tables):
+    def extend_season_output(self, number, summary):
         result = ''
 
         try:
-            amnt_races = season_trivia_table.get(self.bot.query.name == 'amnt_races')
+            amnt_races = summary['trivia'].get('amnt_races')
 
             if amnt_races['value'] > 0:
                 result += 'Total amount of horse races arranged'.ljust(config.season_ljust) + '  ' + str(amnt_races['value']) + linesep
@@ -139,7 +213,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            largest_race = season_trivia_table.get(self.bot.query.name == 'largest_race')
+            largest_race = summary['trivia'].get('largest_race')
 
             if largest_race['person1'] != '':
                 result += 'Most gamblers in one horse race'.ljust(config.season_ljust) + '  ' + str(largest_race['value']) + ' won by ' + largest_race['person1'] + ' on ' + largest_race['date'] + linesep
@@ -147,7 +221,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            races = max(season_main_db.all(), key=itemgetter('races'))
+            races = summary['most']['races']
 
             if races['races'] > 0:
                 result += 'Most horse races attended'.ljust(config.season_ljust) + '  ' + str(races['races']) + ' by ' + races['user'] + linesep
@@ -155,7 +229,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            first_place_bets = max(season_main_db.all(), key=itemgetter('first_place_bets'))
+            first_place_bets = summary['most']['first_place_bets']
 
             if first_place_bets['first_place_bets'] > 0:
                 result += 'Most first place race bets'.ljust(config.season_ljust) + '  ' + str(first_place_bets['first_place_bets']) + ' by ' + first_place_bets['user'] + linesep
@@ -163,7 +237,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            top_three_bets = max(season_main_db.all(), key=itemgetter('top_three_bets'))
+            top_three_bets = summary['most']['top_three_bets']
 
             if top_three_bets['top_three_bets'] > 0:
                 result += 'Most top three race bets'.ljust(config.season_ljust) + '  ' + str(top_three_bets['top_three_bets']) + ' by ' + top_three_bets['user'] + linesep
@@ -171,7 +245,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            race_winnings = max(season_main_db.all(), key=itemgetter('race_winnings'))
+            race_winnings = summary['most']['race_winnings']
 
             if race_winnings['race_winnings'] > 0:
                 result += ('Most ' + config.currency_name + ' winnings in horse races').ljust(config.season_ljust) + '  ' + str(race_winnings['race_winnings']) + ' by ' + race_winnings['user'] + linesep
@@ -179,7 +253,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            highest_succ_bet = season_trivia_table.get(self.bot.query.name == 'highest_succ_bet')
+            highest_succ_bet = summary['trivia'].get('highest_succ_bet')
 
             if highest_succ_bet['person1'] != '':
                 result += 'Highest race payout'.ljust(config.season_ljust) + '  ' + str(highest_succ_bet['value']) + ' by ' + highest_succ_bet['person1'] + ' on ' + highest_succ_bet['person2'] + ' on ' + highest_succ_bet['date'] + linesep
@@ -187,7 +261,7 @@ class Horserace(BaseCog):
             pass
 
         try:
-            highest_accum_bets = season_trivia_table.get(self.bot.query.name == 'highest_accum_bets')
+            highest_accum_bets = summary['trivia'].get('highest_accum_bets')
 
             if highest_accum_bets['person1'] != '':
                 result += 'Most bets on a horse in one race'.ljust(config.season_ljust) + '  ' + str(highest_accum_bets['value']) + ' on ' + highest_accum_bets['person1'] + ' on ' + highest_accum_bets['date']
@@ -223,7 +297,7 @@ class Horserace(BaseCog):
         return result
 
     async def on_season_end(self):
-        reset_horses()
+        self.horse_stats.reset()
     #==============================================
 
 
@@ -235,28 +309,66 @@ class Horserace(BaseCog):
         BaseCog.check_bot_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
 
-        result = '```Horses ' + linesep + linesep
+        stats = BaseCog.load_dependency(self, 'Stats')
+        amnt_races = stats.trivia.value('amnt_races')
 
-        indent = max(len(h) for h in self.horse_names)
-        result += 'Number  ' + 'Name'.ljust(indent) + '  1st' + '  2nd' + '  3rd' + '  4th' + '  5th' + '  6th' + '  7th' + '  8th' + '  9th' + '  10th' + '  Profit' + '  Winrate' + linesep + linesep
+        await self.bot.post_message(self.bot.bot_channel, self.horse_stats.render(amnt_races))
 
-        ctr = 1
 
-        stats = BaseCog.load_dependency(self, 'Stats')
-        amnt_races = stats.trivia_table.get(self.bot.query.name == 'amnt_races')
+    @commands.command()
+    async def odds(self, context, bet=None):
+        """Shows the chances of a horse to finish in each place and how much bets pay out on average, estimated from many simulated races. Optionally for a bet of _bet_ (payouts are rounded). Usage: !odds [bet]"""
 
-        for h in self.horse_names:
-            if amnt_races['value'] > 0:
-                stat_profit = ( 4 * self.horse_table.get(self.bot.query.name == h)['race_wins'] + 2 * self.horse_table.get(self.bot.query.name == h)['2nd'] + 1.75 * self.horse_table.get(self.bot.query.name == h)['3rd'] + 1.25 * self.horse_table.get(self.bot.query.name == h)['4th'] + 1.00 * self.horse_table.get(self.bot.query.name == h)['5th'] - amnt_races['value'] ) / amnt_races['value']
-                str_profit = '%1.2f' % stat_profit
-                stat_winrate = ( self.horse_table.get(self.bot.query.name == h)['race_wins'] + self.horse_table.get(self.bot.query.name == h)['2nd'] + self.horse_table.get(self.bot.query.name == h)['3rd'] + self.horse_table.get(self.bot.query.name == h)['4th'] + self.horse_table.get(self.bot.query.name == h)['5th'] ) / amnt_races['value']
-                str_winrate = '%1.2f' % stat_winrate
-            else:
-                stat_profit = 0
-                str_profit = '0'
-                str_winrate = '0'
-            result += str(ctr).ljust(len('Number')) + '  ' + h.ljust(indent) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['race_wins']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['2nd']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['3rd']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['4th']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['5th']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['6th']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['7th']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['8th']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['9th']).ljust(3) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['10th']).ljust(4) + '  ' + str_profit.ljust(len('Profit')) + '  ' + str_winrate.ljust(len('Winrate')) + linesep
-            ctr += 1
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_forbidden_characters(self, context)
+
+        if race_odds.numpy is None:
+            await self.bot.post_error(context, 'This feature is currently not available, ' + context.message.author.name + '. Sorry. Please notify your bot admin about installing NumPy.')
+            return
+
+        if bet is not None:
+            try:
+                bet = int(bet)
+            except ValueError:
+                await self.bot.post_error(context, 'Bet must be an integer.')
+                return
+
+            if bet <= 0:
+                await self.bot.post_error(context, 'Bet must be greater than zero.')
+                return
+
+        amnt_horses = len(self.horse_names)
+        key = race_odds.OddsCache.key(amnt_horses, self.race_length, self.uninvited_chance, self.odds_races)
+        entry = self.odds.get(key)
+
+        if entry is None:
+            # Simulating takes a while; do it in the background (and in worker processes, if configured) and only once
+            if self.odds_task is None:
+                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** Simulating ' + str(self.odds_races) + ' races to calculate the odds, this may take a while...')
+                self.odds_task = self.bot.loop.run_in_executor(None, self.odds.compute, amnt_horses, self.race_length, self.uninvited_chance, self.odds_races, self.odds_processes)
+
+            try:
+                entry = await asyncio.shield(self.odds_task)
+            finally:
+                self.odds_task = None
+
+        probabilities = entry['probabilities']
+        places = len(probabilities[0])
+
+        result = '```Odds of each horse (' + str(entry['races']) + ' simulated races, ' + '%1.0f' % (self.uninvited_chance * 100) + '% with an uninvited guest)' + linesep + linesep
+        result += 'Place  Chance  (lowest - highest horse)' + linesep
+
+        for place in range(places):
+            chances = [row[place] for row in probabilities]
+            result += str(place + 1).ljust(len('Place')) + '  ' + ('%5.2f%%' % (sum(chances) / len(chances) * 100)).ljust(len('Chance')) + '  (' + '%1.2f%% - %1.2f%%' % (min(chances) * 100, max(chances) * 100) + ')' + linesep
+
+        result += linesep + 'Payouts' + (' for a bet of ' + str(bet) if bet is not None else '') + linesep
+
+        for table in self.odds_payout_tables:
+            payout = race_odds.expected_payout(probabilities, table, bet)
+            name = '/'.join('%g' % multiplier for multiplier in table)
+            result += name.ljust(max(len('/'.join('%g' % m for m in t)) for t in self.odds_payout_tables)) + '  ' + '%1.3f per point bet, house edge %1.2f%%' % (payout, (1 - payout) * 100) + (' (current)' if table == PAYOUT_MULTIPLIERS else '') + linesep
 
         result += '```'
         await self.bot.post_message(self.bot.bot_channel, result)
@@ -267,24 +379,25 @@ class Horserace(BaseCog):
         """To let out your anger when your horse lost the race."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
 
-        await self.bot.post_message(self.bot.bot_channel, ':fork_and_knife:')
+        await self.bot.post_message(context.message.channel, ':fork_and_knife:')
 
     @commands.command()
     async def bet(self, context, bet, horse):
         """Stake money on a horse in a horse race. Type !horses to find your favourite steed."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
         await BaseCog.dynamic_user_add(self, context)
 
-        is_participating = context.message.author.name in self.race_participants
+        session = self.bot.sessions.get('horserace', context.message.channel)
+        is_participating = session is not None and context.message.author.name in session.participants
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+        accounts = economy.accounts
 
         try:
             try:
@@ -299,9 +412,9 @@ class Horserace(BaseCog):
                 await self.bot.post_error(context, 'Horse must be an integer. If you need help finding your horse, type `!horses`.')
                 return
 
-            if self.race_closed:
+            if session is None or session.closed:
                 await self.bot.post_error(context, 'You are too late to place a bet in the recent horse race, ' + context.message.author.name + '. Arrange a new race with !horserace <bet> <horse> if you are so eager to see your favourite breed on the track.')
-            elif context.message.author.name in self.race_participants:
+            elif context.message.author.name in session.participants:
                 await self.bot.post_error(context, 'You have already placed a bet, ' + context.message.author.name + '.')
             elif bet < 0:
                 await self.bot.post_error(context, 'You cannot bet a negative amount of ' + config.currency_name + 's, ' + context.message.author.name + '.')
@@ -310,7 +423,7 @@ class Horserace(BaseCog):
             elif horse <= 0 or horse > len(self.horse_names):
                 await self.bot.post_error(context, 'Invalid horse number. If you need help finding your horse, type `!horses`.')
             else:
-                user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
+                user_balance = accounts.get(context.message.author.name)['balance']
 
                 # Check if horserace is today's minigame for holiday points
                 holidays = self.bot.get_cog('Holidays')
@@ -320,7 +433,7 @@ class Horserace(BaseCog):
                 if holidays is not None:
                     if holidays.holiday_minigame.contains(self.bot.query.minigame == 'Horseraces'):
                         is_holiday_minigame = True
-                        holiday = main_db.get(self.bot.query.user == context.message.author.name)['holiday']
+                        holiday = accounts.get(context.message.author.name)['holiday']
 
                 if user_balance + holiday >= bet:
                     lock = True
@@ -338,25 +451,25 @@ class Horserace(BaseCog):
                                 leftover = bet - holiday
 
                                 if leftover > 0: # i.e. bet > holiday points
-                                    main_db.update(subtract('holiday', holiday), self.bot.query.user == context.message.author.name)
-                                    main_db.update(subtract('balance', leftover), self.bot.query.user == context.message.author.name)
-                                    main_db.update(subtract('gambling_profit', leftover), self.bot.query.user == context.message.author.name)
+                                    accounts.update(subtract('holiday', holiday), context.message.author.name)
+                                    accounts.update(subtract('balance', leftover), context.message.author.name)
+                                    accounts.update(subtract('gambling_profit', leftover), context.message.author.name)
                                 else: # Note: holiday points do not count as negative gambling profit
-                                    main_db.update(subtract('holiday', bet), self.bot.query.user == context.message.author.name)
+                                    accounts.update(subtract('holiday', bet), context.message.author.name)
                             else:
-                                main_db.update(subtract('balance', bet), self.bot.query.user == context.message.author.name)
-                                main_db.update(subtract('gambling_profit', bet), self.bot.query.user == context.message.author.name)
+                                accounts.update(subtract('balance', bet), context.message.author.name)
+                                accounts.update(subtract('gambling_profit', bet), context.message.author.name)
                         except Exception as e:
                             await self.bot.post_error(context, 'Something went wrong subtracting the bet from your account balance! You have therefore not placed a bet.', config.additional_error_message)
                             log.exception(e)
                         else:
-                            self.race_participants[context.message.author.name] = (bet, min(holiday, bet), horse)
-                            await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** ' + context.message.author.name + ' has bet ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '!') # first index is 0
+                            session.participants[context.message.author.name] = (bet, min(holiday, bet), horse)
+                            await session.post('**[HORSE RACE]** ' + context.message.author.name + ' has bet ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '!') # first index is 0
                 else:
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. You wish to stake ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
+                    await session.post('**[HORSE RACE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. You wish to stake ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
         except Exception as e:
-            if (context.message.author.name in self.race_participants) and not is_participating:
-                del self.race_participants[context.message.author.name]
+            if session is not None and (context.message.author.name in session.participants) and not is_participating:
+                del session.participants[context.message.author.name]
 
             await self.bot.post_error(context, 'Oh no, something went wrong (you have not placed a bet).', config.additional_error_message)
             log.exception(e)
@@ -367,31 +480,31 @@ class Horserace(BaseCog):
         """Undo your horse race bet."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+        accounts = economy.accounts
 
-        is_participating = context.message.author.name in self.race_participants
+        session = self.bot.sessions.get('horserace', context.message.channel)
 
-        if self.race_closed:
+        if session is None or session.closed:
             await self.bot.post_error(context, 'You are too late to remove a bet from the recent horse race, ' + context.message.author.name + '.')
-        elif context.message.author.name not in self.race_participants:
+        elif context.message.author.name not in session.participants:
             await self.bot.post_error(context, 'You have not placed a bet, ' + context.message.author.name + '.')
         else:
-            user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
-            bet, holiday_used, horse = self.race_participants[context.message.author.name]
+            user_balance = accounts.get(context.message.author.name)['balance']
+            bet, holiday_used, horse = session.participants[context.message.author.name]
 
             # Remove bet
-            balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
-            gambling_profit = main_db.get(self.bot.query.user == context.message.author.name)['gambling_profit']
-            holiday = main_db.get(self.bot.query.user == context.message.author.name)['holiday']
-            main_db.update({'gambling_profit': gambling_profit + (bet - holiday_used)}, self.bot.query.user == context.message.author.name)
-            main_db.update({'balance': balance + (bet - holiday_used)}, self.bot.query.user == context.message.author.name)
-            main_db.update({'holiday': holiday + holiday_used}, self.bot.query.user == context.message.author.name)
-            del self.race_participants[context.message.author.name]
-            await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** ' + context.message.author.name + ' has removed their bet of ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '.') # first index is 0
+            balance = accounts.get(context.message.author.name)['balance']
+            gambling_profit = accounts.get(context.message.author.name)['gambling_profit']
+            holiday = accounts.get(context.message.author.name)['holiday']
+            accounts.update({'gambling_profit': gambling_profit + (bet - holiday_used)}, context.message.author.name)
+            accounts.update({'balance': balance + (bet - holiday_used)}, context.message.author.name)
+            accounts.update({'holiday': holiday + holiday_used}, context.message.author.name)
+            del session.participants[context.message.author.name]
+            await session.post('**[HORSE RACE]** ' + context.message.author.name + ' has removed their bet of ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '.') # first index is 0
 
 
     @commands.command()
@@ -399,24 +512,19 @@ class Horserace(BaseCog):
         """Starts a horse race, placing a bet of _bet_ points on _horse_. Type !horses to find your favourite steed."""
 
         BaseCog.check_main_server(self, context)
-        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_game_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
         await BaseCog.dynamic_user_add(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
+        accounts = economy.accounts
         stats = BaseCog.load_dependency(self, 'Stats')
-        trivia_table = stats.trivia_table
+        trivia = stats.trivia
         gambling = BaseCog.load_dependency(self, 'Gambling')
 
-        br_bet = None
-
-        try:
-            battleroyale = BaseCog.load_dependency(self, 'BattleRoyale')
-            br_bet = battleroyale.br_bet
-        except DependencyLoadError:
-            # If battle royale cog is not available, shouldn't exit with error
-            pass
+        # Any number of races can take place at once, but only one game with animated messages per channel
+        session = RaceSession(self.bot, context.message.channel, self.horse_names, self.horse_emotes)
+        blocking = self.bot.sessions.blocking(session)
 
         try:
             try:
@@ -431,11 +539,11 @@ class Horserace(BaseCog):
                 await self.bot.post_error(context, 'Horse must be an integer. If you need help finding your horse, type `!horses`.')
                 return
 
-            if br_bet and br_bet != 0:
-                await self.bot.post_error(context, 'Sorry ' + context.message.author.name + ', please wait for the ongoing battle royale to end so that the messages don\'t interfere.')
+            if blocking is not None and blocking.game == 'horserace':
+                await self.bot.post_error(context, 'Not so hasty, keen gambler. There is already a big race taking place in this channel.')
                 return
-            elif self.race_participants:
-                await self.bot.post_error(context, 'Not so hasty, keen gambler. There is already a big race taking place.')
+            elif blocking is not None:
+                await self.bot.post_error(context, 'Sorry ' + context.message.author.name + ', please wait for the ongoing ' + blocking.title.lower() + ' in this channel to end so that the messages don\'t interfere.')
                 return
             elif bet < 0:
                 await self.bot.post_error(context, 'You cannot bet a negative amount of ' + config.currency_name + 's, ' + context.message.author.name + '.')
@@ -443,11 +551,11 @@ class Horserace(BaseCog):
             elif bet == 0:
                 await self.bot.post_error(context, 'You cannot bet zero ' + config.currency_name + 's, ' + context.message.author.name + '.')
                 return
-            elif horse <= 0 or horse > len(self.horse_names):
+            elif horse <= 0 or horse > len(session.names):
                 await self.bot.post_error(context, 'Invalid horse number. If you need help finding your horse, type `!horses`.')
                 return
             else:
-                user_balance = main_db.get(self.bot.query.user == context.message.author.name)['balance']
+                user_balance = accounts.get(context.message.author.name)['balance']
 
                 # Check if horserace is today's minigame for holiday points
                 holidays = self.bot.get_cog('Holidays')
@@ -457,10 +565,10 @@ class Horserace(BaseCog):
                 if holidays is not None:
                     if holidays.holiday_minigame.contains(self.bot.query.minigame == 'Horseraces'):
                         is_holiday_minigame = True
-                        holiday = main_db.get(self.bot.query.user == context.message.author.name)['holiday']
+                        holiday = accounts.get(context.message.author.name)['holiday']
 
                 if user_balance + holiday < bet:
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. You wish to stake ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
+                    await session.post('**[HORSE RACE]** You do not have enough ' + config.currency_name + 's, ' + context.message.author.name + '. You wish to stake ' + str(bet) + ' ' + config.currency_name + 's and your current balance is ' + str(user_balance) + '.') 
                     return
 
                 lock = gambling.lock
@@ -472,26 +580,8 @@ class Horserace(BaseCog):
 
                 announcement = 'Listen here, good people. Duke ' + context.message.author.name + ' has announced a majestic horse race. Which is the fastest steed in the lands of Tamriel?'
 
-                amnt_races = trivia_table.get(self.bot.query.name == 'amnt_races')
-                indent = max(len(h) for h in self.horse_names)
-                horse_list = '```Nr.  ' + 'Name'.ljust(indent) + '  Wins' + '  Profit' + '  Winrate' + linesep
-                ctr = 1
-
-                for h in self.horse_names:
-                    if amnt_races['value'] > 0:
-                        stat_profit = ( 4 * self.horse_table.get(self.bot.query.name == h)['race_wins'] + 2 * self.horse_table.get(self.bot.query.name == h)['2nd'] + 1.75 * self.horse_table.get(self.bot.query.name == h)['3rd'] + 1.25 * self.horse_table.get(self.bot.query.name == h)['4th'] + 1.00 * self.horse_table.get(self.bot.query.name == h)['5th'] - amnt_races['value'] ) / amnt_races['value']
-                        str_profit = '%1.2f' % stat_profit
-                        stat_winrate = ( self.horse_table.get(self.bot.query.name == h)['race_wins'] + self.horse_table.get(self.bot.query.name == h)['2nd'] + self.horse_table.get(self.bot.query.name == h)['3rd'] + self.horse_table.get(self.bot.query.name == h)['4th'] + self.horse_table.get(self.bot.query.name == h)['5th'] ) / amnt_races['value']
-                        str_winrate = '%1.2f' % stat_winrate
-                    else:
-                        stat_profit = 0
-                        str_profit = '0'
-                        str_winrate = '0'
-
-                    horse_list += str(ctr).ljust(len('Nr.')) + '  ' + h.ljust(indent) + '  ' + str(self.horse_table.get(self.bot.query.name == h)['race_wins']).ljust(len('Wins')) + '  ' + str_profit.ljust(len('Profit')) + '  ' + str_winrate.ljust(len('Winrate')) + '   ' + linesep
-                    ctr += 1
-
-                horse_list += '```'
+                indent = max(len(h) for h in session.names)
+                horse_list = self.horse_stats.render_summary(trivia.value('amnt_races'))
 
                 try:
                     # Remove bet
@@ -499,331 +589,191 @@ class Horserace(BaseCog):
                         leftover = bet - holiday
 
                         if leftover > 0: # i.e. bet > holiday points
-                            main_db.update(subtract('holiday', holiday), self.bot.query.user == context.message.author.name)
-                            main_db.update(subtract('balance', leftover), self.bot.query.user == context.message.author.name)
-                            main_db.update(subtract('gambling_profit', leftover), self.bot.query.user == context.message.author.name)
+                            accounts.update(subtract('holiday', holiday), context.message.author.name)
+                            accounts.update(subtract('balance', leftover), context.message.author.name)
+                            accounts.update(subtract('gambling_profit', leftover), context.message.author.name)
                         else: # Note: holiday points do not count as negative gambling profit
-                            main_db.update(subtract('holiday', bet), self.bot.query.user == context.message.author.name)
+                            accounts.update(subtract('holiday', bet), context.message.author.name)
                     else:
-                        main_db.update(subtract('balance', bet), self.bot.query.user == context.message.author.name)
-                        main_db.update(subtract('gambling_profit', bet), self.bot.query.user == context.message.author.name)
+                        accounts.update(subtract('balance', bet), context.message.author.name)
+                        accounts.update(subtract('gambling_profit', bet), context.message.author.name)
                 except Exception as e:
                     await self.bot.post_error(context, 'Something went wrong subtracting the bet from your account balance! Horse race is therefore canceled.')
                     log.exception(e)
                     return
 
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** ' + announcement)
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** Type !bet <bet> <horse> to place a bet on your favourite breed.')
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** Type !unbet to remove your current bet.')
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]**' + linesep + linesep)
-                await self.bot.post_message(self.bot.bot_channel, horse_list + linesep)
-                self.race_participants[context.message.author.name] = (bet, min(holiday, bet), horse)
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** ' + context.message.author.name + ' has bet ' + str(bet) + ' ' + config.currency_name + 's on ' + self.horse_names[horse - 1] + '!') # first index is 0
+                self.bot.sessions.start(session)
+
+                await session.post('**[HORSE RACE]** ' + announcement)
+                await session.post('**[HORSE RACE]** Type !bet <bet> <horse> to place a bet on your favourite breed.')
+                await session.post('**[HORSE RACE]** Type !unbet to remove your current bet.')
+                await session.post('**[HORSE RACE]**' + linesep + linesep)
+                await session.post(horse_list + linesep)
+                session.participants[context.message.author.name] = (bet, min(holiday, bet), horse)
+                await session.post('**[HORSE RACE]** ' + context.message.author.name + ' has bet ' + str(bet) + ' ' + config.currency_name + 's on ' + session.names[horse - 1] + '!') # first index is 0
                 self.race_last_ann = announcement
-                self.race_closed = False
+                session.closed = False
 
                 if self.race_delay <= 60:
                     await asyncio.sleep(self.race_delay) # during this time, people can use commands to join
                 else:
                     await asyncio.sleep(self.race_delay-60) # during this time, people can use commands to join
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** The race will start in 1 minute. Type !bet <bet> <horse> to take part!')
+                    await session.post('**[HORSE RACE]** The race will start in 1 minute. Type !bet <bet> <horse> to take part!')
                     await asyncio.sleep(30) # during this time, people can use commands to join
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** The race will start in 30 seconds. Type !bet <bet> <horse> to take part!')
+                    await session.post('**[HORSE RACE]** The race will start in 30 seconds. Type !bet <bet> <horse> to take part!')
                     await asyncio.sleep(30) # during this time, people can use commands to join
 
-                self.race_closed = True
+                session.closed = True
 
-                # _self.race_participants_ is now filled with usernames and bets
+                # _session.participants_ is now filled with usernames and bets
                 ann_message = '**[HORSE RACE]** Ladies and gentlemen, the glorious race is about to begin. The bets are:' + linesep + linesep + '`'
 
                 ctr = 1
 
-                for h in self.horse_names:
-                    accum_bets = sum(b for p, (b, f, h) in self.race_participants.items() if h == ctr)
+                for h in session.names:
+                    accum_bets = sum(b for p, (b, f, h) in session.participants.items() if h == ctr)
 
                     if accum_bets > 0:
                         ann_message += h.ljust(indent) + '  ' + str(accum_bets) + linesep
 
                     ctr += 1
 
-                await self.bot.post_message(self.bot.bot_channel, ann_message + '`' + linesep + linesep)
+                await session.post(ann_message + '`' + linesep + linesep)
 
                 # Total positions are (if using default) 69, every horse starts at position 0
                 positions = self.race_length
-                horse_positions = []
                 angery = False
 
                 # Check if another 'horse' joins the race
                 if random.uniform(0, 1) < self.uninvited_chance:
                     angery = True
 
-                for h in self.horse_names:
-                    horse_positions.append(0);
-
                 if angery:
-                    horse_positions.append(0);
-                    self.horse_names.append( '???' )
+                    session.names.append( '???' )
 
                     uninvited_guest = random.choice(self.uninvited_guest_emotes)
-                    self.horse_emotes.append(uninvited_guest)
+                    session.emotes.append(uninvited_guest)
 
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** Looks like there is an uninvited guest on the race track ' + uninvited_guest + '. The crowd is enraged, but the race continues.' + linesep + linesep)
+                    await session.post('**[HORSE RACE]** Looks like there is an uninvited guest on the race track ' + uninvited_guest + '. The crowd is enraged, but the race continues.' + linesep + linesep)
 
-                placements = []
-                await asyncio.sleep(self.race_time_end)
-                len_placements = 0
-                horse_message = None
-                last_message_id = None
+                # The whole race is decided up front; the frames are only played back afterwards
+                race = simulate_race(len(session.names), positions, vectorized=self.race_simulation == 'numpy')
+                placements = race.placements
 
-                while len_placements != len(self.horse_names):
-                    ctr = 0
-                    update = ':checkered_flag: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post: :triangular_flag_on_post:'
+                # TODO naming, It's not *actually* the index (it's the horse number)
+                first_index = placements[0]
+                second_index = placements[1]
+                third_index = placements[2]
+                fourth_index = placements[3]
+                fifth_index = placements[4]
+                first = session.names[first_index - 1]
+                second = session.names[second_index - 1]
+                third = session.names[third_index - 1]
+                fourth = session.names[fourth_index - 1]
+                fifth = session.names[fifth_index - 1]
+                amnt_first = sum(1 for p, (b, f, h) in session.participants.items() if h == first_index)
+                amnt_second = sum(1 for p, (b, f, h) in session.participants.items() if h == second_index)
+                amnt_third = sum(1 for p, (b, f, h) in session.participants.items() if h == third_index)
+                amnt_fourth = sum(1 for p, (b, f, h) in session.participants.items() if h == fourth_index)
+                amnt_fifth = sum(1 for p, (b, f, h) in session.participants.items() if h == fifth_index)
+
+                # Add winnings and update horses and trivia right away, the result is known. Everything is written together, or not at all if anything fails.
+                payout_message = ''
+                payout = False
 
-                    len_placements = len(placements)
+                try:
+                    records = [] # Trivia records set by this race, see Trivia.record
 
-                    # Update visuals
-                    for h in self.horse_names:
-                        update += linesep
-                        ctr += 1
-                        horse_position = horse_positions[ctr - 1]
-                        emoj = self.horse_emotes[ctr - 1]
+                    with accounts.transaction() as transaction:
 
-                        if horse_position == 0:
-                            update += '| '
+                        for p, (b, f, h) in session.participants.items():
+                            account = transaction.get(p)
+                            account['races'] += 1
+                            account['horse_bets'][h - 1] += 1
+                            place = placements.index(h)
 
-                            for i in range(1, positions):
-                                update += '-'
+                            if place >= len(PAYOUT_MULTIPLIERS):
+                                continue
 
-                            update += ' | ' + emoj + ' ' + str(ctr) + ' ' + h
-                        elif horse_position >= positions:
-                            update += '' + emoj + ' | '
+                            multiplier = PAYOUT_MULTIPLIERS[place]
+                            account['top_three_bets'] += 1
 
-                            for i in range(1, positions):
-                                update += '-'
+                            if place == 0:
+                                account['first_place_bets'] += 1
 
-                            update += ' | ' + str(ctr) + ' ' + h
+                            payout = True
+                            winnings = int(round(b * multiplier))
+                            new_balance = account['balance'] + winnings
+                            account['race_winnings'] += winnings - b
+                            account['gambling_profit'] += winnings # do not subtract bet because that's already done in bet()
+                            account['balance'] = new_balance
 
-                            if placements.index(ctr) == 0:
-                                update += ' :first_place:'
-                            elif placements.index(ctr) == 1:
-                                update += ' :second_place:'
-                            elif placements.index(ctr) == 2:
-                                update += ' :third_place:'
-                        else:
-                            update += '| '
+                            records.append(('highest_total_owned', new_balance, p))
+                            records.append(('highest_succ_bet', winnings, p, session.names[h - 1])) # which user received the highest amount of points through one bet
 
-                            # Let's say we have 5 positions total, the horse is on position 2; we need to add 3 dashes in front of it: 1 to 5 - 2
-                            for i in range(1, positions - horse_position):
-                                update += '-'
+                            payout_message += p + ': ' + str(winnings) + linesep
 
-                            update += ' ' + emoj + ' '
+                        # Placements and total bets of the horses, written in one go
+                        bets = {}
 
-                            # Let's say the horse is on position 4, we need to add 3 more dashes behind it: 0 to 2
-                            for i in range(0, horse_position - 1):
-                                update += '-'
+                        for p, (b, f, h) in session.participants.items():
+                            bets[session.names[h - 1]] = bets.get(session.names[h - 1], 0) + b
 
-                            update += ' | ' + str(ctr) + ' ' + h
+                        self.horse_stats.record_race([session.names[horse - 1] for horse in placements], bets)
 
-                    async for message in self.bot.bot_channel.history(limit=1):
-                        if message.id != last_message_id:
-                            horse_message = await self.bot.post_message(self.bot.bot_channel, update)
-                            last_message_id = horse_message.id
-                        else:
-                            await horse_message.edit(content=update);
+                        loc_highest_accum_bets = 0
+                        loc_highest_accum_bets_horse = None
 
-                        break # defensive coding, there really should only be one message returned
+                        for h, name in enumerate(session.names):
+                            sum_ = 0
 
-                    if len(placements) >= 3:
-                        await asyncio.sleep(self.race_time_finish)
-                    elif max(horse_positions) > positions - 6:
-                        await asyncio.sleep(self.race_time_end)
-                    else:
-                        await asyncio.sleep(self.race_time_default)
+                            for p, (b, f, hs) in session.participants.items():
+                                if h + 1 == hs: # h starts at 0
+                                    sum_ += b
 
-                    step_list = [1, 2, 3]
-                    step_probabilities = [0.65, 0.25, 0.1]
-                    new_placements = []
+                            if sum_ > loc_highest_accum_bets:
+                                loc_highest_accum_bets = sum_
+                                loc_highest_accum_bets_horse = name
 
-                    for idhp, horse_position in enumerate(horse_positions):
-                        x = random.uniform(0, 1)
-                        cum_prob = 0
+                        records.append(('highest_accum_bets', loc_highest_accum_bets, loc_highest_accum_bets_horse)) # which horse had the highest amount of bets in one race
+                        records.append(('largest_race', len(session.participants), first, second)) # which race had the most people betting on horses
 
-                        for i, i_p in zip(step_list, step_probabilities):
-                            cum_prob += i_p
+                    trivia.increment('amnt_races')
 
-                            if x < cum_prob:
-                                break
+                    for record in records:
+                        trivia.record(*record)
 
-                        horse_position += i
-                        horse_positions[idhp] = horse_position
-                        hnr = idhp + 1
-
-                        if horse_position >= positions and hnr not in placements:
-                            new_placements.append(hnr)
+                    settled = True
+                except Exception as e:
+                    settled = False
+                    log.exception(e)
 
-                    random.shuffle(new_placements)
-                    placements.extend(new_placements)
+                await asyncio.sleep(self.race_time_end)
+                await self.play_race(session, race)
 
-                # TODO naming, It's not *actually* the index (it's the horse number)
-                first_index = placements[0]
-                second_index = placements[1]
-                third_index = placements[2]
-                fourth_index = placements[3]
-                fifth_index = placements[4]
-                first = self.horse_names[first_index - 1]
-                second = self.horse_names[second_index - 1]
-                third = self.horse_names[third_index - 1]
-                fourth = self.horse_names[fourth_index - 1]
-                fifth = self.horse_names[fifth_index - 1]
-                amnt_first = sum(1 for p, (b, f, h) in self.race_participants.items() if h == first_index)
-                amnt_second = sum(1 for p, (b, f, h) in self.race_participants.items() if h == second_index)
-                amnt_third = sum(1 for p, (b, f, h) in self.race_participants.items() if h == third_index)
-                amnt_fourth = sum(1 for p, (b, f, h) in self.race_participants.items() if h == fourth_index)
-                amnt_fifth = sum(1 for p, (b, f, h) in self.race_participants.items() if h == fifth_index)
-
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** The race is over, valued spectators, and all placements are decided. What a divine spectacle!')
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** In fifth place is ' + fifth + ', anticipated by ' + str(amnt_fifth) + ' users.')
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** In fourth place is ' + fourth + ', anticipated by ' + str(amnt_fourth) + ' users.')
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** In third place is ' + third + ', anticipated by ' + str(amnt_third) + ' users.')
-                await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** In second place is ' + second + ', anticipated by ' + str(amnt_second) + ' users.')
+                await session.post('**[HORSE RACE]** The race is over, valued spectators, and all placements are decided. What a divine spectacle!')
+                await session.post('**[HORSE RACE]** In fifth place is ' + fifth + ', anticipated by ' + str(amnt_fifth) + ' users.')
+                await session.post('**[HORSE RACE]** In fourth place is ' + fourth + ', anticipated by ' + str(amnt_fourth) + ' users.')
+                await session.post('**[HORSE RACE]** In third place is ' + third + ', anticipated by ' + str(amnt_third) + ' users.')
+                await session.post('**[HORSE RACE]** In second place is ' + second + ', anticipated by ' + str(amnt_second) + ' users.')
 
                 if amnt_first == 0:
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + '! Looks like nobody saw this coming. What a surprise!')
+                    await session.post('**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + '! Looks like nobody saw this coming. What a surprise!')
                 else:
-                    await self.bot.post_message(self.bot.bot_channel, '**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + ', anticipated by ' + str(amnt_first) + ' users! Congratulations!')
-
-                # Add winnings and update some trivia
-                try:
-                    highest_total_owned = trivia_table.get(self.bot.query.name == 'highest_total_owned')['value']
-                    highest_succ_bet = trivia_table.get(self.bot.query.name == 'highest_succ_bet')['value'] # which user received the highest amount of ' + config.currency_name + 's through one bet
-
-                    payout_message = ''
-                    payout = False
-
-                    for p, (b, f, h) in self.race_participants.items():
-                        multiplier = 0
-
-                        if h == first_index:
-                            multiplier = 4
-                            main_db.update(increment('first_place_bets'), self.bot.query.user == p)
-                            main_db.update(increment('top_three_bets'), self.bot.query.user == p)
-                        elif h == second_index:
-                            multiplier = 2
-                            main_db.update(increment('top_three_bets'), self.bot.query.user == p)
-                        elif h == third_index:
-                            multiplier = 1.8
-                            main_db.update(increment('top_three_bets'), self.bot.query.user == p)
-                        elif h == fourth_index:
-                            multiplier = 1.3
-                            main_db.update(increment('top_three_bets'), self.bot.query.user == p)
-                        elif h == fifth_index:
-                            multiplier = 1
-                            main_db.update(increment('top_three_bets'), self.bot.query.user == p)
-                        else:
-                            continue
-
-                        payout = True
-                        race_winnings = main_db.get(self.bot.query.user == p)['race_winnings']
-                        balance = main_db.get(self.bot.query.user == p)['balance'] # prior to update
-                        winnings = int(round(b * multiplier))
-                        new_balance = balance + winnings
-                        main_db.update({'race_winnings': race_winnings + winnings - b}, self.bot.query.user == p)
-                        gambling_profit = main_db.get(self.bot.query.user == p)['gambling_profit']
-                        main_db.update({'gambling_profit': gambling_profit + winnings}, self.bot.query.user == p) # do not subtract bet because that's already done in bet()
-                        main_db.update({'balance': new_balance}, self.bot.query.user == p)
-
-                        if new_balance > highest_total_owned:
-                            trivia_table.update({'value': new_balance, 'person1': p, 'person2': 'None', 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_total_owned')
-                            highest_total_owned = new_balance
-
-                        if winnings > highest_succ_bet:
-                            trivia_table.update({'value': winnings, 'person1': p, 'person2': self.horse_names[h - 1], 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_succ_bet')
-                            highest_succ_bet = winnings
-
-                        payout_message += p + ': ' + str(winnings) + linesep
-
-                    if payout:
-                        payout_message = '**[HORSE RACE]** The payouts are:' + linesep + linesep + payout_message
-                        await self.bot.post_message(self.bot.bot_channel, payout_message)
-                except Exception as e:
-                    await self.bot.post_error(context, 'Something went wrong handing out the cash! Balances and stats might be inconsistent now.', config.additional_error_message)
-                    log.exception(e)
-
-                # Update horses and other trivia
-                try:
-                    self.horse_table.update(increment('race_wins'), self.bot.query.name == first) # updates amount of races won by this HORSE, not user
-                    self.horse_table.update(increment('2nd'), self.bot.query.name == second)
-                    self.horse_table.update(increment('3rd'), self.bot.query.name == third)
-
-                    # Update total number of bets ever placed on this horse
-                    for p, (b, f, h) in self.race_participants.items():
-                        total_bets = self.horse_table.get(self.bot.query.name == self.horse_names[h - 1])['total_bets']
-                        self.horse_table.update({'total_bets': total_bets + b}, self.bot.query.name == self.horse_names[h - 1])
-                        horse_bets = main_db.get(self.bot.query.user == p)['horse_bets']
-                        horse_bets[h - 1] += 1
-                        main_db.update({'horse_bets': horse_bets}, self.bot.query.user == p)
-
-                    trivia_table.update(increment('value'), self.bot.query.name == 'amnt_races')
-                    highest_accum_bets = trivia_table.get(self.bot.query.name == 'highest_accum_bets')['value'] # which horse had the highest amount of bets in one race
-                    largest_race = trivia_table.get(self.bot.query.name == 'largest_race')['value'] # which race had the most people betting on horses
-
-                    loc_highest_accum_bets = 0
-                    loc_highest_accum_bets_horse = None
-
-                    for h, name in enumerate(self.horse_names):
-                        sum_ = 0
-
-                        for p, (b, f, hs) in self.race_participants.items():
-                            if h + 1 == hs: # h starts at 0
-                                sum_ += b
-
-                        if sum_ > loc_highest_accum_bets:
-                            loc_highest_accum_bets = sum_
-                            loc_highest_accum_bets_horse = name
-
-                    if loc_highest_accum_bets > highest_accum_bets:
-                        trivia_table.update({'value': loc_highest_accum_bets, 'person1': loc_highest_accum_bets_horse, 'person2': 'None', 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'highest_accum_bets')
-
-                    if len(self.race_participants) > largest_race:
-                        trivia_table.update({'value': len(self.race_participants), 'person1': first, 'person2': second, 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")}, self.bot.query.name == 'largest_race')
-
-                    for placement, horse in enumerate(placements):
-                        if placement == 3:
-                            self.horse_table.update(increment('4th'), self.bot.query.name == self.horse_names[horse - 1])
-                        elif placement == 4: 
-                            self.horse_table.update(increment('5th'), self.bot.query.name == self.horse_names[horse - 1])
-                        elif placement == 5: 
-                            self.horse_table.update(increment('6th'), self.bot.query.name == self.horse_names[horse - 1])
-                        elif placement == 6: 
-                            self.horse_table.update(increment('7th'), self.bot.query.name == self.horse_names[horse - 1])
-                        elif placement == 7: 
-                            self.horse_table.update(increment('8th'), self.bot.query.name == self.horse_names[horse - 1])
-                        elif placement == 8: 
-                            self.horse_table.update(increment('9th'), self.bot.query.name == self.horse_names[horse - 1])
-                        elif placement == 9: 
-                            self.horse_table.update(increment('10th'), self.bot.query.name == self.horse_names[horse - 1])
-                except Exception as e:
-                    await self.bot.post_error(context, 'Could not update some horse race stats (only affects !trivia output).', config.additional_error_message)
-                    log.exception(e)
-
-                try:
-                    for p in self.race_participants:
-                        main_db.update(increment('races'), self.bot.query.user == p)
-                except Exception as e:
-                    await self.bot.post_error(context, 'Could not update some horse race stats (only affects !trivia output).', config.additional_error_message)
-                    log.exception(e)
+                    await session.post('**[HORSE RACE]** ...and in first place is the amazingly swift ' + first + ', anticipated by ' + str(amnt_first) + ' users! Congratulations!')
 
-                # Remove emote and name from array so that :angery: doesn't automatically participate next race
-                if angery:
-                    self.horse_emotes = self.horse_emotes[:-1]
-                    self.horse_names = self.horse_names[:-1]
+                if not settled:
+                    await self.bot.post_error(context, 'Something went wrong handing out the cash! Nobody has been paid out, please contact an admin.', config.additional_error_message)
+                elif payout:
+                    payout_message = '**[HORSE RACE]** The payouts are:' + linesep + linesep + payout_message
+                    await session.post(payout_message)
         except Exception as e:
             await self.bot.post_error(context, 'Oh no, something went wrong.', config.additional_error_message)
             log.exception(e)
 
-        # Reset stuff
-        self.race_closed = True
-        self.race_participants = {}
+        # The next race in this channel starts with a session of its own (and without the uninvited guest)
+        session.closed = True
+        self.bot.sessions.end(session)
 
 
 def setup(bot):
@@ -1,9 +1,11 @@
 import logging
 import discord
 from discord.ext import commands
-from operator import itemgetter
+from collections import OrderedDict
 from os import linesep
 from .base_cog import BaseCog
+from database import SortedFieldIndex
+from conf import config
 
 log = logging.getLogger(__name__)
 
@@ -14,8 +16,43 @@ class Labels(BaseCog):
         BaseCog.__init__(self, bot)
         self.bot = bot
         self.label_table = self.bot.database.table('label_table')
+
+        # Labels by iid (kept sorted for !labels), and the values of recently shown labels
+        self.index = SortedFieldIndex(self.label_table, 'iid')
+        self.cache = OrderedDict()
+        self.cache_size = int(config.get('Labels', 'label_cache_size', fallback='256'))
+        self.page_size = max(int(config.get('Labels', 'labels_page_size', fallback='50')), 1)
+        self.label_table.add_listener(self.on_label_change)
+
         self.bot.info_text += 'Labels:' + linesep + '  The label feature allows users to store (!set) and retrieve (!show) pieces of information - such as images or generic text - in a database for frequent use.' + linesep + linesep
 
+    def on_label_change(self, event, doc_ids, fields):
+        # New labels can't be cached yet; anything else may have changed a cached value
+        if event != 'insert':
+            self.cache.clear()
+
+
+    def get_value(self, label):
+        """The value of _label_, or None if it doesn't exist."""
+
+        if label in self.cache:
+            self.cache.move_to_end(label)
+            return self.cache[label]
+
+        doc_id = self.index.get(label)
+
+        if doc_id is None:
+            return None
+
+        value = self.label_table.get(doc_id=doc_id)['url']
+        self.cache[label] = value
+
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return value
+
+
     @commands.command()
     async def set(self, context, label, value):
         """Store a message/image/emote _value_ that can subsequently be displayed via !show _label_. If the label exists, it will be updated with the new value. Please only use lowercase letters."""
@@ -26,8 +63,10 @@ class Labels(BaseCog):
             await self.bot.post_error(context, 'Your message contains uppercase letters, ' + context.message.author.name + '. To make labels easier to find and use, only all lowercase labels are allowed. Sorry.')
             return
 
-        if self.label_table.contains(self.bot.query.iid == label):
-            self.label_table.update({'url': value}, self.bot.query.iid == label)
+        doc_id = self.index.get(label)
+
+        if doc_id is not None:
+            self.label_table.update({'url': value}, doc_ids=[doc_id])
             await self.bot.post_message(context.message.channel, '**[INFO]** ' + context.message.author.name + ' has updated the label ' + str(label) + '.')
         else:
             self.label_table.insert({'iid': label, 'url': value})
@@ -40,38 +79,56 @@ class Labels(BaseCog):
 
         BaseCog.check_forbidden_characters(self, context)
 
-        if not self.label_table.contains(self.bot.query.iid == label):
+        url = self.get_value(label)
+
+        if url is None:
             await self.bot.post_error(context, 'The label ' + label + ' does not exist, ' + context.message.author.name + '.')
         else:
-            url = self.label_table.get(self.bot.query.iid == label)['url']
             await self.bot.post_message(context.message.channel, url)
 
 
     @commands.command()
-    async def labels(self, context):
-        """Shows a list of images/messages/emotes that can be shown using !show <label> and set/updated using !set <label> <value>."""
+    async def labels(self, context, prefix='', page=None):
+        """Shows a list of images/messages/emotes that can be shown using !show <label> and set/updated using !set <label> <value>. Optionally only shows labels starting with _prefix_. Usage: !labels [prefix] [page]"""
 
         BaseCog.check_forbidden_characters(self, context)
 
-        if self.label_table:
-            result = '```Labels: ' + linesep
+        # !labels 2 shows the second page of all labels
+        if page is None and prefix.isdigit() and self.index.count(prefix) == 0:
+            prefix, page = '', prefix
 
-            sorted_label_table = sorted(self.label_table.all(), key=itemgetter('iid'), reverse=False)
+        try:
+            page = int(page) if page is not None else 1
+        except ValueError:
+            await self.bot.post_error(context, 'Page number must be an integer.')
+            return
 
-            for image in sorted_label_table:
-                new_part = '  ' + image['iid'] + linesep
-                new_string = result + new_part
+        amnt_labels = self.index.count(prefix)
 
-                if len(new_string) > 1997:
-                    await self.bot.post_message(context.message.channel, result + '```')
-                    result = '```'
+        if amnt_labels < 1:
+            if prefix:
+                await self.bot.post_message(context.message.channel, '**[INFO]** There are no labels starting with ' + prefix + '.')
+            else:
+                await self.bot.post_message(context.message.channel, '**[INFO]** There are no labels.')
+            return
 
-                result += new_part
+        amnt_pages = (amnt_labels + self.page_size - 1) // self.page_size
 
-            result += '```'
-            await self.bot.post_message(context.message.channel, result)
-        else:
-            await self.bot.post_message(context.message.channel, '**[INFO]** There are no labels.')
+        if page < 1 or page > amnt_pages:
+            await self.bot.post_error(context, 'Invalid page number. Please choose a number between 1 and ' + str(amnt_pages) + '.')
+            return
+
+        result = '```Labels' + (' starting with ' + prefix if prefix else '') + ' (page ' + str(page) + ' of ' + str(amnt_pages) + '): ' + linesep
+
+        for label in self.index.sorted_range((page - 1) * self.page_size, page * self.page_size, prefix):
+            result += '  ' + label + linesep
+
+        result += '```'
+
+        if page < amnt_pages:
+            result += 'Type !labels ' + (prefix + ' ' if prefix else '') + str(page + 1) + ' for the next page.'
+
+        await self.bot.post_message(context.message.channel, result)
 
 
     @commands.command()
@@ -80,10 +137,12 @@ class Labels(BaseCog):
 
         BaseCog.check_forbidden_characters(self, context)
 
-        if not self.label_table.contains(self.bot.query.iid == label):
+        doc_id = self.index.get(label)
+
+        if doc_id is None:
             await self.bot.post_error(context, 'The label ' + label + ' does not exist, ' + context.message.author.name + '.')
         else:
-            self.label_table.remove(self.bot.query.iid == label)
+            self.label_table.remove(doc_ids=[doc_id])
             await self.bot.post_message(context.message.channel, '**[INFO]** ' + context.message.author.name + ' has deleted the label ' + str(label) + '.')
 
 
@@ -0,0 +1,168 @@
+import logging
+import random
+from os import linesep
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # Races are simulated in pure Python
+
+log = logging.getLogger(__name__)
+
+__all__ = ('RaceRenderer', 'SimulatedRace', 'simulate_race', 'TRACK_HEADER')
+
+# Every frame, each horse moves ahead by one of STEPS with the respective probability
+STEPS = (1, 2, 3)
+STEP_PROBABILITIES = (0.65, 0.25, 0.1)
+
+TRACK_HEADER = ':checkered_flag:' + ' :triangular_flag_on_post:' * 19
+
+MEDALS = (' :first_place:', ' :second_place:', ' :third_place:')
+
+
+class RaceRenderer:
+    """Renders frames of a horse race: one lane per horse, running from right to left towards the finish line.
+
+    Everything that only depends on the track length and the horses is built once, so a frame is a few string concatenations
+    per horse: the part of the lane in front of the horse and the part behind it are looked up by position.
+    """
+
+    def __init__(self, names, emotes, length):
+        self.names = names
+        self.emotes = emotes
+        self.length = length
+
+        # Horses at 0 < position < length: '| ' + (length - position - 1) dashes + ' ' + emote + ' ' + (position - 1) dashes + ' | ' + number and name
+        self.fronts = ['| ' + '-' * (length - position - 1) + ' ' for position in range(length)]
+        self.backs = [' ' + '-' * max(position - 1, 0) for position in range(length)]
+
+        track = '-' * (length - 1)
+        self.tails = [' | ' + str(number) + ' ' + name for number, name in enumerate(names, 1)]
+        self.waiting = ['| ' + track + ' | ' + emote + ' ' + str(number) + ' ' + name for number, (name, emote) in enumerate(zip(names, emotes), 1)]
+        self.finished = [emote + ' | ' + track + tail for emote, tail in zip(emotes, self.tails)]
+
+
+    def lane(self, index, position, placements):
+        """The lane of horse _index_ (0-based) at _position_. _placements_ lists the numbers (1-based) of horses that have finished, in order."""
+
+        if position <= 0:
+            return self.waiting[index]
+
+        if position >= self.length:
+            place = placements.index(index + 1)
+            return self.finished[index] + (MEDALS[place] if place < len(MEDALS) else '')
+
+        return self.fronts[position] + self.emotes[index] + self.backs[position] + self.tails[index]
+
+
+    def render(self, positions, placements):
+        """The whole frame for the horses at _positions_ (one per horse, in order)."""
+
+        return TRACK_HEADER + linesep + linesep.join(self.lane(index, position, placements) for index, position in enumerate(positions))
+
+
+class SimulatedRace:
+    """The complete course of a race on a track of _length_ positions, as computed by simulate_race().
+
+    _frames_ holds the positions of all horses in every frame, _placed_ how many horses had finished in each frame, and _placements_
+    the numbers (1-based) of all horses in the order they finished.
+    """
+
+    def __init__(self, length, frames, placed, placements):
+        self.length = length
+        self.frames = frames
+        self.placed = placed
+        self.placements = placements
+
+
+    def __len__(self):
+        return len(self.frames)
+
+
+    def frame_placements(self, frame):
+        """The placements already decided in _frame_, e.g. for RaceRenderer.render."""
+        return self.placements[:self.placed[frame]]
+
+
+    def delays(self, time_default, time_end, time_finish):
+        """Seconds to show each frame for: _time_finish_ once three horses have finished, _time_end_ while the leader is close to the
+        finish line and _time_default_ otherwise.
+        """
+
+        result = []
+
+        for positions, placed in zip(self.frames, self.placed):
+            if placed >= 3:
+                result.append(time_finish)
+            elif max(positions) > self.length - 6:
+                result.append(time_end)
+            else:
+                result.append(time_default)
+
+        return result
+
+
+def simulate_race(amnt_horses, length, seed=None, vectorized=False):
+    """Run a whole race of _amnt_horses_ horses on a track of _length_ positions and return it as a SimulatedRace.
+
+    The race starts with all horses at 0 and ends with the first frame in which all of them have crossed the finish line. Horses that
+    finish in the same frame are placed in random order. Doesn't depend on anything but its arguments, so the same _seed_ always
+    yields the same race. With _vectorized_ (requires NumPy), all steps of all horses are drawn at once; seeds then give different
+    races than the pure Python version, but with the same odds.
+    """
+
+    if vectorized and numpy is not None:
+        return _simulate_race_numpy(amnt_horses, length, seed)
+
+    return _simulate_race_python(amnt_horses, length, seed)
+
+
+def _simulate_race_python(amnt_horses, length, seed):
+    rng = random.Random(seed)
+    positions = [0] * amnt_horses
+    placements = []
+    frames = [list(positions)]
+    placed = [0]
+
+    while len(placements) < amnt_horses:
+        new_placements = []
+
+        for index in range(amnt_horses):
+            x = rng.random()
+            cum_prob = 0
+
+            for step, probability in zip(STEPS, STEP_PROBABILITIES):
+                cum_prob += probability
+
+                if x < cum_prob:
+                    break
+
+            positions[index] += step
+
+            if positions[index] >= length and index + 1 not in placements:
+                new_placements.append(index + 1)
+
+        rng.shuffle(new_placements)
+        placements.extend(new_placements)
+        frames.append(list(positions))
+        placed.append(len(placements))
+
+    return SimulatedRace(length, frames, placed, placements)
+
+
+def _simulate_race_numpy(amnt_horses, length, seed):
+    rng = numpy.random.default_rng(seed)
+
+    # Every horse moves at least one position per frame, so all of them have finished after _length_ steps
+    steps = rng.choice(STEPS, size=(length, amnt_horses), p=STEP_PROBABILITIES)
+    positions = numpy.zeros((length + 1, amnt_horses), dtype=numpy.int64)
+    numpy.cumsum(steps, axis=0, out=positions[1:])
+
+    finished = numpy.argmax(positions >= length, axis=0) # Frame in which each horse crosses the finish line
+    last_frame = int(finished.max())
+
+    # Order by frame of finishing, randomly among horses finishing in the same frame
+    order = numpy.lexsort((rng.random(amnt_horses), finished))
+    placed = numpy.searchsorted(numpy.sort(finished), numpy.arange(last_frame + 1), side='right')
+
+    return SimulatedRace(length, positions[:last_frame + 1].tolist(), placed.tolist(), (order + 1).tolist())
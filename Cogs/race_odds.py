@@ -0,0 +1,145 @@
+import logging
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .race_engine import STEPS, STEP_PROBABILITIES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # !odds is not available
+
+log = logging.getLogger(__name__)
+
+__all__ = ('simulate_placements', 'estimate_odds', 'expected_payout', 'OddsCache')
+
+
+def simulate_placements(amnt_horses, length, amnt_races, seed=None, batch_size=10000):
+    """Simulate _amnt_races_ races like simulate_race() (requires NumPy) and count how often each horse finished in each place.
+
+    Returns an amnt_horses x amnt_horses array: counts[horse, place] (both 0-based). Races are simulated _batch_size_ at a time, all
+    steps of a batch drawn as one array.
+    """
+
+    rng = numpy.random.default_rng(seed)
+    counts = numpy.zeros(amnt_horses * amnt_horses, dtype=numpy.int64)
+
+    # Steps are drawn as 16 bit integers (much faster than floats); a step is larger by one for every threshold the number reaches
+    thresholds = [int(round(threshold * 65536)) for threshold in numpy.cumsum(STEP_PROBABILITIES)[:-1]]
+    horses = numpy.arange(amnt_horses)
+
+    while amnt_races > 0:
+        batch = min(batch_size, amnt_races)
+        amnt_races -= batch
+
+        # Note: STEPS are consecutive integers
+        draws = rng.integers(0, 65536, size=(batch, length, amnt_horses), dtype=numpy.uint16)
+        steps = numpy.full(draws.shape, STEPS[0], dtype=numpy.int16)
+
+        for threshold in thresholds:
+            steps += draws >= threshold
+
+        positions = numpy.cumsum(steps, axis=1, dtype=numpy.int16)
+
+        # Frame in which each horse crosses the finish line; horses finishing in the same frame are placed in random order
+        finished = numpy.argmax(positions >= length, axis=1)
+        order = numpy.argsort(finished + rng.random((batch, amnt_horses)), axis=1)
+
+        # order[race, place] is the horse in _place_; count (horse, place) pairs
+        counts += numpy.bincount((order * amnt_horses + horses).ravel(), minlength=amnt_horses * amnt_horses)
+
+    return counts.reshape(amnt_horses, amnt_horses)
+
+
+def estimate_odds(amnt_horses, length, uninvited_chance, amnt_races, processes=1, seed=None):
+    """Placement probabilities of the _amnt_horses_ regular horses, estimated from _amnt_races_ simulated races.
+
+    With a chance of _uninvited_chance_, an extra horse nobody can bet on joins the race; races with and without it are simulated
+    separately and mixed accordingly. The work is split over _processes_ worker processes. Returns an amnt_horses x (amnt_horses + 1)
+    list of lists: probabilities[horse][place].
+    """
+
+    amnt_uninvited = int(round(amnt_races * uninvited_chance))
+    jobs = []
+
+    for horses, races in ((amnt_horses, amnt_races - amnt_uninvited), (amnt_horses + 1, amnt_uninvited)):
+        chunk = -(-races // processes) if races > 0 else 0
+
+        for start in range(0, races, max(chunk, 1)):
+            jobs.append((horses, length, min(chunk, races - start)))
+
+    seeds = numpy.random.SeedSequence(seed).spawn(len(jobs))
+
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(simulate_placements, *zip(*jobs), seeds))
+    else:
+        results = [simulate_placements(*job, seed=job_seed) for job, job_seed in zip(jobs, seeds)]
+
+    probabilities = numpy.zeros((amnt_horses, amnt_horses + 1))
+
+    for (horses, job_length, races), counts in zip(jobs, results):
+        weight = (1 - uninvited_chance) if horses == amnt_horses else uninvited_chance
+        total = amnt_races - amnt_uninvited if horses == amnt_horses else amnt_uninvited
+
+        # The uninvited guest is the last horse; only the regular horses can be bet on
+        probabilities[:, :horses] += weight * counts[:amnt_horses] / total
+
+    return probabilities.tolist()
+
+
+def expected_payout(probabilities, multipliers, bet=None):
+    """Average amount paid out per point bet on a horse, for a payout table (multipliers by place). With a _bet_, payouts are rounded
+    to whole points like in Horserace.
+    """
+
+    if bet is not None:
+        multipliers = [int(round(bet * multiplier)) / bet for multiplier in multipliers]
+
+    per_horse = [sum(p * m for p, m in zip(row, multipliers)) for row in probabilities]
+    return sum(per_horse) / len(per_horse)
+
+
+class OddsCache:
+    """Odds computed by estimate_odds(), stored in a JSON file by a hash of everything that affects them, so they are only
+    simulated again when the race settings change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+        try:
+            with open(path, 'r') as cache_file:
+                self.entries = json.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+
+    @staticmethod
+    def key(amnt_horses, length, uninvited_chance, amnt_races):
+        settings = {'horses': amnt_horses, 'length': length, 'uninvited_chance': uninvited_chance, 'races': amnt_races, 'steps': STEPS, 'step_probabilities': STEP_PROBABILITIES}
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+    def get(self, key):
+        return self.entries.get(key)
+
+
+    def compute(self, amnt_horses, length, uninvited_chance, amnt_races, processes=1):
+        """Simulate and store the odds for these settings. Blocks for a while; run it in an executor."""
+
+        start = time.perf_counter()
+        probabilities = estimate_odds(amnt_horses, length, uninvited_chance, amnt_races, processes)
+        entry = {'probabilities': probabilities, 'races': amnt_races, 'time': time.perf_counter() - start}
+        log.info('Simulated %d horse races in %1.1fs', amnt_races, entry['time'])
+
+        self.entries[self.key(amnt_horses, length, uninvited_chance, amnt_races)] = entry
+
+        with open(self.path + '.tmp', 'w') as cache_file:
+            json.dump(self.entries, cache_file)
+
+        os.replace(self.path + '.tmp', self.path)
+        return entry
@@ -0,0 +1,191 @@
+import logging
+import os
+import json
+import time
+from collections import OrderedDict
+from database import Database
+from sqlite_backend import SQLiteDatabase
+
+log = logging.getLogger(__name__)
+
+__all__ = ('SeasonArchives', 'resident_memory', 'SUMMARY_SUFFIX')
+
+# Precomputed season summaries are stored next to the archives as <season>.summary.json
+SUMMARY_SUFFIX = '.summary.json'
+
+# Increase when the contents of season summaries change, so outdated summaries are rebuilt
+SUMMARY_VERSION = 1
+
+
+def resident_memory():
+    """Current resident memory of the bot in bytes, or None where /proc is not available."""
+
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SeasonArchives:
+    """Past seasons stored in _path_. Season files are found by name right away, but only opened when a season is first used.
+
+    At most _max_resident_ seasons are kept in memory; opening another one closes the least recently used. With a _memory_limit_
+    (bytes, 0 for none), least recently used seasons are also closed while the bot's resident memory exceeds the limit.
+    seasons[i] returns (main_db, trivia_table) of season i + 1, like the list of season tables this replaces.
+
+    Each season can have a summary (a dict of aggregates, see Stats.summarize_season), which is stored in a file next to the
+    archive and kept in memory once read, so showing a season doesn't require opening its archive again.
+    """
+
+    def __init__(self, path, max_resident=3, memory_limit=0):
+        self.path = path
+        self.max_resident = max(max_resident, 1)
+        self.memory_limit = memory_limit
+        self.filenames = []
+        self.resident = OrderedDict() # filename -> open database, least recently used first
+        self.summaries = {} # filename -> summary
+
+        self.total_loads = 0
+        self.total_evictions = 0
+        self.load_time = 0.0
+
+        self.discover()
+
+
+    def discover(self):
+        """Find all season files. Seasons are numbered in the order of their filenames."""
+
+        filenames = os.listdir(self.path) if os.path.isdir(self.path) else []
+        self.filenames = []
+
+        for filename in sorted(filenames):
+            if filename.endswith(SUMMARY_SUFFIX):
+                continue
+
+            # Note: Seasons migrated to SQLite (see manage.py migrate-sqlite) are preferred over their JSON originals
+            if filename.endswith('.sqlite3'):
+                self.filenames.append(filename)
+            elif filename.endswith('.json') and filename[:-len('.json')] + '.sqlite3' not in filenames:
+                self.filenames.append(filename)
+
+
+    def add(self, filename):
+        """Make a newly written archive in _path_ available as the latest season. Returns its index."""
+
+        if filename not in self.filenames:
+            self.filenames.append(filename)
+
+        return self.filenames.index(filename)
+
+
+    def __len__(self):
+        return len(self.filenames)
+
+
+    def __getitem__(self, index):
+        database = self.open(self.filenames[index])
+        return database.table('main_db'), database.table('trivia_table')
+
+
+    def open(self, filename):
+        if filename in self.resident:
+            self.resident.move_to_end(filename)
+            return self.resident[filename]
+
+        start = time.perf_counter()
+        path = os.path.join(self.path, filename)
+
+        if filename.endswith('.sqlite3'):
+            database = SQLiteDatabase(path)
+        else:
+            database = Database(path)
+
+        # Read the file now rather than on the first query, so the load time below is accurate
+        database.table('main_db')
+        database.table('trivia_table')
+
+        load_time = time.perf_counter() - start
+        self.total_loads += 1
+        self.load_time += load_time
+        self.resident[filename] = database
+        log.info('Opened season archive %s in %1.3fs', filename, load_time)
+
+        self.evict()
+        return database
+
+
+    def evict(self):
+        """Close least recently used seasons until the limits are met again. The most recently used season always stays open."""
+
+        while len(self.resident) > 1 and (len(self.resident) > self.max_resident or self.over_memory_limit()):
+            filename, database = self.resident.popitem(last=False)
+            database.close()
+            self.total_evictions += 1
+            log.info('Closed season archive %s', filename)
+
+
+    def over_memory_limit(self):
+        if not self.memory_limit:
+            return False
+
+        memory = resident_memory()
+        return memory is not None and memory > self.memory_limit
+
+
+    def summary_path(self, filename):
+        return os.path.join(self.path, filename.rpartition('.')[0] + SUMMARY_SUFFIX)
+
+
+    def summary(self, index):
+        """The stored summary of season _index_ + 1, or None if there is none or it is older than the archive."""
+
+        filename = self.filenames[index]
+
+        if filename not in self.summaries:
+            path = self.summary_path(filename)
+
+            try:
+                with open(path, 'r') as summary_file:
+                    summary = json.load(summary_file)
+            except (OSError, ValueError):
+                return None
+
+            if summary.get('version') != SUMMARY_VERSION or summary.get('archive_mtime') != os.path.getmtime(os.path.join(self.path, filename)):
+                return None
+
+            self.summaries[filename] = summary
+
+        return self.summaries[filename]
+
+
+    def store_summary(self, index, summary):
+        filename = self.filenames[index]
+        summary = dict(summary, version=SUMMARY_VERSION, archive_mtime=os.path.getmtime(os.path.join(self.path, filename)))
+        path = self.summary_path(filename)
+
+        with open(path + '.tmp', 'w') as summary_file:
+            json.dump(summary, summary_file)
+
+        os.replace(path + '.tmp', path)
+        self.summaries[filename] = summary
+        return summary
+
+
+    def close(self):
+        while self.resident:
+            filename, database = self.resident.popitem()
+            database.close()
+
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'seasons': len(self.filenames),
+            'resident': list(self.resident),
+            'max_resident': self.max_resident,
+            'loads': self.total_loads,
+            'evictions': self.total_evictions,
+            'summaries': len(self.summaries),
+            'load_time': self.load_time
+        }
@@ -1,69 +1,114 @@
 import logging
+import os
+import time
+import asyncio
 import discord
 from discord.ext import commands
-from operator import itemgetter
-from os import linesep, listdir
-from .base_cog import BaseCog
+from os import linesep
 from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+from .base_cog import BaseCog
+from .season_archives import SeasonArchives, resident_memory
+from .trivia import Trivia
+from storage import storage_for_format
 from conf import config
 
 log = logging.getLogger(__name__)
 
+# Tables that are archived at the end of a season
+ARCHIVED_TABLES = ('main_db', 'trivia_table', 'horses')
+
 class Stats(BaseCog):
     """A cog for displaying various user- or server-related stats."""
 
     def __init__(self, bot):
         BaseCog.__init__(self, bot)
         self.trivia_table = bot.database.table('trivia_table')
+        self.trivia = Trivia(self.trivia_table, flush_changes=int(config.get('Stats', 'trivia_flush_changes', fallback='20')))
+        self.trivia_flush_interval = int(config.get('Stats', 'trivia_flush_interval', fallback='30'))
         self.seasons_path = config.get('Private', 'seasons_path', fallback='seasons')
+        self.all_page_size = max(int(config.get('Stats', 'all_page_size', fallback='25')), 1)
 
-        # Past seasons, if available
-        self.season_tables = []
-
+        # Cogs add the trivia entries they need; entries that already exist are kept
         try:
-            if len(self.trivia_table) < 1:
-                self.reset_trivia()
+            self.reset_trivia()
         except Exception as e:
             print('Stats::__init__: Error while resetting trivia table!')
             log.exception(e)
 
-        for filename in sorted(listdir(self.seasons_path)):
-            if filename.endswith('.json'):
-                season_db = TinyDB(self.seasons_path + '/' + filename)
-                self.season_tables.append((season_db.table('main_db'), season_db.table('trivia_table')))
+        # Past seasons, if available. They are only read from disk when !season asks for them.
+        start = time.perf_counter()
+        max_resident_seasons = int(config.get('Stats', 'max_resident_seasons', fallback='3'))
+        season_memory_limit = int(config.get('Stats', 'season_memory_limit_mb', fallback='0')) * 1024 * 1024
+        self.season_tables = SeasonArchives(self.seasons_path, max_resident=max_resident_seasons, memory_limit=season_memory_limit)
 
-        log.info('Loaded ' + str(len(self.season_tables)) + ' season tables')
+        memory = resident_memory()
+        log.info('Found ' + str(len(self.season_tables)) + ' season archives in %1.3fs, resident memory: %s', time.perf_counter() - start, 'unknown' if memory is None else '%1.1f MB' % (memory / 1e6))
+
+        self.trivia_flush_task = bot.loop.create_task(self.flush_trivia())
 
 
     def reset_trivia(self):
         for cog_name, cog in self.bot.cogs.items():
-            cog.extend_trivia_table(self.trivia_table)
+            cog.extend_trivia_table(self.trivia)
+
+        self.trivia.flush()
+
+
+    async def flush_trivia(self):
+        """Asynchronous timer loop that periodically writes changed trivia entries to the database."""
+
+        while True:
+            await asyncio.sleep(self.trivia_flush_interval)
+
+            try:
+                self.trivia.flush()
+            except Exception as e:
+                log.fatal('EXCEPTION OCCURRED WHILE FLUSHING TRIVIA:')
+                log.exception(e)
 
 
     #================ BASECOG INTERFACE ================
     async def on_season_end(self):
-        self.trivia_table.purge()
+        self.trivia.reset()
         self.reset_trivia()
+
+
+    def on_shutdown(self):
+        self.trivia.flush()
     #==============================================
 
 
-    def get_check_result_string(self, command, ctype):
-        result = None
+    def cog_unload(self):
+        """Stop flushing trivia, write what's left and close season archives on cog unload."""
+        self.trivia_flush_task.cancel()
+        self.trivia.flush()
+        self.season_tables.close()
+        BaseCog.cog_unload(self)
+
+
+    def get_label(self, command):
+        """Label of the aspect _command_ in rankings, or None if it can't be ranked. No command means balance."""
 
         # NOTE: economy cog is always loaded in functions prior to calling this, so is expected to be available
         if not command:
-            command = 'balance'
-            result = 'total ' + config.currency_name + 's'
+            return 'total ' + config.currency_name + 's'
         elif command == 'given':
-            result = 'points given'
+            return 'points given'
         elif command == 'received':
-            result = 'points received'
-        else:
-            for cog_name, cog in self.bot.cogs.items():
-                result = cog.get_label_for_command(command)
+            return 'points received'
+
+        for cog_name, cog in self.bot.cogs.items():
+            result = cog.get_label_for_command(command)
+
+            if result:
+                return result
+
+        return None
 
-                if result:
-                    break
+
+    def get_check_result_string(self, command, ctype):
+        result = self.get_label(command)
 
         if result:
             result = '**[INFO]** ' + ctype + ' users (sorted by ' + result + '):' + linesep + '```'
@@ -82,7 +127,6 @@ class Stats(BaseCog):
         BaseCog.check_forbidden_characters(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
 
         result = self.get_check_result_string(command, 'Bottom ten')
 
@@ -93,18 +137,17 @@ class Stats(BaseCog):
         if not command:
             command = 'balance'
 
-        bottom_ten = (sorted(main_db.all(), key=itemgetter(command))[:10])[::-1]
+        bottom_ten = economy.accounts.columns.bottom(command, 10)[::-1]
         indent = 0
 
         try:
-            indent = max(len(entry['user']) for entry in bottom_ten)
+            indent = max(len(username) for username, value in bottom_ten)
         except ValueError:
             await self.bot.post_message(self.bot.bot_channel, 'There are no users.')
             return
 
-        for entry in bottom_ten:
-            username = entry['user']
-            result += linesep + username.ljust(indent) + '  ' + str(entry[command])
+        for username, value in bottom_ten:
+            result += linesep + username.ljust(indent) + '  ' + str(value)
 
         result += '```'
 
@@ -120,7 +163,6 @@ class Stats(BaseCog):
         BaseCog.check_forbidden_characters(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
 
         result = self.get_check_result_string(command, 'Top ten')
 
@@ -131,18 +173,17 @@ class Stats(BaseCog):
         if not command:
             command = 'balance'
 
-        top_ten = sorted(main_db.all(), key=itemgetter(command), reverse=True)[:10]
+        top_ten = economy.accounts.columns.top(command, 10)
         indent = 0
 
         try:
-            indent = max(len(entry['user']) for entry in top_ten)
+            indent = max(len(username) for username, value in top_ten)
         except ValueError:
             await self.bot.post_message(self.bot.bot_channel, 'There are no users.')
             return
 
-        for entry in top_ten:
-            username = entry['user']
-            result += linesep + username.ljust(indent) + '  ' + str(entry[command])
+        for username, value in top_ten:
+            result += linesep + username.ljust(indent) + '  ' + str(value)
 
         result += '```'
 
@@ -150,43 +191,106 @@ class Stats(BaseCog):
 
 
     @commands.command()
-    async def all(self, context, command=None):
-        """Shows all users in descending order, sorted by a given aspect. If no argument is given, balance is used. Other options: given, received, br_wins, br_score, br_winnings, brs, duel_wins, duel_winnings, duels, races, first_place_bets, race_winnings, gambling_profit."""
+    async def all(self, context, command=None, page=None):
+        """Shows all users in descending order, sorted by a given aspect, one page at a time. If no argument is given, balance is used. Other options: given, received, br_wins, br_score, br_winnings, brs, duel_wins, duel_winnings, duels, races, first_place_bets, race_winnings, gambling_profit. Usage: !all [aspect] [page]"""
 
         BaseCog.check_main_server(self, context)
         BaseCog.check_bot_channel(self, context)
         BaseCog.check_forbidden_characters(self, context)
 
         economy = BaseCog.load_dependency(self, 'Economy')
-        main_db = economy.main_db
 
-        result = self.get_check_result_string(command, 'All')
+        # !all 2 shows the second page sorted by balance
+        if page is None and command is not None and command.isdigit():
+            command, page = None, command
 
-        if result is None:
+        label = self.get_label(command)
+
+        if label is None:
             await self.bot.post_error(context, 'I don\'t have any info on that.')
             return
 
+        try:
+            page = int(page) if page is not None else 1
+        except ValueError:
+            await self.bot.post_error(context, 'Page number must be an integer.')
+            return
+
         if not command:
             command = 'balance'
 
-        all_users = sorted(main_db.all(), key=itemgetter(command), reverse=True)
-        indent = 0
+        amnt_users = len(economy.accounts.columns)
 
-        try:
-            indent = max(len(entry['user']) for entry in all_users)
-        except ValueError:
+        if amnt_users < 1:
+            await self.bot.post_message(self.bot.bot_channel, 'There are no users.')
+            return
+
+        amnt_pages = (amnt_users + self.all_page_size - 1) // self.all_page_size
+
+        if page < 1 or page > amnt_pages:
+            await self.bot.post_error(context, 'Invalid page number. Please choose a number between 1 and ' + str(amnt_pages) + '.')
+            return
+
+        # Only the rows of the requested page are read from the (already sorted) leaderboard
+        first = (page - 1) * self.all_page_size
+        users = economy.accounts.columns.range(command, first, first + self.all_page_size)
+
+        if not users:
             await self.bot.post_message(self.bot.bot_channel, 'There are no users.')
             return
 
-        for entry in all_users:
-            username = entry['user']
-            result += linesep + username.ljust(indent) + '  ' + str(entry[command])
+        indent = max(len(username) for username, value in users)
+        rank_indent = len(str(first + len(users)))
+
+        result = '**[INFO]** All users (sorted by ' + label + '), page ' + str(page) + ' of ' + str(amnt_pages) + ':' + linesep + '```'
+
+        for position, (username, value) in enumerate(users, first + 1):
+            result += linesep + str(position).rjust(rank_indent) + '  ' + username.ljust(indent) + '  ' + str(value)
 
         result += '```'
 
+        if page < amnt_pages:
+            result += 'Type !all ' + command + ' ' + str(page + 1) + ' for the next page.'
+
         await self.bot.post_message(self.bot.bot_channel, result)
 
 
+    @commands.command()
+    async def rank(self, context, user, command=None):
+        """Shows the rank of _user_ among all users for a given aspect. If no aspect is given, balance is used. Other options: given, received, br_wins, br_score, br_winnings, brs, duel_wins, duel_winnings, duels, races, first_place_bets, race_winnings, gambling_profit."""
+
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_forbidden_characters(self, context)
+
+        economy = BaseCog.load_dependency(self, 'Economy')
+
+        label = self.get_label(command)
+
+        if label is None:
+            await self.bot.post_error(context, 'I don\'t have any info on that.')
+            return
+
+        if not command:
+            command = 'balance'
+
+        user_pukcab = user
+        user = BaseCog.map_user(self, user)
+
+        if not economy.accounts.contains(user):
+            await self.bot.post_error(context, 'User ' + user_pukcab + ' has not been added yet. They need to type !add to initialize their account.' + BaseCog.suggest_users(self, user_pukcab))
+            return
+
+        result = economy.accounts.rank(user, command)
+
+        if result is None:
+            await self.bot.post_error(context, 'I don\'t have any info on that.')
+            return
+
+        rank, value = result
+        await self.bot.post_message(self.bot.bot_channel, '**[INFO]** ' + user + ' ranks #' + str(rank) + ' of ' + str(len(economy.accounts.columns)) + ' users by ' + label + ' (' + str(value) + ').')
+
+
     @commands.command()
     async def trivia(self, context):
         """Shows some global statistical information."""
@@ -200,7 +304,7 @@ class Stats(BaseCog):
         for cog_name, cog in self.bot.cogs.items():
 
             try:
-                part_result = cog.extend_trivia_output(self.trivia_table)
+                part_result = cog.extend_trivia_output(self.trivia)
 
                 if part_result:
                     result += part_result
@@ -214,6 +318,91 @@ class Stats(BaseCog):
         await self.bot.post_message(self.bot.bot_channel, result)
 
 
+    def summarize_season(self, season_trivia_table, season_main_db):
+        """Aggregates of a past season for !season, computed in a single pass over its main_db:
+
+            'users': amount of users
+            'trivia': the trivia table's entries by name
+            'most': for every numeric account field, {'user': ..., field: value} of the (first) user with the highest value
+
+        Cogs add aggregates of their own with extend_season_summary.
+        """
+
+        most = {}
+        amnt_users = 0
+
+        for account in season_main_db.all():
+            amnt_users += 1
+
+            for field, value in account.items():
+                if isinstance(value, int) and (field not in most or value > most[field][field]):
+                    most[field] = {'user': account['user'], field: value}
+
+        summary = {'users': amnt_users, 'trivia': {entry['name']: dict(entry) for entry in season_trivia_table.all()}, 'most': most}
+
+        for cog_name, cog in self.bot.cogs.items():
+            cog.extend_season_summary(season_trivia_table, season_main_db, summary)
+
+        return summary
+
+
+    def season_summary(self, index, rebuild=False):
+        """The summary of season _index_ + 1. It is computed (and stored next to the archive) on first use, or when _rebuild_ is set."""
+
+        summary = None if rebuild else self.season_tables.summary(index)
+
+        if summary is None:
+            start = time.perf_counter()
+            season_main_db, season_trivia_table = self.season_tables[index]
+            summary = self.season_tables.store_summary(index, self.summarize_season(season_trivia_table, season_main_db))
+            log.info('Built summary of season ' + str(index + 1) + ' in %1.3fs', time.perf_counter() - start)
+
+        return summary
+
+
+    def snapshot_season(self):
+        """Copy the tables that make up the current season (ARCHIVED_TABLES). Doesn't await, so no command can change them in between."""
+
+        # Documents are never changed in place (see ObservedTable), so copying the dicts is enough
+        self.trivia.flush()
+        return {name: {document.doc_id: dict(document) for document in self.bot.database.table(name).all()} for name in ARCHIVED_TABLES}
+
+
+    def write_season(self, path, snapshot):
+        """Write a season snapshot to _path_ in the database format and compute its summary. Runs in an executor; only touches the snapshot."""
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        storage_for_format(config.database_format)(path).write(snapshot)
+
+        season_db = TinyDB(storage=MemoryStorage)
+        season_db.storage.write(snapshot)
+        return self.summarize_season(season_db.table('trivia_table'), season_db.table('main_db'))
+
+
+    async def archive_season(self, snapshot):
+        """Store a finished season (see snapshot_season) in the seasons path and make it available to !season right away.
+        The archive is written in an executor, so commands keep running meanwhile. Returns the new season's number.
+        """
+
+        number = len(self.season_tables) + 1
+        filename = 'season' + str(number).zfill(3) + '.json'
+
+        while os.path.exists(os.path.join(self.seasons_path, filename)) or os.path.exists(os.path.join(self.seasons_path, filename[:-len('.json')] + '.sqlite3')):
+            number += 1
+            filename = 'season' + str(number).zfill(3) + '.json'
+
+        if self.season_tables.filenames and filename < self.season_tables.filenames[-1]:
+            log.warning('New season archive ' + filename + ' sorts before ' + self.season_tables.filenames[-1] + '; seasons will be numbered differently after a restart')
+
+        start = time.perf_counter()
+        summary = await self.bot.loop.run_in_executor(None, self.write_season, os.path.join(self.seasons_path, filename), snapshot)
+        index = self.season_tables.add(filename)
+        self.season_tables.store_summary(index, summary)
+
+        log.info('Archived season ' + str(index + 1) + ' as ' + filename + ' in %1.3fs', time.perf_counter() - start)
+        return index + 1
+
+
     @commands.command()
     async def season(self, context, number):
         """Shows statistical information about (previous) season _number_."""
@@ -234,14 +423,13 @@ class Stats(BaseCog):
         elif number < 1 or number > amnt_seasons:
             await self.bot.post_error(context, 'Invalid season number. Please choose a number between 1 and ' + str(amnt_seasons) + '.')
         else:
-            season_trivia_table = self.season_tables[number - 1][1]
-            season_main_db = self.season_tables[number - 1][0]
+            summary = self.season_summary(number - 1)
 
             result = '```Season ' + str(number) + linesep + linesep
 
             for cog_name, cog in self.bot.cogs.items():
                 try:
-                    part_result = cog.extend_season_output(number, season_trivia_table, season_main_db, self.season_tables)
+                    part_result = cog.extend_season_output(number, summary)
 
                     if part_result:
                         result += part_result
@@ -253,6 +441,26 @@ class Stats(BaseCog):
             await self.bot.post_message(self.bot.bot_channel, result)
 
 
+    @commands.command()
+    async def rebuildsummaries(self, context):
+        """[ADMINS ONLY] Recomputes the stored summaries of all previous seasons, e.g. after a cog's season output changed."""
+
+        BaseCog.check_main_server(self, context)
+        BaseCog.check_bot_channel(self, context)
+        BaseCog.check_admin(self, context)
+        BaseCog.check_forbidden_characters(self, context)
+
+        start = time.perf_counter()
+
+        for index in range(len(self.season_tables)):
+            self.season_summary(index, rebuild=True)
+
+            # Each season is read from disk; let other commands run in between
+            await asyncio.sleep(0)
+
+        await self.bot.post_message(self.bot.bot_channel, '**[INFO]** Rebuilt the summaries of ' + str(len(self.season_tables)) + ' seasons in %1.2fs.' % (time.perf_counter() - start))
+
+
 def setup(bot):
     """Stats cog load."""
     bot.add_cog(Stats(bot))
@@ -4,6 +4,7 @@ from discord.ext import commands
 #from os import environ
 import asyncio
 import datetime
+import time
 from conf import config
 from .base_cog import BaseCog
 
@@ -46,6 +47,26 @@ class TimedEvents(BaseCog):
         self.timed_events.append(event)
 
 
+    def daily_reset(self):
+        """Reset all accounts for the new day in a single pass over main_db: each cog first prepares the reset (prepare_daily_reset),
+        then changes every account in turn (extend_daily_reset), in the order the cogs were loaded. All changes are written at once.
+        Returns the number of changed accounts.
+        """
+
+        economy = BaseCog.load_dependency(self, 'Economy')
+        cogs = list(self.bot.cogs.values())
+
+        def reset_account(account):
+            for cog in cogs:
+                cog.extend_daily_reset(account)
+
+        with self.bot.database.batch():
+            for cog in cogs:
+                cog.prepare_daily_reset()
+
+            return economy.accounts.update_all(reset_account)
+
+
     async def timed_task(self):
         """Asynchronous timer loop that executes a set of tasks at a specific time. Examples are paying back loans, resetting free points, or printing holidays."""
 
@@ -57,9 +78,15 @@ class TimedEvents(BaseCog):
                 self.time_until_execute = 86400  # 1 Day
 
                 try:
-                    # Execute all registered events:
+                    start = time.perf_counter()
+                    amnt_changed = self.daily_reset()
+                    reset_time = time.perf_counter() - start
+
+                    # Execute all registered events, i.e. announcements based on the reset:
                     for event in self.timed_events:
                         await event()
+
+                    log.info('Daily reset changed ' + str(amnt_changed) + ' accounts in %1.3fs, timed events took %1.3fs in total', reset_time, time.perf_counter() - start)
                 except Exception as e:
                     await self.bot.post_message(self.bot.bot_channel, '**[ERROR]** Oh no, something went wrong. ' + config.additional_error_message)
                     log.fatal('EXCEPTION OCCURRED WHILE EXECUTING TIMED EVENT:')
@@ -72,6 +99,7 @@ class TimedEvents(BaseCog):
     def cog_unload(self):
         """Cancel timed event on cog unload."""
         self.timed_task.cancel()
+        BaseCog.cog_unload(self)
 
 
 def setup(bot):
@@ -0,0 +1,132 @@
+import logging
+import datetime
+import time
+
+log = logging.getLogger(__name__)
+
+__all__ = ('Trivia',)
+
+
+class Trivia:
+    """Trivia entries (counters and records like highest_duel) by name, kept in memory and written to trivia_table in batches.
+
+    Each entry looks like a row of trivia_table: {'name': ..., 'value': ..., 'person1': ..., 'person2': ..., 'date': ...}.
+    Changes only touch the in-memory entries; flush() writes all changed entries back to the table at once. It is called
+    automatically after _flush_changes_ changes, and periodically by Stats. Changes since the last flush are lost
+    if the bot crashes, which is acceptable for trivia. The same goes for a rolled back database batch: the entries are
+    reloaded, so changes made inside the batch are undone along with those not flushed before it.
+    """
+
+    def __init__(self, table, flush_changes=20):
+        self.table = table
+        self.flush_changes = flush_changes
+        self.reload()
+
+        self.total_changes = 0
+        self.total_flushes = 0
+        self.flush_time = 0.0
+        table.add_listener(self.on_change)
+
+
+    def reload(self):
+        """Read all entries from the table. Unflushed changes are dropped."""
+
+        self.entries = {}
+        self.doc_ids = {}
+        self.dirty = set()
+        self.unflushed = 0
+
+        for document in self.table.all():
+            self.entries[document['name']] = dict(document)
+            self.doc_ids[document['name']] = document.doc_id
+
+
+    def on_change(self, event, doc_ids, fields):
+        # Note: Our own flushes change nothing we don't already know
+        if event in ('reload', 'purge'):
+            self.reload()
+
+
+    def add(self, name):
+        """Create the entry _name_, unless it already exists."""
+
+        if name not in self.entries:
+            self.entries[name] = {'name': name, 'value': 0, 'person1': '', 'person2': '', 'date': ''}
+            self._changed(name)
+
+
+    def get(self, name):
+        """A copy of the entry _name_, or None."""
+
+        entry = self.entries.get(name)
+        return dict(entry) if entry is not None else None
+
+
+    def value(self, name):
+        return self.entries[name]['value']
+
+
+    def increment(self, name, amount=1):
+        self.entries[name]['value'] += amount
+        self._changed(name)
+
+
+    def record(self, name, value, person1, person2='None'):
+        """Make _value_ the new record _name_ (held by _person1_ and _person2_) if it is higher than the current one. Returns whether it was."""
+
+        entry = self.entries[name]
+
+        if value <= entry['value']:
+            return False
+
+        entry.update({'value': value, 'person1': person1, 'person2': person2, 'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")})
+        self._changed(name)
+        return True
+
+
+    def _changed(self, name):
+        self.dirty.add(name)
+        self.unflushed += 1
+        self.total_changes += 1
+
+        if self.unflushed >= self.flush_changes:
+            self.flush()
+
+
+    def flush(self):
+        """Write all changed entries to the table, as a single write."""
+
+        if not self.dirty:
+            return
+
+        start = time.perf_counter()
+        new = [name for name in self.dirty if name not in self.doc_ids]
+        changed = [name for name in self.dirty if name in self.doc_ids]
+
+        if changed:
+            self.table.write_back([dict(self.entries[name]) for name in changed], [self.doc_ids[name] for name in changed])
+
+        if new:
+            for name, doc_id in zip(new, self.table.insert_multiple([dict(self.entries[name]) for name in new])):
+                self.doc_ids[name] = doc_id
+
+        self.dirty = set()
+        self.unflushed = 0
+        self.total_flushes += 1
+        self.flush_time += time.perf_counter() - start
+
+
+    def reset(self):
+        """Empty the table and all entries, e.g. at the end of a season. Entries have to be added again."""
+
+        self.table.purge()
+
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'changes': self.total_changes,
+            'flushes': self.total_flushes,
+            'unflushed': self.unflushed,
+            'flush_time': self.flush_time
+        }
@@ -0,0 +1,277 @@
+import logging
+import bisect
+from database import FieldIndex
+
+log = logging.getLogger(__name__)
+
+__all__ = ('UserResolver', 'BKTree', 'edit_distance')
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between _a_ and _b_.
+
+    Uses Myers' bit-parallel algorithm: each column of the distance matrix is kept as bit vectors of +1/-1 steps in one
+    integer, so comparing two names takes one pass over the longer one instead of filling the whole matrix.
+    """
+
+    if len(a) < len(b):
+        a, b = b, a
+
+    if not b:
+        return len(a)
+
+    peq = {}
+
+    for i, char in enumerate(b):
+        peq[char] = peq.get(char, 0) | (1 << i)
+
+    mask = (1 << len(b)) - 1
+    last = 1 << (len(b) - 1)
+    pv = mask
+    mv = 0
+    distance = len(b)
+
+    for char in a:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+
+    return distance
+
+
+class BKTree:
+    """Burkhard-Keller tree of strings, to find all terms within a given edit distance without comparing against every term.
+
+    Terms can't be removed; callers filter out terms that no longer exist and rebuild the tree once too many have piled up.
+    """
+
+    def __init__(self, terms=()):
+        self.root = None
+        self.size = 0
+
+        for term in terms:
+            self.add(term)
+
+
+    def add(self, term):
+        if self.root is None:
+            self.root = (term, {})
+            self.size = 1
+            return
+
+        node = self.root
+
+        while True:
+            distance = edit_distance(term, node[0])
+
+            if distance == 0:
+                return
+
+            child = node[1].get(distance)
+
+            if child is None:
+                node[1][distance] = (term, {})
+                self.size += 1
+                return
+
+            node = child
+
+
+    def search(self, term, max_distance):
+        """[(distance, term)] of all terms within _max_distance_ of _term_."""
+
+        result = []
+        stack = [self.root] if self.root is not None else []
+
+        while stack:
+            node_term, children = stack.pop()
+            distance = edit_distance(term, node_term)
+
+            if distance <= max_distance:
+                result.append((distance, node_term))
+
+            # Triangle inequality: only children at distance d with |d - distance| <= max_distance can contain matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+
+        return result
+
+
+class UserResolver(FieldIndex):
+    """Resolves what users type for a username (in any case, or a shortcut) to the username as it appears in main_db.
+
+    Keeps case-folded usernames and shortcuts in dicts, updated through main_db's listeners like any FieldIndex, so resolving
+    never scans main_db. For unknown names, suggest() offers similar usernames and shortcuts: ones starting with what was typed
+    (from a sorted list of all folded names) and ones within a small edit distance (from a BK-tree).
+    """
+
+    def __init__(self, main_db, shortcuts=None):
+        self.shortcuts = {} # folded shortcut -> username
+        self.shortcut_names = {} # folded shortcut -> shortcut as registered
+        super().__init__(main_db, 'user')
+        self.set_shortcuts(shortcuts or {})
+
+
+    def rebuild(self):
+        self.folded = {} # folded username -> usernames with that folded form, in the order they were added
+        self.sorted_terms = []
+        self.tree = None # Built on the first suggest(), as only mistyped names need it
+        self.stale_terms = 0
+        super().rebuild()
+
+        for shortcut in self.shortcuts:
+            self._add_term(shortcut)
+
+
+    def _add(self, doc_id, value):
+        super()._add(doc_id, value)
+
+        if isinstance(value, str):
+            folded = value.casefold()
+            self.folded.setdefault(folded, []).append(value)
+            self._add_term(folded)
+
+
+    def _remove(self, doc_id):
+        value = self.values.get(doc_id)
+        super()._remove(doc_id)
+
+        if isinstance(value, str):
+            folded = value.casefold()
+            users = self.folded.get(folded, [])
+
+            if value in users:
+                users.remove(value)
+
+            if not users:
+                self.folded.pop(folded, None)
+                self._remove_term(folded)
+
+
+    def on_change(self, event, doc_ids, fields):
+        # Start over after a purge (e.g. at the end of a season), keeping the shortcuts
+        if event == 'purge':
+            self.rebuild()
+        else:
+            super().on_change(event, doc_ids, fields)
+
+
+    def _add_term(self, term):
+        index = bisect.bisect_left(self.sorted_terms, term)
+
+        if index < len(self.sorted_terms) and self.sorted_terms[index] == term:
+            return
+
+        self.sorted_terms.insert(index, term)
+
+        if self.tree is not None:
+            self.tree.add(term)
+
+
+    def _remove_term(self, term):
+        if term in self.folded or term in self.shortcuts:
+            return
+
+        index = bisect.bisect_left(self.sorted_terms, term)
+
+        if index < len(self.sorted_terms) and self.sorted_terms[index] == term:
+            del self.sorted_terms[index]
+            self.stale_terms += 1
+
+        # The tree still contains removed terms (suggest() skips them); start over once they make up half of it
+        if self.tree is not None and self.stale_terms * 2 > self.tree.size:
+            self.tree = None
+
+
+    def set_shortcuts(self, shortcuts):
+        """Replace all shortcuts with _shortcuts_ ({shortcut: username}, as stored in user_shortcuts.json)."""
+
+        old = list(self.shortcuts)
+        self.shortcuts = {}
+        self.shortcut_names = {}
+
+        for term in old:
+            self._remove_term(term)
+
+        for shortcut, user in shortcuts.items():
+            self.set_shortcut(shortcut, user)
+
+
+    def set_shortcut(self, shortcut, user):
+        folded = shortcut.casefold()
+
+        # As before, the first of several shortcuts differing only in case wins
+        if folded not in self.shortcuts:
+            self.shortcuts[folded] = user
+            self.shortcut_names[folded] = shortcut
+            self._add_term(folded)
+
+
+    def resolve(self, user):
+        """The username _user_ refers to: an exact username, a username in another case or a shortcut (in any case), checked
+        in that order. Unknown names are returned unchanged.
+        """
+
+        if user in self.doc_ids:
+            return user
+
+        folded = user.casefold()
+        users = self.folded.get(folded)
+
+        if users:
+            return users[0]
+
+        return self.shortcuts.get(folded, user)
+
+
+    def _display_name(self, term):
+        if term in self.folded:
+            return self.folded[term][0]
+
+        return self.shortcut_names[term]
+
+
+    def suggest(self, user, limit=3, max_distance=2):
+        """Up to _limit_ known usernames and shortcuts that _user_ might have meant: names starting with it first, then names
+        within _max_distance_ edits, closest first.
+        """
+
+        folded = user.casefold()
+        result = []
+
+        if folded:
+            start = bisect.bisect_left(self.sorted_terms, folded)
+            stop = bisect.bisect_left(self.sorted_terms, folded + '\U0010ffff')
+            result = self.sorted_terms[start:min(stop, start + limit)]
+
+        if len(result) < limit:
+            if self.tree is None:
+                self.tree = BKTree(self.sorted_terms)
+                self.stale_terms = 0
+
+            # Short names are within two edits of almost anything
+            max_distance = min(max_distance, (len(folded) + 1) // 3)
+            matches = sorted(match for match in self.tree.search(folded, max_distance) if match[1] in self.folded or match[1] in self.shortcuts)
+
+            for distance, term in matches:
+                if term not in result:
+                    result.append(term)
+
+                if len(result) >= limit:
+                    break
+
+        return [self._display_name(term) for term in result]
+
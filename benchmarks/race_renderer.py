@@ -0,0 +1,98 @@
+"""Benchmark: horse race frames rendered per second, building every lane character by character (as Horserace used to) vs. RaceRenderer.
+
+Run from the bot's root directory: python3 benchmarks/race_renderer.py [amount of horses] [race length]
+"""
+import os
+import random
+import sys
+import time
+from os import linesep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Cogs.race_engine import RaceRenderer, TRACK_HEADER
+
+
+def render_per_character(names, emotes, positions, horse_positions, placements):
+    """The frame rendering loop of Horserace.horserace before RaceRenderer."""
+
+    ctr = 0
+    update = TRACK_HEADER
+
+    for h in names:
+        update += linesep
+        ctr += 1
+        horse_position = horse_positions[ctr - 1]
+        emoj = emotes[ctr - 1]
+
+        if horse_position == 0:
+            update += '| '
+
+            for i in range(1, positions):
+                update += '-'
+
+            update += ' | ' + emoj + ' ' + str(ctr) + ' ' + h
+        elif horse_position >= positions:
+            update += '' + emoj + ' | '
+
+            for i in range(1, positions):
+                update += '-'
+
+            update += ' | ' + str(ctr) + ' ' + h
+
+            if placements.index(ctr) == 0:
+                update += ' :first_place:'
+            elif placements.index(ctr) == 1:
+                update += ' :second_place:'
+            elif placements.index(ctr) == 2:
+                update += ' :third_place:'
+        else:
+            update += '| '
+
+            for i in range(1, positions - horse_position):
+                update += '-'
+
+            update += ' ' + emoj + ' '
+
+            for i in range(0, horse_position - 1):
+                update += '-'
+
+            update += ' | ' + str(ctr) + ' ' + h
+
+    return update
+
+
+def make_frames(amnt_horses, length, amnt_frames):
+    frames = []
+
+    for i in range(amnt_frames):
+        positions = [random.randint(0, length + 2) for h in range(amnt_horses)]
+        placements = [number for number, position in enumerate(positions, 1) if position >= length]
+        random.shuffle(placements)
+        frames.append((positions, placements))
+
+    return frames
+
+
+if __name__ == '__main__':
+    amnt_horses = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 69
+    names = ['Horse ' + str(i + 1) for i in range(amnt_horses)]
+    emotes = [':horse_' + str(i + 1) + ':' for i in range(amnt_horses)]
+    frames = make_frames(amnt_horses, length, 2000)
+    renderer = RaceRenderer(names, emotes, length)
+
+    # Both have to draw exactly the same race
+    for positions, placements in frames:
+        assert renderer.render(positions, placements) == render_per_character(names, emotes, length, positions, placements)
+
+    print(str(amnt_horses) + ' horses, race length ' + str(length))
+
+    for name, render in (('per character', lambda positions, placements: render_per_character(names, emotes, length, positions, placements)), ('RaceRenderer', renderer.render)):
+        start = time.perf_counter()
+
+        for positions, placements in frames:
+            render(positions, placements)
+
+        elapsed = time.perf_counter() - start
+        print(name.ljust(13) + '  ' + ('%10.0f' % (len(frames) / elapsed)) + ' frames/s')
@@ -0,0 +1,75 @@
+"""Benchmark: startup time and peak memory of opening every season archive up front vs. SeasonArchives, which only finds them.
+
+Run from the bot's root directory: python3 benchmarks/season_archives.py [amount of seasons] [users per season]
+Each variant runs in a process of its own, since peak memory (ru_maxrss) can only grow.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def startup(variant, path):
+    from Cogs.season_archives import SeasonArchives
+    from tinydb import TinyDB
+
+    start = time.perf_counter()
+
+    if variant == 'eager':
+        # What Stats used to do: open every season up front (plain TinyDB reads the file again on every query)
+        seasons = []
+
+        for filename in sorted(os.listdir(path)):
+            database = TinyDB(os.path.join(path, filename))
+            seasons.append((database.table('main_db'), database.table('trivia_table')))
+    else:
+        seasons = SeasonArchives(path)
+
+    startup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main_db, trivia_table = seasons[len(seasons) - 1]
+
+    # Roughly what one !season does: a few full scans of main_db
+    for i in range(8):
+        main_db.all()
+
+    first_access = time.perf_counter() - start
+
+    start = time.perf_counter()
+
+    for i in range(8):
+        main_db.all()
+
+    second_access = time.perf_counter() - start
+
+    print(variant.ljust(6) + '  startup ' + ('%8.1f' % (startup_time * 1e3)) + ' ms  first !season ' + ('%7.1f' % (first_access * 1e3)) + ' ms  next !season ' + ('%7.1f' % (second_access * 1e3)) + ' ms  peak memory ' + ('%6.1f' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)) + ' MB')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] in ('eager', 'lazy'):
+        startup(sys.argv[1], sys.argv[2])
+        sys.exit()
+
+    import storage
+    from serialization import make_data
+
+    amnt_seasons = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    amnt_users = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    print(str(amnt_seasons) + ' seasons with ' + str(amnt_users) + ' users each')
+
+    with tempfile.TemporaryDirectory() as directory:
+        serialized = storage.dump(make_data(amnt_users), 'json')
+
+        for i in range(amnt_seasons):
+            with open(os.path.join(directory, 'season' + str(i + 1).zfill(3) + '.json'), 'wb') as season_file:
+                season_file.write(serialized)
+
+        for variant in ('eager', 'lazy'):
+            subprocess.run([sys.executable, os.path.abspath(__file__), variant, directory], check=True, cwd=ROOT)
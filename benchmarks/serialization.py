@@ -0,0 +1,55 @@
+"""Benchmark: dump/load time and file size of a generated 50k-user database as JSON and as MessagePack.
+
+Run from the bot's root directory: python3 benchmarks/serialization.py [amount of users]
+"""
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage
+
+
+def make_data(amnt_users):
+    """Database contents shaped like the real thing: main_db accounts as created by Economy.add, plus a few small tables."""
+
+    generator = random.Random(42)
+    main_db = {}
+
+    for i in range(amnt_users):
+        main_db[i + 1] = {'user': 'user' + str(i), 'balance': generator.randint(0, 5000), 'free': generator.randint(0, 15), 'given': generator.randint(0, 2000), 'received': generator.randint(0, 2000), 'loan': 0, 'gambling_profit': generator.randint(-2000, 2000), 'duel_wins': generator.randint(0, 50), 'duel_winnings': generator.randint(0, 500), 'duels': generator.randint(0, 100), 'races': generator.randint(0, 100), 'first_place_bets': generator.randint(0, 30), 'top_three_bets': generator.randint(0, 60), 'race_winnings': generator.randint(-500, 500), 'horse_bets': [generator.randint(0, 10) for horse in range(10)], 'brs': generator.randint(0, 50), 'br_score': generator.randint(0, 500), 'br_wins': generator.randint(0, 10), 'br_winnings': generator.randint(0, 500), 'holiday': 0}
+
+    trivia_table = {i + 1: {'name': 'trivia' + str(i), 'value': i, 'person1': 'user1', 'person2': 'None', 'date': '2020-01-01 12:00'} for i in range(20)}
+    horses = {i + 1: {'name': 'horse' + str(i), 'race_wins': 0, '2nd': 0, '3rd': 0, '4th': 0, '5th': 0, '6th': 0, '7th': 0, '8th': 0, '9th': 0, '10th': 0, 'total_bets': 0} for i in range(10)}
+    return {'main_db': main_db, 'trivia_table': trivia_table, 'horses': horses}
+
+
+def run(format, data, repeat):
+    serialized = storage.dump(data, format)
+    dump_time = min(timeit.repeat(lambda: storage.dump(data, format), number=1, repeat=repeat))
+    load_time = min(timeit.repeat(lambda: storage.load(serialized), number=1, repeat=repeat))
+
+    # A full write through the storage class, i.e. including the temporary file, fsync and rename
+    with tempfile.TemporaryDirectory() as directory:
+        target = storage.storage_for_format(format)(os.path.join(directory, 'economy.db'))
+        write_time = min(timeit.repeat(lambda: target.write(data), number=1, repeat=repeat))
+
+    print(format.ljust(8) + '  dump ' + ('%7.1f' % (dump_time * 1e3)) + ' ms  load ' + ('%7.1f' % (load_time * 1e3)) + ' ms  write ' + ('%7.1f' % (write_time * 1e3)) + ' ms  size ' + ('%7.2f' % (len(serialized) / 1e6)) + ' MB')
+    return dump_time, load_time, len(serialized)
+
+
+if __name__ == '__main__':
+    amnt_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    data = make_data(amnt_users)
+    print(str(amnt_users) + ' users')
+
+    json_dump, json_load, json_size = run('json', data, 5)
+
+    if storage.msgpack is None:
+        print('msgpack is not installed, skipping MessagePack (pip install msgpack)')
+    else:
+        msgpack_dump, msgpack_load, msgpack_size = run('msgpack', data, 5)
+        print('msgpack vs. json: dump ' + ('%1.1fx' % (json_dump / msgpack_dump)) + ' faster, load ' + ('%1.1fx' % (json_load / msgpack_load)) + ' faster, ' + ('%1.0f%%' % (100 * msgpack_size / json_size)) + ' of the size')
@@ -0,0 +1,40 @@
+"""Micro-benchmark: looking up users in main_db with a TinyDB query scan vs. the account index.
+
+Run from the bot's root directory: python3 benchmarks/user_index.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tinydb import Query
+from database import Database
+from Cogs.accounts import Accounts
+
+
+def make_database(path, amnt_users):
+    database = Database(path, write_behind=True, flush_writes=amnt_users + 1)
+    main_db = database.table('main_db')
+    main_db.insert_multiple({'user': 'user' + str(i), 'balance': 15, 'free': 15} for i in range(amnt_users))
+    return database, main_db
+
+
+def run(amnt_users, lookups):
+    with tempfile.TemporaryDirectory() as directory:
+        database, main_db = make_database(os.path.join(directory, 'economy.json'), amnt_users)
+        accounts = Accounts(main_db, database)
+        query = Query()
+        names = ['user' + str(i * 7919 % amnt_users) for i in range(lookups)]
+
+        scan = timeit.timeit(lambda: [main_db.get(query.user == name) for name in names], number=1) / lookups
+        indexed = timeit.timeit(lambda: [accounts.get(name) for name in names], number=1) / lookups
+
+        print(str(amnt_users).rjust(7) + '  scan ' + ('%10.1f' % (scan * 1e6)) + ' us  indexed ' + ('%7.2f' % (indexed * 1e6)) + ' us  speedup ' + ('%8.0fx' % (scan / indexed)))
+        database.close()
+
+
+if __name__ == '__main__':
+    for amnt_users, lookups in ((1000, 200), (10000, 50), (100000, 10)):
+        run(amnt_users, lookups)
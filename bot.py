@@ -2,15 +2,23 @@ import logging
 import socket
 from os import linesep
 import sys 
+import time
 import asyncio
 from traceback import format_exc
 from aiohttp import AsyncResolver, ClientSession, TCPConnector
 import aiodns
 from dependency_load_error import DependencyLoadError
-import discord
 from discord.ext import commands
 from conf import config
-from tinydb import TinyDB, Query
+from tinydb import Query
+from database import open_database
+from outbox import Outbox, PRIORITY_HIGH, PRIORITY_NORMAL
+from game_session import GameSessions
+
+try:
+    import resource
+except ImportError:
+    resource = None # Not available on Windows
 
 log = logging.getLogger(__name__)
 
@@ -21,6 +29,7 @@ class EconomyBot(commands.Bot):
 
     def __init__(self, **kwargs):
         try:
+            start = time.perf_counter()
             super().__init__(**kwargs)
 
             self.http_session = ClientSession(
@@ -28,9 +37,29 @@ class EconomyBot(commands.Bot):
             )
 
             # Main database for current season
-            self.database = TinyDB(config.database)
+            self.database = open_database(config.database, config.database_backend, tables=config.database_tables, write_behind=config.database_write_behind, flush_interval=config.database_flush_interval, flush_writes=config.database_flush_writes, journal=config.database_journal, journal_sync_writes=config.database_journal_sync_writes, format=config.database_format, background_writes=config.database_background_writes, max_backlog=config.database_max_backlog)
             self.query = Query()
-            log.info('Main database loaded')
+
+            # All messages are sent through per-channel queues that respect Discord's rate limits, see post_message
+            self.outbox = Outbox(self.loop, rate=config.message_rate, per=config.message_rate_period, max_attempts=config.repost_attempts, retry_delay=config.message_retry_delay)
+
+            # Running games (horse races, battle royales, duels), each with a state of its own; see game_session.py
+            self.sessions = GameSessions()
+            database_stats = self.database.stats()
+
+            if 'journal' in database_stats:
+                log.info('Main database loaded, replayed %d journal records in %1.3fs', database_stats['journal']['replayed_records'], database_stats['journal']['replay_time'])
+            else:
+                log.info('Main database loaded')
+
+            # With write-behind enabled, pending writes are flushed periodically (and always on shutdown, see close())
+            self.database_flush_task = None
+
+            if config.database_write_behind and config.database_backend != 'sqlite':
+                self.database_flush_task = self.loop.create_task(self.flush_database())
+
+            # Commands wait here if the database's background writer falls behind
+            self.before_invoke(self.wait_for_database)
 
             self.info_text = ''
             self.info_text += linesep + linesep + config.description
@@ -66,6 +95,11 @@ class EconomyBot(commands.Bot):
                 log.fatal('Summary:\n Num failed extension loads: %d', amnt_failed)
                 sys.exit()
 
+            if resource is not None:
+                log.info('Startup took %1.3fs, peak resident memory: %1.1f MB', time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+            else:
+                log.info('Startup took %1.3fs', time.perf_counter() - start)
+
             self.info_text += 'Some additional information:' + linesep + '  Please be aware of the fact that there may be bugs in the system. There are fail-safe mechanisms, but they may not always prevent a loss of ' + config.currency_name + 's in case of an error.'
         except Exception as e:
             # If any exception occurs at this point, better not execute the thing and let the bot admin figure out what's going on.
@@ -73,6 +107,49 @@ class EconomyBot(commands.Bot):
             sys.exit()
 
 
+    async def flush_database(self):
+        """Asynchronous timer loop that periodically writes cached database changes to disk."""
+
+        while True:
+            await asyncio.sleep(self.database.flush_interval)
+
+            try:
+                self.database.flush()
+            except Exception as e:
+                log.fatal('EXCEPTION OCCURRED WHILE FLUSHING DATABASE:')
+                log.exception(e)
+
+
+    async def wait_for_database(self, context):
+        """Hook called before every command. Applies backpressure if database writes pile up."""
+        await self.database.wait_for_backlog()
+
+
+    async def close(self):
+        """Flush and close the database before shutting down."""
+
+        if self.database_flush_task is not None:
+            self.database_flush_task.cancel()
+
+        self.outbox.close()
+
+        # Cogs may keep changes in memory (e.g. trivia); let them write those before the database is closed
+        for cog_name, cog in self.cogs.items():
+            try:
+                cog.on_shutdown()
+            except Exception as e:
+                log.exception(e)
+
+        try:
+            self.database.close()
+            log.info('Main database flushed and closed')
+        except Exception as e:
+            log.fatal('EXCEPTION OCCURRED WHILE CLOSING DATABASE:')
+            log.exception(e)
+
+        await super().close()
+
+
     async def on_ready(self):
         print('Ready for use.')
         print('--------------')
@@ -117,14 +194,19 @@ class EconomyBot(commands.Bot):
             message_minus_forbidden = context.message.content.replace('@', '')
             message_minus_forbidden = message_minus_forbidden.replace('`', '')
             quote = '`' + context.message.author.name + ': ' + message_minus_forbidden + '`' + linesep + linesep
-            await self.post_message(self.bot_channel, quote + '**[ERROR]** ' + error_text + ' ' + add_error_message)
+            await self.post_message(self.bot_channel, quote + '**[ERROR]** ' + error_text + ' ' + add_error_message, priority=PRIORITY_HIGH)
         except Exception as e:
             log.fatal('EXCEPTION OCCURRED WHILE POSTING ERROR:')
             log.exception(e)
 
 
-    async def post_message(self, channel, message_text, embed = None):
-        """Has the bot post a message in the respective channel."""
+    async def post_message(self, channel, message_text, embed = None, priority = PRIORITY_NORMAL, coalesce = True):
+        """Has the bot post a message in the respective channel. Waits until the message has been sent and returns it (the last part of
+        long messages), or None if it couldn't be sent.
+
+        Messages are queued per channel and sent in order of _priority_ (see outbox.py). While they wait, messages with _coalesce_ may be
+        joined with other messages to the same channel; post messages that are edited later with coalesce=False.
+        """
 
         try:
             if embed is None:
@@ -136,6 +218,8 @@ class EconomyBot(commands.Bot):
                     message_text = message_text[:-3]
                     chunk_size = 1994
 
+                chunks = []
+
                 for i in range(0, len(message_text), chunk_size):
                     text_chunk = message_text[i:i+chunk_size]
 
@@ -143,24 +227,13 @@ class EconomyBot(commands.Bot):
                         text_chunk = '```' + text_chunk
                         text_chunk += '```'
 
-                    attempts = 0
+                    chunks.append(text_chunk)
 
-                    while attempts < config.repost_attempts:
-                        try:
-                            return await channel.send(text_chunk)
-                        except discord.errors.HTTPException:
-                            attempts += 1
-                            await asyncio.sleep(2)
+                # Queue all chunks at once, so they are sent in order; callers that edit the message later get the last chunk
+                messages = await asyncio.gather(*[self.outbox.send(channel, text_chunk, priority=priority, coalesce=coalesce) for text_chunk in chunks])
+                return messages[-1] if messages else None
             else:
-                attempts = 0
-
-                while attempts < config.repost_attempts:
-                    try:
-                        return await channel.send(embed=embed)
-                        break
-                    except discord.errors.HTTPException:
-                        attempts += 1
-                        await asyncio.sleep(2)
+                return await self.outbox.send(channel, embed=embed, priority=priority)
         except Exception as e:
             await self.bot_channel.send('**[ERROR]** A critical error occurred.' + ' ' + config.additional_error_message)
             log.fatal('EXCEPTION OCCURRED WHILE POSTING MESSAGE:')
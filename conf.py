@@ -21,11 +21,32 @@ class Config:
             self.cogs_data_path = self.config.get('Private', 'cogs_data_path', fallback='Cogs/data')
             self.logfile = self.config.get('Private', 'logfile', fallback='economy.log')
             self.database = self.config.get('Private', 'database', fallback='economy.json')
+            self.database_backend = self.config.get('Private', 'database_backend', fallback='tinydb')
+            self.database_format = self.config.get('Private', 'database_format', fallback='json')
+            self.database_write_behind = self.config.getboolean('Private', 'database_write_behind', fallback=False)
+            self.database_flush_interval = int(self.config.get('Private', 'database_flush_interval', fallback='30'))
+            self.database_flush_writes = int(self.config.get('Private', 'database_flush_writes', fallback='100'))
+            self.database_journal = self.config.get('Private', 'database_journal', fallback='')
+            self.database_journal_sync_writes = int(self.config.get('Private', 'database_journal_sync_writes', fallback='10'))
+            self.database_background_writes = self.config.getboolean('Private', 'database_background_writes', fallback=False)
+            self.database_max_backlog = int(self.config.get('Private', 'database_max_backlog', fallback='20'))
+
+            # Tables stored in files of their own, as table = path or table = path, backend
+            self.database_tables = {}
+
+            if self.config.has_section('DatabaseTables'):
+                for table, value in self.config.items('DatabaseTables'):
+                    path, _, backend = value.partition(',')
+                    self.database_tables[table] = (path.strip(), backend.strip() or self.database_backend)
+
             self.admins = self.config.get('Private', 'admins', fallback='').split(',')
             self.additional_error_message = self.config.get('Private', 'additional_error_message', fallback='')
             self.main_server = int(self.config.get('Private', 'main_server', fallback=''))
             self.additional_info_text = self.config.get('Private', 'additional_info_text', fallback='')
 
+            # Channels in which games can be played besides the bot channel
+            self.game_channel_ids = [int(channel_id) for channel_id in self.config.get('Private', 'game_channel_ids', fallback='').split(',') if channel_id.strip()]
+
             self.timezone = self.config.get('General', 'timezone', fallback='CET') # Note: This is just a string to be printed. Doesn't actually affect displayed time.
             self.description = self.config.get('General', 'description', fallback='''My Test Economy''')
             self.name = self.config.get('General', 'name', fallback='Test Economy')
@@ -37,6 +58,9 @@ class Config:
             self.trivia_ljust = int(self.config.get('General', 'trivia_ljust', fallback='39'))
             self.season_ljust = int(self.config.get('General', 'season_ljust', fallback='41'))
             self.repost_attempts = int(self.config.get('General', 'repost_attempts', fallback='30'))
+            self.message_rate = int(self.config.get('General', 'message_rate', fallback='5'))
+            self.message_rate_period = float(self.config.get('General', 'message_rate_period', fallback='5'))
+            self.message_retry_delay = float(self.config.get('General', 'message_retry_delay', fallback='2'))
 
             log.info('Finished reading server configuration from file')
         except Exception as e:
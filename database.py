@@ -0,0 +1,696 @@
+import logging
+import asyncio
+import bisect
+from array import array
+from contextlib import contextmanager, ExitStack
+from functools import partial
+from tinydb import TinyDB
+from tinydb.database import Table, Document
+from storage import WriteBehindMiddleware, storage_for_format
+from journal import Journal
+
+log = logging.getLogger(__name__)
+
+__all__ = ('Database', 'DatabaseRouter', 'ObservedTable', 'FieldIndex', 'SortedFieldIndex', 'ColumnMirror', 'open_database')
+
+
+class ObservedTable(Table):
+    """A TinyDB table that notifies listeners about changed documents, so indexes can be kept up to date without scanning the table.
+
+    Listeners are called as listener(event, doc_ids, fields) with event being one of 'insert', 'update', 'remove', 'purge' or 'reload' (table contents were restored, e.g. by a rollback).
+    Access by document ID (get(doc_id=...), update(..., doc_ids=[...])) goes straight to the cached data instead of copying the whole table.
+    """
+
+    def __init__(self, storage, name, **kwargs):
+        super().__init__(storage, name, **kwargs)
+        self.listeners = []
+
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def notify(self, event, doc_ids, fields=None):
+        for listener in self.listeners:
+            listener(event, doc_ids, fields)
+
+
+    def _raw_table(self):
+        # Note: WriteBehindMiddleware keeps the raw data in memory with integer document IDs, so this does not touch the disk
+        raw_data = self._storage._storage.read() or {}
+        return raw_data, raw_data.get(self.name, {})
+
+
+    def process_elements(self, func, cond=None, doc_ids=None, eids=None):
+        if doc_ids is None or eids is not None:
+            return super().process_elements(func, cond, doc_ids, eids)
+
+        raw_data, table = self._raw_table()
+        data = {doc_id: dict(table[doc_id]) for doc_id in doc_ids}
+
+        for doc_id in doc_ids:
+            func(data, doc_id)
+
+        # Replace the table dict rather than changing it, so the storage notices the write
+        table = dict(table)
+
+        for doc_id in doc_ids:
+            if doc_id in data:
+                table[doc_id] = data[doc_id]
+            else:
+                del table[doc_id]
+
+        raw_data[self.name] = table
+        self.clear_cache()
+        self._storage._storage.write(raw_data)
+
+        return doc_ids
+
+
+    def get(self, cond=None, doc_id=None, eid=None):
+        if doc_id is None or cond is not None:
+            return super().get(cond, doc_id, eid)
+
+        raw_data, table = self._raw_table()
+        value = table.get(doc_id)
+
+        if value is None:
+            return None
+
+        return Document(value, doc_id)
+
+
+    def insert(self, document):
+        doc_id = super().insert(document)
+        self.notify('insert', [doc_id])
+        return doc_id
+
+
+    def insert_multiple(self, documents):
+        doc_ids = super().insert_multiple(documents)
+        self.notify('insert', doc_ids)
+        return doc_ids
+
+
+    def update(self, fields, cond=None, doc_ids=None, eids=None):
+        doc_ids = super().update(fields, cond, doc_ids, eids)
+        self.notify('update', doc_ids, fields)
+        return doc_ids
+
+
+    def write_back(self, documents, doc_ids=None, eids=None):
+        if doc_ids is None:
+            doc_ids = [document.doc_id for document in documents]
+
+        documents = dict(zip(doc_ids, documents))
+        doc_ids = self.process_elements(lambda data, doc_id: data.__setitem__(doc_id, dict(documents[doc_id])), doc_ids=list(documents))
+        self.notify('update', doc_ids)
+        return doc_ids
+
+
+    def remove(self, cond=None, doc_ids=None, eids=None):
+        doc_ids = super().remove(cond, doc_ids, eids)
+        self.notify('remove', doc_ids)
+        return doc_ids
+
+
+    def purge(self):
+        super().purge()
+        self.notify('purge', [])
+
+
+class FieldIndex:
+    """Hash index mapping the value of a unique field (e.g. a username) to its document ID in an ObservedTable."""
+
+    def __init__(self, table, field):
+        self.table = table
+        self.field = field
+        self.doc_ids = {}
+        self.values = {}
+        self.rebuild()
+        table.add_listener(self.on_change)
+
+
+    def rebuild(self):
+        """Reindex the whole table."""
+
+        self.doc_ids = {}
+        self.values = {}
+
+        for doc in self.table:
+            self._add(doc.doc_id, doc.get(self.field))
+
+
+    def get(self, value):
+        """Document ID for _value_, or None."""
+        return self.doc_ids.get(value)
+
+
+    def _add(self, doc_id, value):
+        self.values[doc_id] = value
+        self.doc_ids[value] = doc_id
+
+
+    def _remove(self, doc_id):
+        value = self.values.pop(doc_id, None)
+
+        if self.doc_ids.get(value) == doc_id:
+            del self.doc_ids[value]
+
+
+    def on_change(self, event, doc_ids, fields):
+        if event == 'purge':
+            self.doc_ids = {}
+            self.values = {}
+        elif event == 'reload':
+            self.rebuild()
+        elif event == 'remove':
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+        elif isinstance(fields, dict) and self.field not in fields:
+            # Plain updates that do not touch the indexed field can't change the index
+            return
+        else:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+                doc = self.table.get(doc_id=doc_id)
+
+                if doc is not None:
+                    self._add(doc_id, doc.get(self.field))
+
+
+class SortedFieldIndex(FieldIndex):
+    """FieldIndex that also keeps all values of the (string) field in sorted order, to list them page by page or by prefix
+    without sorting the table.
+    """
+
+    def rebuild(self):
+        self.sorted_values = []
+        super().rebuild()
+
+
+    def _add(self, doc_id, value):
+        if value is not None and value not in self.doc_ids:
+            bisect.insort(self.sorted_values, value)
+
+        super()._add(doc_id, value)
+
+
+    def _remove(self, doc_id):
+        value = self.values.get(doc_id)
+        super()._remove(doc_id)
+
+        if value is not None and value not in self.doc_ids:
+            position = bisect.bisect_left(self.sorted_values, value)
+
+            if position < len(self.sorted_values) and self.sorted_values[position] == value:
+                del self.sorted_values[position]
+
+
+    def on_change(self, event, doc_ids, fields):
+        if event == 'purge':
+            self.sorted_values = []
+
+        super().on_change(event, doc_ids, fields)
+
+
+    def _prefix_bounds(self, prefix):
+        low = bisect.bisect_left(self.sorted_values, prefix)
+        high = bisect.bisect_left(self.sorted_values, prefix + '\U0010ffff') if prefix else len(self.sorted_values)
+        return low, high
+
+
+    def count(self, prefix=''):
+        """Amount of values starting with _prefix_."""
+
+        low, high = self._prefix_bounds(prefix)
+        return high - low
+
+
+    def sorted_range(self, start, stop, prefix=''):
+        """Values number _start_ to _stop_ - 1 in sorted order, among those starting with _prefix_."""
+
+        low, high = self._prefix_bounds(prefix)
+        return self.sorted_values[min(low + max(start, 0), high):min(low + stop, high)]
+
+
+class ColumnMirror:
+    """Column-oriented copy of the integer fields of an ObservedTable, for ranking documents without copying the whole table.
+
+    Every document gets a slot; each integer field (e.g. balance) is an array with one value per slot. _key_field_ (e.g. user)
+    is kept alongside to name the documents. Slots of removed documents are reused. Ranking by a field no document has returns [].
+
+    For every field, _orders_ holds the slots of all documents sorted by value, documents with equal values in descending order of
+    document ID (so top() lists the older ones first, like a stable sort of the table would). Single changes are kept sorted with a
+    binary search; changes to more than BULK_CHANGES documents at once (e.g. the daily reset) sort the changed fields again instead,
+    since every single insert into a sorted array moves the entries behind it.
+    """
+
+    BULK_CHANGES = 64
+
+    def __init__(self, table, key_field):
+        self.table = table
+        self.key_field = key_field
+        self.rebuild()
+        table.add_listener(self.on_change)
+
+
+    def rebuild(self):
+        self.slots = {} # doc_id -> slot
+        self.keys = []
+        self.doc_ids = array('q') # slot -> doc_id, for ordering equal values
+        self.free_slots = []
+        self.columns = {}
+        self.orders = {} # field -> slots, see class docstring
+
+        for doc in self.table:
+            self._set(doc.doc_id, doc, changed=set())
+
+        self._sort(self.columns)
+
+
+    def _sort(self, fields):
+        """Build orders[field] from scratch for all _fields_: one stable sort by value of the slots in descending document order."""
+
+        by_doc_id = sorted(self.slots.values(), key=self.doc_ids.__getitem__, reverse=True)
+
+        for field in fields:
+            self.orders[field] = array('q', sorted(by_doc_id, key=self.columns[field].__getitem__))
+
+
+    def _position(self, field, value, doc_id):
+        """Index of the first entry in orders[field] that doesn't come before a document _doc_id_ with _value_."""
+
+        order = self.orders[field]
+        column = self.columns[field]
+        doc_ids = self.doc_ids
+        low, high = 0, len(order)
+
+        while low < high:
+            middle = (low + high) // 2
+            other = order[middle]
+
+            if column[other] < value or (column[other] == value and doc_ids[other] > doc_id):
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+    def _set(self, doc_id, doc, changed=None):
+        """Copy the integer fields of _doc_ to its slot. Without _changed_, orders are kept sorted; otherwise the names of changed
+        fields are added to _changed_ and orders are left for _sort().
+        """
+
+        slot = self.slots.get(doc_id)
+
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.doc_ids[slot] = doc_id
+
+                for column in self.columns.values():
+                    column[slot] = 0
+            else:
+                slot = len(self.keys)
+                self.keys.append(None)
+                self.doc_ids.append(doc_id)
+
+                for column in self.columns.values():
+                    column.append(0)
+
+            self.slots[doc_id] = slot
+
+            if changed is None:
+                for field in self.orders:
+                    self.orders[field].insert(self._position(field, 0, doc_id), slot)
+            else:
+                changed.update(self.columns)
+
+        self.keys[slot] = doc.get(self.key_field)
+
+        for field, value in doc.items():
+            # Note: bool is a subclass of int, but not something to rank by
+            if type(value) is int:
+                if field not in self.columns:
+                    self.columns[field] = array('q', bytes(8 * len(self.keys)))
+
+                    # All other documents rank with 0 in a field they don't have
+                    if changed is None:
+                        self._sort([field])
+                    else:
+                        changed.add(field)
+
+                column = self.columns[field]
+
+                if column[slot] != value:
+                    if changed is None:
+                        del self.orders[field][self._position(field, column[slot], doc_id)]
+
+                    column[slot] = value
+
+                    if changed is None:
+                        self.orders[field].insert(self._position(field, value, doc_id), slot)
+                    else:
+                        changed.add(field)
+
+
+    def _remove(self, doc_id, changed=None):
+        slot = self.slots.pop(doc_id, None)
+
+        if slot is not None:
+            if changed is None:
+                for field, column in self.columns.items():
+                    del self.orders[field][self._position(field, column[slot], doc_id)]
+            else:
+                changed.update(self.columns)
+
+            self.keys[slot] = None
+            self.free_slots.append(slot)
+
+
+    def on_change(self, event, doc_ids, fields):
+        if event in ('purge', 'reload'):
+            self.rebuild()
+            return
+
+        # Sorting the changed fields once beats moving the sorted arrays for every single document
+        changed = set() if len(doc_ids) > self.BULK_CHANGES else None
+
+        if changed is not None and event == 'update' and isinstance(fields, dict) and self.key_field not in fields and all(doc_id in self.slots for doc_id in doc_ids):
+            # Every document got the same values (e.g. table.update({...}) at the end of a season), no need to look at them
+            for field, value in fields.items():
+                if type(value) is int:
+                    if field not in self.columns:
+                        self.columns[field] = array('q', bytes(8 * len(self.keys)))
+
+                    column = self.columns[field]
+
+                    for doc_id in doc_ids:
+                        column[self.slots[doc_id]] = value
+
+                    changed.add(field)
+        elif event == 'remove':
+            for doc_id in doc_ids:
+                self._remove(doc_id, changed)
+        else:
+            for doc_id in doc_ids:
+                doc = self.table.get(doc_id=doc_id)
+
+                if doc is None:
+                    self._remove(doc_id, changed)
+                else:
+                    self._set(doc_id, doc, changed)
+
+        if changed:
+            self._sort(changed)
+
+
+    def range(self, field, start, stop):
+        """The documents ranked _start_ to _stop_ - 1 (0 being the highest _field_), as (key, value) tuples in descending order."""
+
+        order = self.orders.get(field)
+
+        if order is None:
+            return []
+
+        column = self.columns[field]
+        start = max(start, 0)
+        stop = min(stop, len(order))
+        return [(self.keys[order[-1 - position]], column[order[-1 - position]]) for position in range(start, stop)]
+
+
+    def top(self, field, amount):
+        """The _amount_ documents with the highest _field_, as (key, value) tuples in descending order."""
+        return self.range(field, 0, amount)
+
+
+    def bottom(self, field, amount):
+        """The _amount_ documents with the lowest _field_, as (key, value) tuples in ascending order."""
+
+        order = self.orders.get(field)
+
+        if order is None:
+            return []
+
+        column = self.columns[field]
+        result = []
+        start = 0
+
+        # Equal values are listed oldest document first here too, i.e. each run of them is read backwards
+        while len(result) < amount and start < len(order):
+            value = column[order[start]]
+            end = self._position(field, value + 1, float('inf'))
+            run = order[max(start, end - (amount - len(result))):end] # The oldest documents are at the end of the run
+            result.extend((self.keys[slot], column[slot]) for slot in reversed(run))
+            start = end
+
+        return result
+
+
+    def ranked(self, field):
+        """All documents as (key, value) tuples, sorted by _field_ in descending order."""
+        return self.range(field, 0, len(self.slots))
+
+
+    def rank(self, field, doc_id):
+        """(rank, value) of document _doc_id_ by _field_, rank 1 being the highest value. Documents with equal values share a rank.
+        None if the document or the field is unknown.
+        """
+
+        slot = self.slots.get(doc_id)
+
+        if slot is None or field not in self.orders:
+            return None
+
+        value = self.columns[field][slot]
+
+        # Everyone after the last document with _value_ ranks higher
+        higher = len(self.orders[field]) - self._position(field, value + 1, float('inf'))
+        return higher + 1, value
+
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class Database:
+    """The bot's main database. Hands out tables like TinyDB does and takes care of flushing cached writes to disk.
+
+    With a _journal_ path, every change is also appended to a journal (see journal.Journal), which is replayed on top of the
+    database file when the database is opened again and emptied whenever the database file has been written.
+    _format_ is the file format used for writing ('json' or 'msgpack'); files in either format can be opened.
+    With _background_writes_, the file is written on a thread of its own (see storage.BackgroundWriter). If more than
+    _max_backlog_ snapshots are waiting for it, wait_for_backlog() makes commands wait until the disk has caught up.
+    """
+
+    def __init__(self, path, write_behind=False, flush_interval=30, flush_writes=100, journal=None, journal_sync_writes=10, format='json', background_writes=False, max_backlog=20):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.format = format
+        self.max_backlog = max_backlog
+        self.storage = WriteBehindMiddleware(storage_for_format(format), write_behind=write_behind, max_pending_writes=flush_writes, background=background_writes)
+        self.db = TinyDB(path, storage=self.storage, table_class=ObservedTable)
+        self.journal = None
+        self._journaled_tables = set()
+
+        if journal:
+            self.journal = Journal(journal, sync_writes=journal_sync_writes)
+            self.storage.flush_listeners.append(self.journal.on_snapshot)
+            self._replay_journal()
+
+
+    def _replay_journal(self):
+        raw_data = dict(self.storage.read() or {})
+
+        if self.journal.replay(raw_data) == 0:
+            return
+
+        # Write a new snapshot right away, which also empties the journal
+        self.storage.write(raw_data)
+        self.storage.flush()
+
+        for table in self.db._table_cache.values():
+            table.clear_cache()
+            table._init_last_id(table._read())
+
+        log.info('Replayed %d journal records from %s in %1.3fs', self.journal.replayed_records, self.journal.path, self.journal.replay_time)
+
+
+    def table(self, name):
+        table = self.db.table(name)
+
+        if self.journal is not None and name not in self._journaled_tables:
+            table.add_listener(partial(self.journal.on_change, table))
+            self._journaled_tables.add(name)
+
+        return table
+
+
+    @contextmanager
+    def batch(self):
+        """Group all writes inside the with block into a single write to disk. If the block raises, all of its changes are rolled back.
+
+        Note: Don't await inside the block, other commands' writes would become part of the batch.
+        """
+
+        snapshot = dict(self.storage.read() or {})
+        self.storage.hold()
+
+        if self.journal is not None:
+            self.journal.hold()
+
+        try:
+            yield self
+        except BaseException:
+            self.storage.restore(snapshot)
+
+            if self.journal is not None:
+                self.journal.discard()
+
+            for table in self.db._table_cache.values():
+                table.clear_cache()
+                table.notify('reload', [])
+
+            raise
+        else:
+            if self.journal is not None:
+                self.journal.release()
+        finally:
+            self.storage.release()
+
+
+    def flush(self):
+        """Write all pending changes to disk. Returns a concurrent.futures.Future that is done once they are on disk."""
+
+        future = self.storage.flush()
+
+        if self.journal is not None:
+            self.journal.sync()
+
+        return future
+
+
+    async def wait_for_backlog(self):
+        """Wait for the background writer if it has fallen too far behind."""
+
+        if self.storage.queue_depth() >= self.max_backlog:
+            log.warning('Database write backlog of ' + str(self.storage.queue_depth()) + ' snapshots, waiting for the disk to catch up')
+            await asyncio.wrap_future(self.storage.last_flush)
+
+
+    def close(self):
+        self.db.close()
+
+        if self.journal is not None:
+            self.journal.close()
+
+
+    def stats(self):
+        result = self.storage.stats()
+        result['path'] = self.path
+        result['format'] = self.format
+        result['max_backlog'] = self.max_backlog
+
+        if self.journal is not None:
+            result['journal'] = self.journal.stats()
+
+        return result
+
+
+class DatabaseRouter:
+    """Keeps some tables in database files of their own, so writing one of them does not rewrite all the others. Same interface as Database.
+
+    _databases_ maps table names to the database they are stored in; all other tables are stored in _default_.
+    """
+
+    def __init__(self, default, databases=None):
+        self.default = default
+        self.databases = databases or {}
+        self.path = default.path
+        self.flush_interval = default.flush_interval
+        self.files = [default]
+
+        for database in self.databases.values():
+            if all(database is not f for f in self.files):
+                self.files.append(database)
+
+
+    def table(self, name):
+        return self.databases.get(name, self.default).table(name)
+
+
+    @contextmanager
+    def batch(self):
+        """Database.batch() for all database files at once."""
+
+        with ExitStack() as stack:
+            for database in self.files:
+                stack.enter_context(database.batch())
+
+            yield self
+
+
+    def flush(self):
+        for database in self.files:
+            database.flush()
+
+
+    async def wait_for_backlog(self):
+        for database in self.files:
+            await database.wait_for_backlog()
+
+
+    def close(self):
+        for database in self.files:
+            database.close()
+
+
+    def stats(self):
+        """Statistics of the default database, see all_stats() for the others."""
+        return self.default.stats()
+
+
+    def all_stats(self):
+        return [database.stats() for database in self.files]
+
+
+def _open_file(path, backend, **kwargs):
+    if backend == 'sqlite':
+        from sqlite_backend import SQLiteDatabase
+
+        if kwargs.get('journal'):
+            log.warning('The database journal is not used with the SQLite backend, SQLite keeps its own journal')
+
+        return SQLiteDatabase(path, flush_interval=kwargs.get('flush_interval', 30))
+    elif backend == 'tinydb':
+        return Database(path, **kwargs)
+
+    raise ValueError('Unknown database backend ' + str(backend))
+
+
+def open_database(path, backend='tinydb', tables=None, **kwargs):
+    """Open the bot's database with the given backend ('tinydb' or 'sqlite').
+
+    _tables_ optionally maps table names to (path, backend) for tables that are stored in a file of their own. With a journal,
+    each of those files gets its own journal next to it.
+    """
+
+    default = _open_file(path, backend, **kwargs)
+    files = {path: default}
+    databases = {}
+
+    for name, (table_path, table_backend) in (tables or {}).items():
+        if table_path not in files:
+            file_kwargs = dict(kwargs)
+
+            if kwargs.get('journal'):
+                file_kwargs['journal'] = table_path + '.journal'
+
+            files[table_path] = _open_file(table_path, table_backend, **file_kwargs)
+
+        databases[name] = files[table_path]
+
+    log.info('Database files: ' + ', '.join(files))
+    return DatabaseRouter(default, databases)
@@ -0,0 +1,112 @@
+import logging
+import itertools
+import time
+from outbox import PRIORITY_NORMAL
+
+log = logging.getLogger(__name__)
+
+__all__ = ('GameSession', 'GameSessions', 'SessionConflict')
+
+
+class SessionConflict(Exception):
+    """Raised by GameSessions.start() if another game already occupies the channel."""
+
+    def __init__(self, session):
+        super().__init__('Channel ' + str(session.channel) + ' is occupied by ' + session.title)
+        self.session = session
+
+
+class GameSession:
+    """The state of one running game in one channel. Games subclass this and keep everything that belongs to a single game
+    (participants, bets, pool, ...) on their session object instead of the cog, so any number of them can run at once.
+
+    Sessions only share the accounts. Their messages go to their own channel; games that keep editing their messages (_exclusive_,
+    e.g. horse races) get the channel to themselves, see GameSessions.start().
+    """
+
+    game = 'game' # Name of the game, as used in GameSessions.find()
+    title = 'Game'
+    exclusive = False
+
+    def __init__(self, bot, channel):
+        self.bot = bot
+        self.channel = channel
+        self.id = None # Set by GameSessions.start()
+        self.started = time.monotonic()
+        self.ended = False
+
+
+    async def post(self, text, embed=None, priority=PRIORITY_NORMAL, coalesce=True):
+        """Post a message of this game in its channel, see EconomyBot.post_message."""
+        return await self.bot.post_message(self.channel, text, embed=embed, priority=priority, coalesce=coalesce)
+
+
+    def describe(self):
+        """A line about the game for !games."""
+        return self.title
+
+
+class GameSessions:
+    """All running game sessions, by session ID."""
+
+    def __init__(self):
+        self.sessions = {} # session ID -> GameSession
+        self.ids = itertools.count(1)
+
+
+    def start(self, session):
+        """Register _session_ and give it an ID. Raises SessionConflict if _session_ is exclusive and another exclusive game is
+        already running in its channel, so their messages can't interfere. Check with blocking() first to tell the user.
+        """
+
+        other = self.blocking(session)
+
+        if other is not None:
+            raise SessionConflict(other)
+
+        session.id = next(self.ids)
+        self.sessions[session.id] = session
+        log.info('%s %d started in %s', session.title, session.id, session.channel)
+        return session
+
+
+    def end(self, session):
+        """Unregister _session_. Ending a session more than once is fine."""
+
+        session.ended = True
+
+        if self.sessions.pop(session.id, None) is not None:
+            log.info('%s %d ended after %1.0fs', session.title, session.id, time.monotonic() - session.started)
+
+
+    def blocking(self, session):
+        """The running session that keeps _session_ from starting in its channel, or None."""
+
+        if not session.exclusive:
+            return None
+
+        for other in self.sessions.values():
+            if other.exclusive and other.channel == session.channel:
+                return other
+
+        return None
+
+
+    def find(self, game, channel=None):
+        """The running sessions of _game_, only those in _channel_ if given, oldest first."""
+        return [session for session in self.sessions.values() if session.game == game and (channel is None or session.channel == channel)]
+
+
+    def get(self, game, channel):
+        """The oldest running session of _game_ in _channel_, or None."""
+
+        sessions = self.find(game, channel)
+        return sessions[0] if sessions else None
+
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
@@ -0,0 +1,204 @@
+import logging
+import os
+import json
+import threading
+import time
+from functools import partial
+
+log = logging.getLogger(__name__)
+
+__all__ = ('Journal',)
+
+
+class Journal:
+    """Append-only log of changed documents, one JSON record per line.
+
+    Every record holds the complete new state of the documents it touches, so replaying a record twice does no harm.
+    Together with the last snapshot of the database (the database file itself) the journal describes the current state;
+    once a new snapshot has been written, compact() removes the records it contains.
+
+    Records are written to the file immediately, but only fsynced every _sync_writes_ records and on sync()/compact().
+    compact() may be called from the database's background writer thread, so file access is guarded by a lock.
+    """
+
+    def __init__(self, path, sync_writes=10):
+        self.path = path
+        self.sync_writes = sync_writes
+        self.lock = threading.Lock()
+        self.handle = open(path, 'ab')
+        self.pending = []
+        self.holds = []
+        self.unsynced = 0
+        self.compacted = 0 # Bytes compact() has removed from the start of the file, see on_snapshot
+
+        self.total_records = 0
+        self.total_syncs = 0
+        self.total_bytes_written = 0
+        self.replayed_records = 0
+        self.replay_time = 0.0
+
+
+    def on_change(self, table, event, doc_ids, fields=None):
+        """Table listener, see ObservedTable. Reloads are not journaled; the documents have already been restored."""
+
+        if event in ('insert', 'update'):
+            documents = {}
+
+            for doc_id in doc_ids:
+                document = table.get(doc_id=doc_id)
+
+                if document is not None:
+                    documents[str(doc_id)] = dict(document)
+
+            self.append({'table': table.name, 'op': 'write', 'docs': documents})
+        elif event == 'remove':
+            self.append({'table': table.name, 'op': 'remove', 'ids': list(doc_ids)})
+        elif event == 'purge':
+            self.append({'table': table.name, 'op': 'purge'})
+
+
+    def append(self, record):
+        self.pending.append(json.dumps(record, separators=(',', ':')))
+
+        if not self.holds:
+            self.write()
+
+
+    def hold(self):
+        """Keep records in memory until release(), e.g. during Database.batch(). discard() drops them instead."""
+        self.holds.append(len(self.pending))
+
+
+    def release(self):
+        self.holds.pop()
+
+        if not self.holds:
+            self.write()
+
+
+    def discard(self):
+        """Drop all records since the matching hold()."""
+        del self.pending[self.holds.pop():]
+
+
+    def write(self):
+        if not self.pending:
+            return
+
+        data = ('\n'.join(self.pending) + '\n').encode('utf-8')
+
+        with self.lock:
+            self.handle.write(data)
+            self.handle.flush()
+
+        self.total_records += len(self.pending)
+        self.total_bytes_written += len(data)
+        self.unsynced += len(self.pending)
+        self.pending = []
+
+        if self.unsynced >= self.sync_writes:
+            self.sync()
+
+
+    def sync(self):
+        if self.unsynced == 0:
+            return
+
+        with self.lock:
+            os.fsync(self.handle.fileno())
+
+        self.unsynced = 0
+        self.total_syncs += 1
+
+
+    def on_snapshot(self):
+        """Flush listener (see WriteBehindMiddleware): remembers how far the journal goes, so it can be compacted once the snapshot is on disk.
+
+        The position counts all bytes ever written, including those compacted away since, so it stays valid if an earlier snapshot
+        compacts the journal first (background writes may have several snapshots underway).
+        """
+
+        with self.lock:
+            return partial(self.compact, self.compacted + self.handle.tell())
+
+
+    def compact(self, position):
+        """Remove the records before _position_ (see on_snapshot), which have become part of a snapshot. Records appended since then are kept."""
+
+        with self.lock:
+            start = position - self.compacted # Where the records after the snapshot begin in the file as it is now
+
+            if start <= 0:
+                return # A later snapshot has already been compacted
+
+            end = self.handle.tell()
+            tail = b''
+
+            if end > start:
+                with open(self.path, 'rb') as handle:
+                    handle.seek(start)
+                    tail = handle.read(end - start)
+
+            self.handle.seek(0)
+            self.handle.truncate()
+            self.handle.write(tail)
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.compacted += start
+
+
+    def replay(self, raw_data):
+        """Apply all journaled records to _raw_data_ (the database contents as loaded from the last snapshot). Returns the number of records applied.
+
+        A crash in the middle of an append can leave an incomplete last line; it is skipped.
+        """
+
+        start = time.perf_counter()
+        amnt_records = 0
+
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as handle:
+            for line_number, line in enumerate(handle, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.warning('Skipping incomplete journal record in line ' + str(line_number) + ' of ' + self.path)
+                    continue
+
+                # Tables are replaced rather than changed, like everywhere else (see WriteBehindMiddleware)
+                table = dict(raw_data.get(record['table'], {}))
+
+                if record['op'] == 'write':
+                    for doc_id, document in record['docs'].items():
+                        table[int(doc_id)] = document
+                elif record['op'] == 'remove':
+                    for doc_id in record['ids']:
+                        table.pop(doc_id, None)
+                elif record['op'] == 'purge':
+                    table = {}
+
+                raw_data[record['table']] = table
+                amnt_records += 1
+
+        self.replayed_records = amnt_records
+        self.replay_time = time.perf_counter() - start
+        return amnt_records
+
+
+    def close(self):
+        self.write()
+        self.sync()
+
+        with self.lock:
+            self.handle.close()
+
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'records': self.total_records,
+            'syncs': self.total_syncs,
+            'bytes_written': self.total_bytes_written,
+            'unsynced_records': self.unsynced,
+            'replayed_records': self.replayed_records,
+            'replay_time': self.replay_time
+        }
@@ -0,0 +1,196 @@
+"""Maintenance commands for the bot's database. Run from the bot's root directory while the bot is stopped, e.g.:
+
+    python3 manage.py migrate-sqlite
+    python3 manage.py split-database
+    python3 manage.py convert --to msgpack
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import time
+from conf import config
+from sqlite_backend import SQLiteDatabase
+from Cogs.season_archives import SUMMARY_SUFFIX
+import storage
+
+log = logging.getLogger(__name__)
+
+
+def read_database(path):
+    """Load a TinyDB database file in any format (see storage.load). Returns the data and the format of the file."""
+
+    with open(path, 'rb') as handle:
+        serialized = handle.read()
+
+    return storage.load(serialized), storage.detect_format(serialized)
+
+
+def read_tables(path):
+    """Load a TinyDB database file and yield (table name, [(doc_id, document)]) one table at a time."""
+
+    data, format = read_database(path)
+
+    for name in list(data):
+        table = data.pop(name)
+        yield name, [(int(doc_id), document) for doc_id, document in table.items()]
+
+
+def copy_to_sqlite(source, target):
+    """Copy every table of the TinyDB JSON file _source_ into the SQLite database _target_, keeping document IDs."""
+
+    database = SQLiteDatabase(target)
+    amnt_documents = 0
+
+    for name, documents in read_tables(source):
+        table = database.table(name)
+        table.purge()
+        table.write_back([document for doc_id, document in documents], [doc_id for doc_id, document in documents])
+        amnt_documents += len(documents)
+        print('  ' + name.ljust(20) + ' ' + str(len(documents)) + ' documents')
+
+    database.close()
+    return amnt_documents
+
+
+def migrate_sqlite(args):
+    """Copy economy.json and all season archives into SQLite databases."""
+
+    if os.path.exists(args.target) and not args.force:
+        print(args.target + ' already exists. Use --force to overwrite its tables.')
+        return 1
+
+    start = time.perf_counter()
+    print('Migrating ' + args.source + ' to ' + args.target)
+    copy_to_sqlite(args.source, args.target)
+
+    if os.path.isdir(args.seasons):
+        for filename in sorted(os.listdir(args.seasons)):
+            if filename.endswith('.json') and not filename.endswith(SUMMARY_SUFFIX):
+                source = os.path.join(args.seasons, filename)
+                target = os.path.join(args.seasons, filename[:-len('.json')] + '.sqlite3')
+                print('Migrating ' + source + ' to ' + target)
+                copy_to_sqlite(source, target)
+
+    print('Done in %1.2fs. Set database = ' % (time.perf_counter() - start) + args.target + ' and database_backend = sqlite in bot.ini.')
+    return 0
+
+
+def parse_table(value):
+    """Parse a --table argument of the form table=path or table=path,backend."""
+
+    name, _, target = value.partition('=')
+    path, _, backend = target.partition(',')
+
+    if not name or not path:
+        raise argparse.ArgumentTypeError('expected table=path or table=path,backend')
+
+    return name.strip(), (path.strip(), backend.strip() or config.database_backend)
+
+
+def split_database(args):
+    """Move tables out of the TinyDB database into the files given in the [DatabaseTables] section of bot.ini (or with --table)."""
+
+    tables = dict(config.database_tables)
+    tables.update(args.table or [])
+
+    if not tables:
+        print('No tables to split off. List them in the [DatabaseTables] section of bot.ini or use --table.')
+        return 1
+
+    for name, (path, backend) in sorted(tables.items()):
+        if backend not in ('tinydb', 'sqlite'):
+            print('Unknown backend ' + backend + ' for ' + name + '.')
+            return 1
+
+        if os.path.exists(path) and not args.force:
+            print(path + ' already exists. Use --force to overwrite its ' + name + ' table.')
+            return 1
+
+    start = time.perf_counter()
+    backup = args.source + '.bak'
+    shutil.copyfile(args.source, backup)
+    print('Backed up ' + args.source + ' to ' + backup)
+
+    data, format = read_database(args.source)
+
+    for name, (path, backend) in sorted(tables.items()):
+        documents = data.pop(name, {})
+
+        if backend == 'sqlite':
+            database = SQLiteDatabase(path)
+            table = database.table(name)
+            table.purge()
+            table.write_back(list(documents.values()), [int(doc_id) for doc_id in documents])
+            database.close()
+        else:
+            target_storage = storage.storage_for_format(format)(path)
+            target = target_storage.read() or {}
+            target[name] = documents
+            target_storage.write(target)
+
+        print('  ' + name.ljust(20) + ' ' + str(len(documents)).rjust(8) + ' documents -> ' + path)
+
+    storage.storage_for_format(format)(args.source).write(data)
+    print('Done in %1.2fs. ' % (time.perf_counter() - start) + 'Make sure bot.ini lists the same tables in its [DatabaseTables] section before starting the bot.')
+    return 0
+
+
+def convert(args):
+    """Rewrite a TinyDB database file in another format, e.g. to get a readable JSON copy of a MessagePack database."""
+
+    target = args.target or args.source
+    start = time.perf_counter()
+    data, format = read_database(args.source)
+
+    if target == args.source and format == args.to:
+        print(args.source + ' is already stored as ' + format + '.')
+        return 0
+
+    if target != args.source and os.path.exists(target) and not args.force:
+        print(target + ' already exists. Use --force to overwrite it.')
+        return 1
+
+    source_size = os.path.getsize(args.source)
+    target_storage = storage.storage_for_format(args.to)(target)
+    target_storage.write(data)
+    print('Converted ' + args.source + ' (' + format + ', ' + str(source_size) + ' bytes) to ' + target + ' (' + args.to + ', ' + str(target_storage.last_write_size) + ' bytes) in %1.2fs.' % (time.perf_counter() - start))
+
+    if target == args.source:
+        print('Set database_format = ' + args.to + ' in bot.ini so the bot keeps writing ' + args.to + '.')
+
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Economy bot database maintenance.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    migrate = commands.add_parser('migrate-sqlite', help='Copy the TinyDB database and season archives into SQLite.')
+    migrate.add_argument('--source', default=config.get('Private', 'database', fallback='economy.json'))
+    migrate.add_argument('--target', default='economy.sqlite3')
+    migrate.add_argument('--seasons', default=config.get('Private', 'seasons_path', fallback='seasons'))
+    migrate.add_argument('--force', action='store_true')
+    migrate.set_defaults(func=migrate_sqlite)
+
+    split = commands.add_parser('split-database', help='Move tables out of the TinyDB database into files of their own.')
+    split.add_argument('--source', default=config.get('Private', 'database', fallback='economy.json'))
+    split.add_argument('--table', type=parse_table, action='append', help='table=path or table=path,backend (default: the [DatabaseTables] section of bot.ini)')
+    split.add_argument('--force', action='store_true')
+    split.set_defaults(func=split_database)
+
+    convert_parser = commands.add_parser('convert', help='Convert a TinyDB database file between JSON and MessagePack.')
+    convert_parser.add_argument('--to', choices=storage.FORMATS, required=True)
+    convert_parser.add_argument('--source', default=config.get('Private', 'database', fallback='economy.json'))
+    convert_parser.add_argument('--target', help='Write the converted database here instead of replacing the source file')
+    convert_parser.add_argument('--force', action='store_true')
+    convert_parser.set_defaults(func=convert)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
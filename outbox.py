@@ -0,0 +1,263 @@
+import logging
+import asyncio
+import heapq
+import itertools
+import time
+from os import linesep
+import discord
+
+log = logging.getLogger(__name__)
+
+__all__ = ('Outbox', 'PRIORITY_HIGH', 'PRIORITY_NORMAL', 'PRIORITY_LOW')
+
+# Messages with a lower number are sent first; messages of the same priority are sent in the order they were posted
+PRIORITY_HIGH = 0 # Error replies
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2 # Game animations, e.g. horse race frames
+
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+
+
+class OutboundMessage:
+    __slots__ = ('text', 'embed', 'priority', 'coalesce', 'future', 'posted')
+
+    def __init__(self, text, embed, priority, coalesce, future):
+        self.text = text
+        self.embed = embed
+        self.priority = priority
+        self.coalesce = coalesce and embed is None
+        self.future = future
+        self.posted = time.monotonic()
+
+
+class ChannelQueue:
+    """Messages waiting to be sent to one channel, and the channel's rate limit bucket."""
+
+    def __init__(self, channel, rate, per):
+        self.channel = channel
+        self.heap = []
+        self.task = None
+
+        # Token bucket: _rate_ messages per _per_ seconds, like Discord's per-channel limit
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.refill_rate = rate / per
+        self.refilled = time.monotonic()
+        self.blocked_until = 0.0 # Set when Discord tells us to back off
+
+        self.total_messages = 0
+        self.total_sends = 0
+        self.total_coalesced = 0
+        self.total_dropped = 0
+        self.total_retries = 0
+        self.total_rate_limited = 0
+        self.wait_time = 0.0
+        self.max_depth = 0
+        self.latency = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES} # priority -> [messages, total, max]
+
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.refill_rate)
+        self.refilled = now
+
+
+    def delay(self):
+        """Seconds to wait before the next send is allowed."""
+
+        self.refill()
+        delay = max(self.blocked_until - time.monotonic(), 0.0)
+
+        if self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.refill_rate)
+
+        return delay
+
+
+class Outbox:
+    """Sends the bot's messages through one queue per channel, each emptied by a single sender task.
+
+    Every channel has a token bucket, so bursts (several games and gives at once) wait for their turn instead of running into
+    Discord's rate limit and retrying blindly. When Discord does answer with 429, the channel waits as long as it is told to.
+    While messages wait, consecutive small messages to the same channel (of the same priority, and not needed on their own,
+    see send()) are joined into one message. Error replies are posted with a higher priority and skip ahead of game output.
+    """
+
+    def __init__(self, loop, rate=5, per=5.0, max_attempts=30, retry_delay=2.0, max_length=2000):
+        self.loop = loop
+        self.rate = rate
+        self.per = per
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_length = max_length
+        self.queues = {} # channel ID -> ChannelQueue
+        self.sequence = itertools.count()
+
+
+    async def send(self, channel, text=None, embed=None, priority=PRIORITY_NORMAL, coalesce=True):
+        """Queue a message and wait until it has been sent. Returns the sent discord.Message, or None if it was dropped after
+        _max_attempts_ failed attempts. Messages posted with _coalesce_ may be joined with others they are queued with, so
+        callers that want to edit the message later have to post it with coalesce=False.
+        """
+
+        queue = self.queues.get(channel.id)
+
+        if queue is None:
+            queue = self.queues[channel.id] = ChannelQueue(channel, self.rate, self.per)
+
+        message = OutboundMessage(text, embed, priority, coalesce, self.loop.create_future())
+        heapq.heappush(queue.heap, (priority, next(self.sequence), message))
+        queue.max_depth = max(queue.max_depth, len(queue.heap))
+
+        if queue.task is None:
+            queue.task = self.loop.create_task(self.sender(queue))
+
+        return await message.future
+
+
+    async def sender(self, queue):
+        try:
+            while queue.heap:
+                delay = queue.delay()
+
+                if delay > 0:
+                    queue.wait_time += delay
+                    await asyncio.sleep(delay)
+                    continue
+
+                batch = self.next_batch(queue)
+
+                try:
+                    sent = await self.deliver(queue, batch)
+                except Exception as e:
+                    # Unexpected errors are raised in post_message of everyone waiting for the batch
+                    for message in batch:
+                        if not message.future.done():
+                            message.future.set_exception(e)
+
+                    continue
+
+                now = time.monotonic()
+
+                for message in batch:
+                    latency = queue.latency[message.priority]
+                    latency[0] += 1
+                    latency[1] += now - message.posted
+                    latency[2] = max(latency[2], now - message.posted)
+
+                    if not message.future.done():
+                        message.future.set_result(sent)
+        finally:
+            queue.task = None
+
+
+    def next_batch(self, queue):
+        """The next message to send, and the messages that directly follow it and can be joined with it."""
+
+        priority, sequence, first = heapq.heappop(queue.heap)
+        batch = [first]
+
+        if not first.coalesce:
+            return batch
+
+        length = len(first.text)
+
+        while queue.heap:
+            priority, sequence, message = queue.heap[0]
+
+            if priority != first.priority or not message.coalesce or length + len(linesep) + len(message.text) > self.max_length:
+                break
+
+            heapq.heappop(queue.heap)
+            batch.append(message)
+            length += len(linesep) + len(message.text)
+
+        queue.total_coalesced += len(batch) - 1
+        return batch
+
+
+    async def deliver(self, queue, batch):
+        text = linesep.join(message.text for message in batch) if batch[0].embed is None else None
+        queue.total_messages += len(batch)
+
+        for attempt in range(self.max_attempts):
+            queue.tokens -= 1
+
+            try:
+                queue.total_sends += 1
+
+                if text is None:
+                    return await queue.channel.send(embed=batch[0].embed)
+
+                return await queue.channel.send(text)
+            except discord.errors.HTTPException as e:
+                retry_after = self.retry_after(e)
+                status = getattr(e, 'status', None)
+
+                # Other client errors (e.g. 403 missing permissions, 404 deleted channel) won't go away by trying again
+                if retry_after is None and status is not None and status < 500:
+                    queue.total_dropped += len(batch)
+                    log.error('Dropped %d message(s) to channel %s: %s', len(batch), queue.channel, e)
+                    return None
+
+                queue.total_retries += 1
+
+                if retry_after is not None:
+                    # Discord has already retried a few times itself; trust what it says rather than our own bucket
+                    queue.total_rate_limited += 1
+                    queue.tokens = 0
+                    queue.blocked_until = time.monotonic() + retry_after
+                    delay = retry_after
+                else:
+                    delay = min(self.retry_delay * 2 ** attempt, 30.0)
+
+                queue.wait_time += delay
+                await asyncio.sleep(delay)
+
+        queue.total_dropped += len(batch)
+        log.error('Dropped %d message(s) to channel %s after %d attempts', len(batch), queue.channel, self.max_attempts)
+        return None
+
+
+    def retry_after(self, error):
+        """Seconds Discord asked us to wait, if _error_ is a rate limit response."""
+
+        if getattr(error, 'status', None) != 429:
+            return None
+
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+
+        for header in ('Retry-After', 'X-RateLimit-Reset-After'):
+            try:
+                return float(headers[header])
+            except (KeyError, TypeError, ValueError):
+                pass
+
+        return self.per
+
+
+    def close(self):
+        for queue in self.queues.values():
+            if queue.task is not None:
+                queue.task.cancel()
+
+
+    def stats(self):
+        result = []
+
+        for queue in self.queues.values():
+            result.append({
+                'channel': str(queue.channel),
+                'depth': len(queue.heap),
+                'max_depth': queue.max_depth,
+                'messages': queue.total_messages,
+                'sends': queue.total_sends,
+                'coalesced': queue.total_coalesced,
+                'dropped': queue.total_dropped,
+                'retries': queue.total_retries,
+                'rate_limited': queue.total_rate_limited,
+                'wait_time': queue.wait_time,
+                'latency': {PRIORITY_NAMES[priority]: (messages, total / messages if messages else 0.0, maximum) for priority, (messages, total, maximum) in queue.latency.items()}
+            })
+
+        return result
@@ -0,0 +1,287 @@
+import logging
+import json
+from contextlib import contextmanager
+import sqlite3
+import time
+from tinydb.database import Document
+
+log = logging.getLogger(__name__)
+
+__all__ = ('SQLiteDatabase', 'SQLiteTable', 'TABLE_KEYS')
+
+# Columns that are copied out of each document so they can be indexed. The full document is always stored as JSON.
+TABLE_KEYS = {
+    'main_db': ('user',),
+    'give_table': ('donor', 'recipient'),
+    'trivia_table': ('name',),
+    'label_table': ('iid',),
+    'horses': ('name',),
+    'holiday_minigame': ('minigame',)
+}
+
+# Key columns that identify a document on their own and get a unique index
+UNIQUE_KEYS = {
+    'main_db': True,
+    'label_table': True
+}
+
+
+def _equality_constraints(hashval, keys, result):
+    """Collect 'field == value' conditions on key columns from a TinyDB query hash. Returns False if the query contains an OR/NOT, i.e. the constraints can't be used to narrow the search."""
+
+    if not isinstance(hashval, tuple) or len(hashval) < 2:
+        return False
+
+    if hashval[0] == '==' and len(hashval[1]) == 1 and hashval[1][0] in keys and isinstance(hashval[2], (str, int, float)):
+        result[hashval[1][0]] = hashval[2]
+        return True
+    elif hashval[0] == 'and':
+        for part in hashval[1]:
+            _equality_constraints(part, keys, result)
+        return True
+
+    return hashval[0] not in ('or', 'not')
+
+
+class SQLiteTable:
+    """A table in an SQLite database that mimics the parts of the TinyDB table API used by the cogs.
+
+    Queries are TinyDB queries; equality conditions on key columns are answered through an index, everything else is filtered in Python.
+    Like ObservedTable, listeners are notified about changed documents.
+    """
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.keys = TABLE_KEYS.get(name, ())
+        self.listeners = []
+        self._create()
+
+
+    def _create(self):
+        columns = ''.join(', "' + key + '"' for key in self.keys)
+        self.database.connection.execute('CREATE TABLE IF NOT EXISTS "' + self.name + '" (doc_id INTEGER PRIMARY KEY' + columns + ', doc TEXT NOT NULL)')
+
+        if self.keys:
+            unique = 'UNIQUE ' if UNIQUE_KEYS.get(self.name) else ''
+            key_list = ', '.join('"' + key + '"' for key in self.keys)
+            self.database.connection.execute('CREATE ' + unique + 'INDEX IF NOT EXISTS "' + self.name + '_keys" ON "' + self.name + '" (' + key_list + ')')
+
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def notify(self, event, doc_ids, fields=None):
+        for listener in self.listeners:
+            listener(event, doc_ids, fields)
+
+
+    def _row(self, doc_id, document):
+        return (doc_id,) + tuple(document.get(key) for key in self.keys) + (json.dumps(document),)
+
+
+    def _select(self, cond=None, doc_ids=None):
+        sql = 'SELECT doc_id, doc FROM "' + self.name + '"'
+        params = []
+
+        if doc_ids is not None:
+            sql += ' WHERE doc_id IN (' + ', '.join('?' for doc_id in doc_ids) + ')'
+            params = list(doc_ids)
+        elif cond is not None:
+            constraints = {}
+
+            if _equality_constraints(getattr(cond, 'hashval', None), self.keys, constraints) and constraints:
+                sql += ' WHERE ' + ' AND '.join('"' + key + '" = ?' for key in constraints)
+                params = list(constraints.values())
+
+        for doc_id, doc in self.database.connection.execute(sql + ' ORDER BY doc_id', params):
+            document = Document(json.loads(doc), doc_id)
+
+            if cond is None or cond(document):
+                yield document
+
+
+    def _write(self, documents):
+        columns = ', '.join(['doc_id'] + ['"' + key + '"' for key in self.keys] + ['doc'])
+        placeholders = ', '.join('?' for i in range(len(self.keys) + 2))
+        self.database.connection.executemany('INSERT OR REPLACE INTO "' + self.name + '" (' + columns + ') VALUES (' + placeholders + ')', (self._row(document.doc_id, document) for document in documents))
+        self.database.commit()
+
+
+    def __len__(self):
+        return self.database.connection.execute('SELECT COUNT(*) FROM "' + self.name + '"').fetchone()[0]
+
+
+    def __iter__(self):
+        return self._select()
+
+
+    def all(self):
+        return list(self._select())
+
+
+    def search(self, cond):
+        return list(self._select(cond))
+
+
+    def count(self, cond):
+        return len(self.search(cond))
+
+
+    def get(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            documents = self._select(doc_ids=[doc_id])
+        else:
+            documents = self._select(cond)
+
+        return next(documents, None)
+
+
+    def contains(self, cond=None, doc_ids=None):
+        if doc_ids is not None:
+            return any(True for document in self._select(doc_ids=doc_ids))
+
+        return self.get(cond) is not None
+
+
+    def insert(self, document):
+        columns = ', '.join(['"' + key + '"' for key in self.keys] + ['doc'])
+        placeholders = ', '.join('?' for i in range(len(self.keys) + 1))
+        cursor = self.database.connection.execute('INSERT INTO "' + self.name + '" (' + columns + ') VALUES (' + placeholders + ')', self._row(None, document)[1:])
+        self.database.commit()
+        self.notify('insert', [cursor.lastrowid])
+        return cursor.lastrowid
+
+
+    def insert_multiple(self, documents):
+        return [self.insert(document) for document in documents]
+
+
+    def update(self, fields, cond=None, doc_ids=None):
+        documents = list(self._select(cond, doc_ids))
+
+        for document in documents:
+            if callable(fields):
+                fields(document)
+            else:
+                document.update(fields)
+
+        self._write(documents)
+        doc_ids = [document.doc_id for document in documents]
+        self.notify('update', doc_ids, fields)
+        return doc_ids
+
+
+    def write_back(self, documents, doc_ids=None):
+        if doc_ids is None:
+            doc_ids = [document.doc_id for document in documents]
+
+        self._write([Document(document, doc_id) for document, doc_id in zip(documents, doc_ids)])
+        self.notify('update', doc_ids)
+        return doc_ids
+
+
+    def remove(self, cond=None, doc_ids=None):
+        if cond is None and doc_ids is None:
+            raise RuntimeError('Use purge() to remove all documents')
+
+        doc_ids = [document.doc_id for document in self._select(cond, doc_ids)]
+        self.database.connection.executemany('DELETE FROM "' + self.name + '" WHERE doc_id = ?', ((doc_id,) for doc_id in doc_ids))
+        self.database.commit()
+        self.notify('remove', doc_ids)
+        return doc_ids
+
+
+    def purge(self):
+        self.database.connection.execute('DELETE FROM "' + self.name + '"')
+        self.database.commit()
+        self.notify('purge', [])
+
+
+class SQLiteDatabase:
+    """SQLite backend for the bot's database. Same interface as database.Database; every table is a real SQLite table."""
+
+    def __init__(self, path, flush_interval=30):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.tables = {}
+        self.holds = 0
+
+        self.total_commits = 0
+        self.total_commit_time = 0.0
+
+
+    def table(self, name):
+        if name not in self.tables:
+            self.tables[name] = SQLiteTable(self, name)
+            self.commit()
+
+        return self.tables[name]
+
+
+    @contextmanager
+    def batch(self):
+        """Group all writes inside the with block into one SQLite transaction. If the block raises, the transaction is rolled back."""
+
+        self.holds += 1
+
+        try:
+            yield self
+        except BaseException:
+            self.holds -= 1
+            self.connection.rollback()
+
+            for table in self.tables.values():
+                table.notify('reload', [])
+
+            raise
+        else:
+            self.holds -= 1
+            self.commit()
+
+
+    def commit(self):
+        if self.holds > 0:
+            return
+
+        start = time.perf_counter()
+        self.connection.commit()
+        self.total_commit_time += time.perf_counter() - start
+        self.total_commits += 1
+
+
+    def flush(self):
+        self.commit()
+
+
+    async def wait_for_backlog(self):
+        # Commits are written synchronously, so there is never a backlog
+        pass
+
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'format': 'sqlite',
+            'write_behind': False,
+            'writes': self.total_commits,
+            'flushes': self.total_commits,
+            'writes_per_flush': 1 if self.total_commits else 0,
+            'bytes_written': 0,
+            'bytes_per_write': 0,
+            'flush_time': self.total_commit_time,
+            'pending_writes': 0,
+            'queue_depth': 0,
+            'max_backlog': 0,
+            'dirty_tables': [],
+            'table_writes': {}
+        }
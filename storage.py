@@ -0,0 +1,397 @@
+import logging
+import os
+import json
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from tinydb.storages import Storage, touch
+from tinydb.middlewares import Middleware
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ('AtomicJSONStorage', 'MsgPackStorage', 'BackgroundWriter', 'WriteBehindMiddleware', 'storage_for_format', 'detect_format', 'load', 'dump')
+
+FORMATS = ('json', 'msgpack')
+
+
+def detect_format(serialized):
+    """'json' or 'msgpack', depending on what the serialized database looks like. A JSON database always starts with '{'."""
+
+    if serialized.lstrip()[:1] == b'{':
+        return 'json'
+
+    return 'msgpack'
+
+
+def load(serialized, encoding=None):
+    """Deserialize a database in either format."""
+
+    if detect_format(serialized) == 'json':
+        return json.loads(serialized.decode(encoding or 'utf-8'))
+
+    if msgpack is None:
+        raise ImportError('The database is stored as MessagePack, but the msgpack module is not installed')
+
+    # Document IDs are integer map keys, which msgpack only allows with strict_map_key=False
+    return msgpack.unpackb(serialized, raw=False, strict_map_key=False)
+
+
+def dump(data, format, encoding=None, **kwargs):
+    """Serialize a database in _format_ ('json' or 'msgpack')."""
+
+    if format == 'json':
+        return json.dumps(data, **kwargs).encode(encoding or 'utf-8')
+    elif format == 'msgpack':
+        if msgpack is None:
+            raise ImportError('Storing the database as MessagePack requires the msgpack module')
+
+        return msgpack.packb(data, use_bin_type=True)
+
+    raise ValueError('Unknown database format ' + str(format))
+
+
+class AtomicJSONStorage(Storage):
+    """Stores the database as a JSON file. Writes go to a temporary file which then replaces the original, so a crash mid-write never leaves a truncated database behind.
+
+    Reading also accepts files written by MsgPackStorage, so switching the format only takes effect with the next write.
+    """
+
+    format = 'json'
+
+    def __init__(self, path, create_dirs=False, encoding=None, **kwargs):
+        super().__init__()
+        touch(path, create_dirs=create_dirs)
+        self.path = path
+        self.encoding = encoding
+        self.kwargs = kwargs
+        self.last_write_size = 0
+
+
+    def read(self):
+        with open(self.path, 'rb') as handle:
+            serialized = handle.read()
+
+        if not serialized:
+            return None
+
+        return load(serialized, self.encoding)
+
+
+    def write(self, data):
+        serialized = dump(data, self.format, self.encoding, **self.kwargs)
+        temp_path = self.path + '.tmp'
+
+        with open(temp_path, 'wb') as handle:
+            handle.write(serialized)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        os.replace(temp_path, self.path)
+        self.last_write_size = len(serialized)
+
+
+class MsgPackStorage(AtomicJSONStorage):
+    """Like AtomicJSONStorage, but writes the database as MessagePack, which is smaller and much faster to encode and decode. Requires the msgpack module."""
+
+    format = 'msgpack'
+
+    def __init__(self, path, create_dirs=False, encoding=None, **kwargs):
+        if msgpack is None:
+            raise ImportError('The msgpack database format requires the msgpack module (pip install msgpack)')
+
+        super().__init__(path, create_dirs=create_dirs, encoding=encoding, **kwargs)
+
+
+def storage_for_format(format):
+    """Storage class writing the database in _format_ ('json' or 'msgpack')."""
+
+    if format == 'json':
+        return AtomicJSONStorage
+    elif format == 'msgpack':
+        return MsgPackStorage
+
+    raise ValueError('Unknown database format ' + str(format))
+
+
+def _done_future():
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class BackgroundWriter:
+    """Writes database snapshots on a thread of its own, so serializing and syncing the file never blocks the event loop.
+
+    Only the latest snapshot matters: if several are submitted while the disk is busy, the older ones are skipped.
+    queue_depth is the number of submitted snapshots that have not reached the disk yet.
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self.condition = threading.Condition()
+        self.snapshot = None
+        self.futures = []
+        self.queue_depth = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='database-writer', daemon=True)
+        self.thread.start()
+
+
+    def submit(self, data):
+        """Queue _data_ for writing. Returns a concurrent.futures.Future that is done once it is on disk."""
+
+        future = Future()
+
+        with self.condition:
+            self.snapshot = data
+            self.futures.append(future)
+            self.queue_depth += 1
+            self.condition.notify()
+
+        return future
+
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.snapshot is None and not self.closed:
+                    self.condition.wait()
+
+                if self.snapshot is None:
+                    return
+
+                data, futures = self.snapshot, self.futures
+                self.snapshot = None
+                self.futures = []
+
+            try:
+                self.write(data)
+            except Exception as e:
+                log.fatal('EXCEPTION OCCURRED WHILE WRITING DATABASE:')
+                log.exception(e)
+
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(None)
+
+            with self.condition:
+                self.queue_depth -= len(futures)
+
+
+    def close(self):
+        """Write the last queued snapshot and stop the thread."""
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+        self.thread.join()
+
+
+class WriteBehindMiddleware(Middleware):
+    """Keeps the whole database in memory and only writes it to the underlying storage when flushed.
+
+    Without write-behind every write is flushed immediately (same behaviour as plain TinyDB). With write-behind,
+    writes are collected until _max_pending_writes_ is reached or flush() is called, e.g. by the bot's flush timer.
+
+    With _background_ set, flushing only hands a snapshot of the cache to a BackgroundWriter. Reads always see the cache.
+
+    Flush listeners are called when a snapshot is taken. A listener may return a function, which is called once that snapshot
+    is on disk (on the writer thread in the background case).
+
+    A failed background write marks its tables dirty again from the writer thread, so dirty_tables and _flushed_tables
+    are guarded by a lock.
+    """
+
+    def __init__(self, storage_cls, write_behind=False, max_pending_writes=100, background=False):
+        super().__init__(storage_cls)
+        self.write_behind = write_behind
+        self.max_pending_writes = max_pending_writes
+        self.background = background
+        self.writer = None
+        self.cache = None
+        self.pending_writes = 0
+        self.lock = threading.Lock()
+        self.dirty_tables = set()
+        self._flushed_tables = {}
+        self.holds = 0
+        self.flush_listeners = []
+        self.last_flush = None
+
+        # Write amplification counters, see stats()
+        self.total_writes = 0
+        self.total_flushes = 0
+        self.total_bytes_written = 0
+        self.total_flush_time = 0.0
+        self.table_writes = {}
+
+
+    def __call__(self, *args, **kwargs):
+        super().__call__(*args, **kwargs)
+
+        if self.background:
+            self.writer = BackgroundWriter(self._write_snapshot)
+
+        return self
+
+
+    def read(self):
+        if self.cache is None:
+            self.cache = self.storage.read()
+
+            if self.cache is not None:
+                # JSON turns document IDs into strings; TinyDB uses integers. Convert once so cached tables never mix both.
+                self.cache = {name: {int(doc_id): doc for doc_id, doc in table.items()} for name, table in self.cache.items()}
+
+                with self.lock:
+                    self._flushed_tables = dict(self.cache)
+
+        return self.cache
+
+
+    def write(self, data):
+        self.cache = data
+        self.pending_writes += 1
+        self.total_writes += 1
+
+        # TinyDB replaces a table's dict whenever that table is written, so a changed identity means a dirty table
+        with self.lock:
+            for name, table in data.items():
+                if self._flushed_tables.get(name) is not table:
+                    self.dirty_tables.add(name)
+                    self.table_writes[name] = self.table_writes.get(name, 0) + 1
+
+            for name in self._flushed_tables:
+                if name not in data:
+                    self.dirty_tables.add(name)
+
+        if self.holds == 0 and (not self.write_behind or self.pending_writes >= self.max_pending_writes):
+            self.flush()
+
+
+    def hold(self):
+        """Defer flushing until release() is called, so several writes end up in one physical write."""
+        self.holds += 1
+
+
+    def release(self):
+        self.holds -= 1
+
+        if self.holds == 0 and self.pending_writes > 0 and (not self.write_behind or self.pending_writes >= self.max_pending_writes):
+            self.flush()
+
+
+    def restore(self, data):
+        """Reset the cache to a previous state, e.g. to roll back a failed batch of writes. Tables are never changed in place, so a shallow copy of the cache is a complete snapshot."""
+
+        self.cache = data
+
+        with self.lock:
+            for name in set(data) | set(self._flushed_tables):
+                if self._flushed_tables.get(name) is not data.get(name):
+                    self.dirty_tables.add(name)
+
+
+    def flush(self):
+        """Write all cached changes to the underlying storage, or queue them for the background writer. Does nothing if there are no dirty tables.
+
+        Returns a concurrent.futures.Future that is done once the changes are on disk.
+        """
+
+        with self.lock:
+            if not self.dirty_tables:
+                self.pending_writes = 0
+                return self.last_flush or _done_future()
+
+            # Tables are never changed in place, so a shallow copy is a consistent snapshot even while the cache keeps changing
+            snapshot = dict(self.cache)
+            self.dirty_tables = set()
+            self._flushed_tables = snapshot
+
+        on_disk = [listener() for listener in self.flush_listeners]
+        self.pending_writes = 0
+
+        if self.writer is not None:
+            future = self.writer.submit((snapshot, on_disk))
+            future.add_done_callback(partial(self._flush_done, snapshot))
+        else:
+            future = Future()
+
+            try:
+                self._write_snapshot((snapshot, on_disk))
+            except Exception:
+                self._retry_later(snapshot)
+                raise
+
+            future.set_result(None)
+
+        self.last_flush = future
+        return future
+
+
+    def _write_snapshot(self, snapshot_and_callbacks):
+        snapshot, on_disk = snapshot_and_callbacks
+
+        start = time.perf_counter()
+        self.storage.write(snapshot)
+        self.total_flush_time += time.perf_counter() - start
+        self.total_flushes += 1
+        self.total_bytes_written += getattr(self.storage, 'last_write_size', 0)
+
+        for callback in on_disk:
+            if callback is not None:
+                callback()
+
+
+    def _flush_done(self, snapshot, future):
+        if future.exception() is not None:
+            self._retry_later(snapshot)
+
+
+    def _retry_later(self, snapshot):
+        # The snapshot did not make it to disk, so its tables are dirty again and the next flush writes them
+        with self.lock:
+            self.dirty_tables.update(snapshot)
+            self._flushed_tables = {}
+
+
+    def queue_depth(self):
+        return self.writer.queue_depth if self.writer is not None else 0
+
+
+    def close(self):
+        self.flush()
+
+        if self.writer is not None:
+            self.writer.close()
+
+        self.storage.close()
+
+
+    def stats(self):
+        """Counters describing how many logical writes were turned into how many physical writes."""
+
+        with self.lock:
+            dirty_tables = sorted(self.dirty_tables)
+
+        return {
+            'write_behind': self.write_behind,
+            'writes': self.total_writes,
+            'flushes': self.total_flushes,
+            'writes_per_flush': self.total_writes / self.total_flushes if self.total_flushes else 0,
+            'bytes_written': self.total_bytes_written,
+            'bytes_per_write': self.total_bytes_written / self.total_writes if self.total_writes else 0,
+            'flush_time': self.total_flush_time,
+            'pending_writes': self.pending_writes,
+            'queue_depth': self.queue_depth(),
+            'dirty_tables': dirty_tables,
+            'table_writes': dict(self.table_writes)
+        }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules are imported from the bot's root directory, like the bot itself does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,67 @@
+import random
+import pytest
+
+pytest.importorskip('tinydb')
+
+from database import open_database, ColumnMirror
+
+
+def expected(table, field, reverse):
+    # What a stable sort of the whole table gives, like leaderboards did before ColumnMirror kept them sorted
+    return sorted([(doc['user'], doc.get(field, 0)) for doc in table.all()], key=lambda entry: entry[1], reverse=reverse)
+
+
+def check(table, mirror, fields):
+    for field in fields:
+        assert mirror.ranked(field) == expected(table, field, True)
+        assert mirror.top(field, 10) == expected(table, field, True)[:10]
+        assert mirror.bottom(field, 10) == expected(table, field, False)[:10]
+
+        for doc in table.all()[:20]:
+            value = doc.get(field, 0)
+            assert mirror.rank(field, doc.doc_id) == (1 + sum(1 for other in table.all() if other.get(field, 0) > value), value)
+
+
+def test_bulk_updates(tmp_path):
+    database = open_database(str(tmp_path / 'economy.json'))
+    table = database.table('main_db')
+    rng = random.Random(1)
+    table.insert_multiple([{'user': 'user' + str(i), 'balance': rng.randint(0, 20), 'free': rng.randint(0, 3)} for i in range(1000)])
+    mirror = ColumnMirror(table, 'user')
+    check(table, mirror, ('balance', 'free'))
+
+    # Like the daily reset: different values for most documents, written back at once
+    documents = table.all()
+
+    for document in documents[::2]:
+        document['free'] = rng.randint(0, 3)
+        document['balance'] += 1
+
+    table.write_back(documents[::2])
+    check(table, mirror, ('balance', 'free'))
+
+    # Like the end of a season: the same values for everyone, including a field nobody had yet
+    table.update({'balance': 0, 'free': 5, 'loan': 0})
+    check(table, mirror, ('balance', 'free', 'loan'))
+
+    # Single changes after a bulk update are still kept in order
+    table.update({'balance': 3}, doc_ids=[documents[10].doc_id])
+    table.insert({'user': 'latecomer', 'balance': 3})
+    table.remove(doc_ids=[documents[20].doc_id])
+    check(table, mirror, ('balance', 'free', 'loan'))
+
+    table.remove(doc_ids=[document.doc_id for document in documents[100:400]])
+    check(table, mirror, ('balance', 'free', 'loan'))
+    database.close()
+
+
+def test_ties_list_older_documents_first(tmp_path):
+    database = open_database(str(tmp_path / 'economy.json'))
+    table = database.table('main_db')
+    table.insert_multiple([{'user': name, 'balance': 5} for name in ('a', 'b', 'c')])
+    mirror = ColumnMirror(table, 'user')
+    table.insert({'user': 'd', 'balance': 5})
+
+    assert mirror.top('balance', 4) == [('a', 5), ('b', 5), ('c', 5), ('d', 5)]
+    assert mirror.bottom('balance', 2) == [('a', 5), ('b', 5)]
+    database.close()
@@ -0,0 +1,138 @@
+import asyncio
+import itertools
+import json
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('discord')
+
+from tinydb import Query
+from conf import config
+from database import open_database
+from game_session import GameSessions
+from Cogs.accounts import Accounts
+from Cogs.trivia import Trivia
+from Cogs.horserace import Horserace
+
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self, channel, content):
+        self.id = next(self.ids)
+        self.channel = channel
+        self.content = content
+
+
+    async def edit(self, content):
+        self.content = content
+
+
+class FakeBot:
+    """Just enough of EconomyBot to run games: a database, the session registry and recorded messages."""
+
+    def __init__(self, database, bot_channel):
+        self.database = database
+        self.query = Query()
+        self.sessions = GameSessions()
+        self.bot_channel = bot_channel
+        self.cogs = {}
+        self.messages = []
+        self.errors = []
+
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+
+    async def post_message(self, channel, message_text, embed=None, priority=None, coalesce=True):
+        message = FakeMessage(channel, message_text)
+        self.messages.append(message)
+        return message
+
+
+    async def post_error(self, context, error_text, add_error_message=''):
+        self.errors.append(error_text)
+
+
+def make_context(user, channel, content):
+    author = SimpleNamespace(name=user)
+    guild = SimpleNamespace(id=config.main_server)
+    return SimpleNamespace(message=SimpleNamespace(author=author, channel=channel, guild=guild, content=content))
+
+
+def make_account(user, balance):
+    return {'user': user, 'balance': balance, 'gambling_profit': 0, 'holiday': 0, 'races': 0, 'first_place_bets': 0, 'top_three_bets': 0, 'race_winnings': 0, 'horse_bets': [0] * 10}
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    # The example data has a single horse; races need at least five
+    with open(str(tmp_path / 'gambling.json'), 'w') as gambling_config:
+        json.dump({'horse_names': ['Horse ' + str(i) for i in range(1, 11)], 'horse_emotes': [':horse:'] * 10, 'uninvited_guest_emotes': [':angry:']}, gambling_config)
+
+    monkeypatch.setattr(config, 'cogs_data_path', str(tmp_path), raising=False)
+    monkeypatch.setattr(config, 'currency_name', 'Point', raising=False)
+    monkeypatch.setattr(config, 'main_server', 1, raising=False)
+    monkeypatch.setattr(config, 'game_channel_ids', [3], raising=False)
+    monkeypatch.setattr(config, 'forbidden_characters', ['`', '@'], raising=False)
+    monkeypatch.setattr(config, 'additional_error_message', '', raising=False)
+
+    database = open_database(str(tmp_path / 'economy.json'))
+    bot = FakeBot(database, SimpleNamespace(id=2, name='bot'))
+
+    main_db = database.table('main_db')
+    main_db.insert_multiple([make_account('alice', 100), make_account('bob', 100)])
+    trivia = Trivia(database.table('trivia_table'))
+
+    for name in ('highest_total_owned', 'highest_accum_bets', 'highest_succ_bet', 'largest_race', 'amnt_races'):
+        trivia.add(name)
+
+    bot.cogs['Economy'] = SimpleNamespace(accounts=Accounts(main_db, database), main_db=main_db)
+    bot.cogs['Stats'] = SimpleNamespace(trivia=trivia)
+    bot.cogs['Gambling'] = SimpleNamespace(lock=False, lock_max_bet=0)
+
+    yield bot
+    database.close()
+
+
+def test_race_session_end_to_end(bot, monkeypatch):
+    horserace = Horserace(bot)
+    horserace.race_delay = 0
+    horserace.race_time_default = horserace.race_time_end = horserace.race_time_finish = 0
+    horserace.uninvited_chance = 0
+    bot.cogs['Horserace'] = horserace
+
+    # Bets are placed while the race waits for more bets
+    async def sleep(delay, sleep=asyncio.sleep):
+        if horserace_session() is not None and not horserace_session().closed:
+            await horserace.bet.callback(horserace, make_context('bob', channel, '!bet 20 2'), '20', '2')
+
+        await sleep(0)
+
+    def horserace_session():
+        return bot.sessions.get('horserace', channel)
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    channel = SimpleNamespace(id=3, name='games')
+    accounts = bot.cogs['Economy'].accounts
+
+    asyncio.run(horserace.horserace.callback(horserace, make_context('alice', channel, '!horserace 10 1'), '10', '1'))
+
+    assert bot.errors == []
+    assert len(bot.sessions) == 0
+
+    # Everything was posted in the race's channel: the race itself and the placements
+    assert all(message.channel is channel for message in bot.messages)
+    assert any(message.content.startswith(':checkered_flag:') for message in bot.messages)
+    assert any('The race is over' in message.content for message in bot.messages)
+    assert any('bob has bet 20' in message.content for message in bot.messages)
+
+    # Both bets were settled
+    assert bot.cogs['Stats'].trivia.value('amnt_races') == 1
+
+    for user, bet in (('alice', 10), ('bob', 20)):
+        account = accounts.get(user)
+        assert account['races'] == 1
+        assert account['balance'] - 100 == account['gambling_profit']
+        assert account['balance'] >= 100 - bet
@@ -0,0 +1,52 @@
+from journal import Journal
+
+
+def write(journal, user):
+    journal.append({'table': 'main_db', 'op': 'write', 'docs': {user: {'user': user}}})
+
+
+def test_overlapping_snapshots_keep_later_records(tmp_path):
+    journal = Journal(str(tmp_path / 'economy.journal'), sync_writes=1)
+
+    # Two snapshots underway at once, as with background writes: the first has user 1, the second users 1 and 2, user 3 is in neither
+    write(journal, '1')
+    first = journal.on_snapshot()
+    write(journal, '2')
+    second = journal.on_snapshot()
+    write(journal, '3')
+
+    first()
+    second()
+
+    raw_data = {}
+    assert journal.replay(raw_data) == 1
+    assert raw_data == {'main_db': {3: {'user': '3'}}}
+
+    # Positions stay valid after further compactions
+    third = journal.on_snapshot()
+    write(journal, '4')
+    third()
+
+    raw_data = {}
+    assert journal.replay(raw_data) == 1
+    assert raw_data == {'main_db': {4: {'user': '4'}}}
+    journal.close()
+
+
+def test_snapshots_compacted_out_of_order(tmp_path):
+    journal = Journal(str(tmp_path / 'economy.journal'), sync_writes=1)
+
+    write(journal, '1')
+    first = journal.on_snapshot()
+    write(journal, '2')
+    second = journal.on_snapshot()
+    write(journal, '3')
+
+    # The older snapshot's records are already gone, so it must not remove anything
+    second()
+    first()
+
+    raw_data = {}
+    assert journal.replay(raw_data) == 1
+    assert raw_data == {'main_db': {3: {'user': '3'}}}
+    journal.close()
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+
+discord = pytest.importorskip('discord')
+
+from outbox import Outbox
+
+
+class FailingChannel:
+    """Fails with the given HTTP statuses, then accepts messages."""
+
+    id = 1
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.attempts = 0
+        self.sent = []
+
+
+    async def send(self, text=None, embed=None):
+        self.attempts += 1
+
+        if self.statuses:
+            error = discord.errors.HTTPException.__new__(discord.errors.HTTPException)
+            error.status = self.statuses.pop(0)
+            error.response = None
+            raise error
+
+        self.sent.append(text)
+        return text
+
+
+def send(channel, *texts):
+    async def run():
+        outbox = Outbox(asyncio.get_running_loop(), rate=100, retry_delay=0.001)
+        results = await asyncio.gather(*[outbox.send(channel, text, coalesce=False) for text in texts])
+        return outbox, results
+
+    return asyncio.run(run())
+
+
+def test_client_errors_are_not_retried():
+    channel = FailingChannel(403)
+    outbox, results = send(channel, 'first', 'second')
+
+    # The failed message is dropped right away and doesn't hold up the next one
+    assert results == [None, 'second']
+    assert channel.attempts == 2
+    stats = outbox.stats()[0]
+    assert stats['dropped'] == 1
+    assert stats['retries'] == 0
+
+
+def test_server_errors_are_retried():
+    channel = FailingChannel(500, 503)
+    outbox, results = send(channel, 'first')
+
+    assert results == ['first']
+    assert channel.attempts == 3
+    assert outbox.stats()[0]['retries'] == 2
@@ -0,0 +1,49 @@
+import threading
+import pytest
+
+pytest.importorskip('tinydb')
+
+from tinydb.storages import MemoryStorage
+from storage import WriteBehindMiddleware
+
+
+class FlakyStorage(MemoryStorage):
+    """Fails to write while _failing_ is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = True
+
+
+    def write(self, data):
+        if self.failing:
+            raise OSError('disk full')
+
+        super().write(data)
+
+
+def wait(future):
+    # Done callbacks run in order, so once this one has run the middleware's own callback has too
+    done = threading.Event()
+    future.add_done_callback(lambda future: done.set())
+    assert done.wait(5)
+
+
+def test_failed_background_write_marks_tables_dirty():
+    middleware = WriteBehindMiddleware(FlakyStorage, write_behind=True, background=True)()
+    middleware.read()
+    middleware.write({'main_db': {1: {'user': 'alice'}}, 'trivia_table': {}})
+
+    future = middleware.flush()
+    wait(future)
+    assert isinstance(future.exception(), OSError)
+    assert middleware.stats()['dirty_tables'] == ['main_db', 'trivia_table']
+
+    # The next flush writes the tables again
+    middleware.storage.failing = False
+    future = middleware.flush()
+    wait(future)
+    assert future.exception() is None
+    assert middleware.stats()['dirty_tables'] == []
+    assert middleware.storage.read() == {'main_db': {1: {'user': 'alice'}}, 'trivia_table': {}}
+    middleware.close()
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('tinydb')
+
+from database import open_database
+from Cogs.trivia import Trivia
+
+
+def test_rolled_back_batch_undoes_changes(tmp_path):
+    database = open_database(str(tmp_path / 'economy.json'))
+    trivia = Trivia(database.table('trivia_table'), flush_changes=2)
+    trivia.add('highest_duel')
+    trivia.record('highest_duel', 10, 'alice', 'bob')
+    trivia.flush()
+
+    with pytest.raises(ZeroDivisionError):
+        with database.batch():
+            # The second change flushes automatically, inside the batch
+            trivia.add('amnt_races')
+            trivia.record('highest_duel', 50, 'carol', 'dave')
+            1 / 0
+
+    assert trivia.get('highest_duel')['value'] == 10
+    assert trivia.get('amnt_races') is None
+    assert not trivia.dirty
+
+    # Entries added again after the rollback are written as new documents
+    trivia.add('amnt_races')
+    trivia.increment('amnt_races')
+    trivia.flush()
+    trivia.reload()
+    assert trivia.value('amnt_races') == 1
+    assert len(database.table('trivia_table')) == 2
+    database.close()